@@ -3,6 +3,7 @@
 # import zone 
 import logging
 import os
+import threading
 from typing import Annotated, Optional
 import vtk
 import qt
@@ -17,6 +18,9 @@ from slicer.parameterNodeWrapper import (
     WithinRange,
 )
 from slicer import vtkMRMLScalarVolumeNode
+import CrohnBOOSTLib
+import CrohnBOOSTLib.model
+from CrohnBOOSTLib import BackgroundTask
 # 
 #################################################################################################################################
 #################################################################################################################################
@@ -191,6 +195,23 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.horizontalSlider.setMaximum(99)
         self.ui.horizontalSlider.setValue(50)  # Default value
         self.ui.horizontalSlider.valueChanged.connect(self.onSliderValueChanged)
+
+        # Live preview: slider moves are debounced, then the current Red slice is
+        # segmented first and the full volume refreshed right after
+        self._livePreviewGeneration = 0
+        self._livePreviewTimer = qt.QTimer()
+        self._livePreviewTimer.setSingleShot(True)
+        self._livePreviewTimer.setInterval(300)
+        self._livePreviewTimer.connect('timeout()', self._runLivePreview)
+
+        # Background computations (BackgroundTask) are polled from this timer, on the main thread
+        self._backgroundTask = None
+        self._backgroundTaskOnFinished = None
+        self._backgroundProgressDialog = None
+        self._pendingTask = None
+        self._taskTimer = qt.QTimer()
+        self._taskTimer.setInterval(100)
+        self._taskTimer.connect('timeout()', self._pollBackgroundTask)
         
         # Buttons configuration for fat segmentation
         self.ui.fatPointsButton.connect('clicked(bool)', self.onFatPointsButtonClicked)
@@ -212,6 +233,42 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         if hasattr(self.ui, 'aiSegmentButton'):
             self.ui.aiSegmentButton.connect('clicked(bool)', self.onAISegmentButtonClicked)
 
+        # Out-of-process AI inference: the job is polled from this timer, on the main thread
+        self._aiJobs = []
+        self._aiPending = []
+        self._aiSubmitArgs = None
+        self._aiQueueTask = None
+        self._aiTimer = qt.QTimer()
+        self._aiTimer.setInterval(200)
+        self._aiTimer.connect('timeout()', self._pollAIJobs)
+        if hasattr(self.ui, 'aiWorkerCheckBox'):
+            self.ui.aiWorkerCheckBox.checked = str(qt.QSettings().value(self.logic.AI_WORKER_SETTING, False)).lower() == 'true'
+            self.ui.aiWorkerCheckBox.connect('toggled(bool)', self.onAIWorkerToggled)
+        if hasattr(self.ui, 'aiWarmUpCheckBox'):
+            self.ui.aiWarmUpCheckBox.checked = str(qt.QSettings().value(self.logic.AI_WARMUP_SETTING, False)).lower() == 'true'
+            self.ui.aiWarmUpCheckBox.connect('toggled(bool)', self.onAIWarmUpToggled)
+
+        # AI queue: several volumes with a single loaded model
+        if hasattr(self.ui, 'aiQueueSelector'):
+            self.ui.aiQueueSelector.setMRMLScene(slicer.mrmlScene)
+            self.ui.aiQueueButton.connect('clicked(bool)', self.onAIQueueButtonClicked)
+            self.ui.aiQueueFolderButton.connect('clicked(bool)', self.onAIQueueFolderButtonClicked)
+
+        # AI inference region (whole volume or a padded crop)
+        if hasattr(self.ui, 'aiRegionComboBox'):
+            self.ui.aiRoiSelector.setMRMLScene(slicer.mrmlScene)
+            self.ui.aiRegionComboBox.connect('currentIndexChanged(int)', self.onAIRegionChanged)
+            self.onAIRegionChanged(self.ui.aiRegionComboBox.currentIndex)
+
+        # Optimised CPU inference settings, kept in the application settings
+        if hasattr(self.ui, 'aiCpuOptimizedCheckBox'):
+            self._loadCpuSettings()
+            self.ui.aiCpuOptimizedCheckBox.connect('toggled(bool)', self._saveCpuSettings)
+            self.ui.aiCpuThreadsSpinBox.connect('valueChanged(int)', self._saveCpuSettings)
+            self.ui.aiCpuPrecisionComboBox.connect('currentIndexChanged(int)', self._saveCpuSettings)
+            self.ui.aiChannelsLastCheckBox.connect('toggled(bool)', self._saveCpuSettings)
+            self.ui.aiCpuCompareButton.connect('clicked(bool)', self.onAICpuCompareButtonClicked)
+
         # Create a hidden segment editor widget for Paint/Erase tools
         self._segmentEditorWidget = slicer.qMRMLSegmentEditorWidget()
         self._segmentEditorWidget.setMRMLScene(slicer.mrmlScene)
@@ -237,15 +294,198 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         """Called whenever the slider's value changes."""
         threshold_factor = value / 100.0
         print(f"Expansion factor set to: {threshold_factor:.2f}")
+        self._scheduleLivePreview()
 
     def onRadiusSliderValueChanged(self, value): 
         print(f"Estimated intestinal radius: {value} mm")
         if hasattr(self, '_current_segment_nodes') and self._current_segment_nodes:
             self._current_segment_nodes['rayon_estime'] = value 
+        self._scheduleLivePreview()
+
+    def _scheduleLivePreview(self):
+        """(Re)start the debounce timer; any preview still running becomes stale."""
+        if not self._current_segment_nodes or not self.ui.livePreviewCheckBox.checked:
+            return
+        self._livePreviewGeneration += 1
+        if self._backgroundTask is not None and self._backgroundProgressDialog is None:
+            self._backgroundTask.cancel()
+        self._livePreviewTimer.start()
+
+    def _redSliceIndex(self, volumeNode):
+        """
+        k index (arrayFromVolume axis 0) of the Red slice in volumeNode, or None if the slice
+        is outside the volume or is not a k plane of it (e.g. coronal acquisition, oblique view).
+        """
+        sliceWidget = slicer.app.layoutManager().sliceWidget('Red')
+        if sliceWidget is None:
+            return None
+        sliceToRAS = sliceWidget.mrmlSliceNode().GetSliceToRAS()
+        center_ras = [sliceToRAS.GetElement(r, 3) for r in range(3)]
+        normal_ras = [sliceToRAS.GetElement(r, 2) for r in range(3)]
+
+        rasToIJK = vtk.vtkMatrix4x4()
+        volumeNode.GetRASToIJKMatrix(rasToIJK)
+        # Slice normal in the volume axes, in mm: it must be the k axis for the plane to be array[k]
+        normal_ijk = np.array(rasToIJK.MultiplyPoint(normal_ras + [0.0])[:3]) * np.array(volumeNode.GetSpacing())
+        if abs(normal_ijk[2]) < 0.999 * np.linalg.norm(normal_ijk):
+            print("Live preview: the Red slice is not a k plane of the volume, full update only")
+            return None
+
+        ijk = rasToIJK.MultiplyPoint(center_ras + [1.0])
+        k = int(round(ijk[2]))
+        if not 0 <= k < volumeNode.GetImageData().GetDimensions()[2]:
+            return None
+        return k
+
+    def _runLivePreview(self):
+        """
+        Segment the visible slice only on a BackgroundTask, merged into the last full result,
+        then start the full-volume update. Slider moves meanwhile bump the generation and
+        cancel both.
+        """
+        nodes = self._current_segment_nodes
+        if not nodes or self._backgroundProgressDialog is not None:
+            return
+        generation = self._livePreviewGeneration
+        inputVolume = nodes['volume']
+        segmentationNode = nodes['segmentation']
+        threshold_factor = self.ui.horizontalSlider.value / 100.0
+        rayon_estime = self.ui.radiusSlider.value
+
+        slice_index = self._redSliceIndex(inputVolume)
+        if slice_index is None or self.logic.dernierMasqueLesion is None:
+            self._runLivePreviewFull(generation)
+            return
+
+        # Node data is read here, on the main thread; the task only sees NumPy arrays
+        volume = self.logic.donneesVolume(inputVolume)
+        centerline_ras = self.logic._pointsToArray(nodes['centerline_points'])
+        wall_ras = self.logic._pointsToArray(nodes['wall_points'])
+
+        def compute(task):
+            return self.logic.calculerApercuCoupe(volume, centerline_ras, wall_ras,
+                                                  threshold_factor, rayon_estime, slice_index, task=task)
+
+        def finished(preview):
+            if generation != self._livePreviewGeneration or self.logic.dernierMasqueLesion is None:
+                return
+            full_mask = self.logic.dernierMasqueLesion.copy()
+            full_mask[slice_index] = preview
+            self.logic.importerSegmentationLesion(segmentationNode, inputVolume, full_mask)
+            qt.QTimer.singleShot(0, lambda: self._runLivePreviewFull(generation))
+
+        self._startBackgroundTask(compute, finished)
+
+    def _runLivePreviewFull(self, generation):
+        """Full-volume update following a slice preview, skipped if the sliders moved since."""
+        if not self._current_segment_nodes or generation != self._livePreviewGeneration:
+            return
+        self._startLesionSegmentation(showProgress=False, generation=generation)
+
+    def _startBackgroundTask(self, function, onFinished, title=None, maximum=100):
+        """
+        Run function(task) on a BackgroundTask thread; onFinished(result) is called on the
+        main thread unless the task failed or was cancelled. With a title, a progress dialog
+        with a cancel button is shown. Only one task runs at a time: a running task is
+        cancelled and the new one starts as soon as it has stopped.
+        """
+        if self._backgroundTask is not None:
+            self._backgroundTask.cancel()
+            self._pendingTask = (function, onFinished, title, maximum)
+            return
+
+        self._backgroundTaskOnFinished = onFinished
+        self._backgroundProgressDialog = None
+        if title:
+            self._backgroundProgressDialog = slicer.util.createProgressDialog(
+                windowTitle=title, labelText=title, maximum=maximum, cancelButton=True)
+        self._backgroundTask = BackgroundTask(function, maximum=maximum).start()
+        self._taskTimer.start()
+
+    def _pollBackgroundTask(self):
+        """Forward progress/cancellation between the dialog and the task; finish on the main thread."""
+        task = self._backgroundTask
+        if task is None:
+            self._taskTimer.stop()
+            return
+        dialog = self._backgroundProgressDialog
+        if dialog is not None:
+            if dialog.wasCanceled:
+                task.cancel()
+            dialog.setValue(task.value)
+            if task.text:
+                dialog.setLabelText(task.text)
+        if not task.finished:
+            return
+
+        self._taskTimer.stop()
+        if dialog is not None:
+            dialog.close()
+        onFinished = self._backgroundTaskOnFinished
+        self._backgroundTask = None
+        self._backgroundTaskOnFinished = None
+        self._backgroundProgressDialog = None
+
+        pending, self._pendingTask = self._pendingTask, None
+        if pending is not None:
+            self._startBackgroundTask(*pending)
+        elif task.error is not None:
+            slicer.util.errorDisplay(f"Computation failed: {task.error}")
+        elif not task.cancelled:
+            onFinished(task.result)
+
+    def _startLesionSegmentation(self, showProgress=True, generation=None, onSuccess=None):
+        """
+        Compute the lesion masks for the current nodes and sliders on a BackgroundTask,
+        then import them into the segmentation node. generation: live preview counter
+        the result is discarded for if the sliders moved in the meantime.
+        """
+        nodes = self._current_segment_nodes
+        inputVolume = nodes['volume']
+        segmentationNode = nodes['segmentation']
+        threshold_factor = self.ui.horizontalSlider.value / 100.0
+        rayon_estime = self.ui.radiusSlider.value
+
+        # Node data is read here, on the main thread; the task only sees NumPy arrays
+        # (snapshots of the curves, so editing them meanwhile is harmless)
+        volume = self.logic.donneesVolume(inputVolume)
+        centerline_ras = self.logic._pointsToArray(nodes['centerline_points'])
+        wall_ras = self.logic._pointsToArray(nodes['wall_points'])
+
+        def compute(task):
+            return self.logic.calculerSegmentationLesion(volume, centerline_ras, wall_ras,
+                                                         threshold_factor, rayon_estime, task=task)
+
+        def finished(result):
+            if generation is not None and generation != self._livePreviewGeneration:
+                return
+            mask, full_mask_final = result
+            with slicer.util.tryWithErrorDisplay("Segmentation update failed", waitCursor=True):
+                if not self.logic.appliquerSegmentationLesion(segmentationNode, inputVolume, mask, full_mask_final):
+                    slicer.util.errorDisplay("The segmentation failed for an unknown reason.")
+                    return
+                if onSuccess is not None:
+                    onSuccess()
+                self._updateLesionVolume(segmentationNode, inputVolume)
+
+        self._startBackgroundTask(compute, finished,
+                                  title="Lesion segmentation" if showProgress else None,
+                                  maximum=len(self.logic.LESION_STAGE_INPUTS))
 
     def cleanup(self) -> None:
         """Called when the application closes and the module widget is destroyed."""
         self.removeObservers()
+        if self.logic is not None:
+            self.logic.libererPredicteur()
+            self.logic.arreterWorker()
+        if getattr(self, '_aiTimer', None) is not None:
+            self._aiTimer.stop()
+        if getattr(self, '_aiQueueTask', None) is not None:
+            self._aiQueueTask.cancel()
+        if getattr(self, '_backgroundTask', None) is not None:
+            self._pendingTask = None
+            self._backgroundTask.cancel()
+            self._taskTimer.stop()
         if hasattr(self, '_segmentEditorWidget'):
             self._segmentEditorWidget = None
         if hasattr(self, '_segmentEditorNode') and self._segmentEditorNode:
@@ -254,6 +494,9 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def enter(self) -> None:
         """Called each time the user opens this module."""
         self.initializeParameterNode()
+        if hasattr(self.ui, 'aiWarmUpCheckBox') and self.ui.aiWarmUpCheckBox.checked:
+            if self.logic.prechaufferAI(self._cpuOptions(), useWorker=self.ui.aiWorkerCheckBox.checked):
+                self.ui.aiStatusLabel.text = "Loading the AI model in the background..."
 
     def exit(self) -> None:
         """Called each time the user opens a different module."""
@@ -304,11 +547,24 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             markupsNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode", "Centerline")
             markupsNode.CreateDefaultDisplayNodes()
 
+        self._observeCenterline(markupsNode)
+
         interactionNode = slicer.app.applicationLogic().GetInteractionNode()
         interactionNode.SetCurrentInteractionMode(slicer.vtkMRMLInteractionNode.Place)
         interactionNode.SetPlaceModePersistence(1)
         slicer.modules.markups.logic().SetActiveListID(markupsNode)
 
+    def _observeCenterline(self, markupsNode):
+        """Invalidate the cached centerline distance field whenever the curve points change."""
+        for event in (slicer.vtkMRMLMarkupsNode.PointAddedEvent,
+                      slicer.vtkMRMLMarkupsNode.PointRemovedEvent,
+                      slicer.vtkMRMLMarkupsNode.PointModifiedEvent):
+            if not self.hasObserver(markupsNode, event, self.onCenterlineModified):
+                self.addObserver(markupsNode, event, self.onCenterlineModified)
+
+    def onCenterlineModified(self, caller, event):
+        self.logic.invaliderChampDistance()
+
     def onSegmentButtonClicked(self):
         inputVolume = self.ui.inputSelector.currentNode()
         if not inputVolume:
@@ -333,6 +589,7 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         except slicer.util.MRMLNodeNotFoundException:
             slicer.util.errorDisplay("Draw the centerline before segmenting")
             return
+        self._observeCenterline(markupsNode)
                 
         segmentationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
         segmentationNode.SetName('Crohn_Segmentation')
@@ -347,30 +604,39 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             return
         
         rayon_estime = self.ui.radiusSlider.value
+        volume = self.logic.donneesVolume(inputVolume)
+        centerline_ras = self.logic._pointsToArray(centerline_points)
 
-        wall_points = self.logic.detecterPointsParoi(markupsNode, inputVolume, rayon_estime)
-        if wall_points is None:
-            slicer.util.errorDisplay("La detection des points de la paroi a echoue")
-            return
+        def wallPointsDetected(wall_ras):
+            if wall_ras is None:
+                slicer.util.errorDisplay("La detection des points de la paroi a echoue")
+                return
+            wall_points = self.logic._arrayToPoints(wall_ras)
+
+            self._current_segment_nodes = {
+                'markups': markupsNode,
+                'volume': inputVolume,
+                'segmentation': segmentationNode,
+                'wall_points': wall_points,
+                'centerline_points': centerline_points,
+                'rayon_estime': rayon_estime
+            }
+            
+            threshold_factor = self.ui.horizontalSlider.value / 100.0
+            print(f"Segmentation expansion factor : {threshold_factor:.2f}")
 
-        self._current_segment_nodes = {
-            'markups': markupsNode,
-            'volume': inputVolume,
-            'segmentation': segmentationNode,
-            'wall_points': wall_points,
-            'centerline_points': centerline_points,
-            'rayon_estime': rayon_estime
-        }
-        
-        threshold_factor = self.ui.horizontalSlider.value / 100.0
-        print(f"Segmentation expansion factor : {threshold_factor:.2f}")
-        
-        if self.logic.mettreAJourSegmentation(inputVolume, centerline_points, wall_points, segmentationNode, threshold_factor, rayon_estime):
-            segmentationDisplayNode = segmentationNode.GetDisplayNode()
-            segmentationDisplayNode.SetOpacity(0.5)
-            self._updateLesionVolume(segmentationNode, inputVolume)
-        else:
-            slicer.util.errorDisplay("The segmentation failed for an unknown reason.")
+            self._startLesionSegmentation(
+                onSuccess=lambda: segmentationNode.GetDisplayNode().SetOpacity(0.5))
+
+        def detect(task):
+            wall_ras = self.logic.calculerPointsParoiRAS(centerline_ras, volume, rayon_estime, task=task)
+            if wall_ras is not None:
+                # The centerline and wall points are final: build the distance field now
+                self.logic.preparerChampDistance(volume, centerline_ras, wall_ras, rayon_estime, task=task)
+            return wall_ras
+
+        self._startBackgroundTask(detect, wallPointsDetected, title="Wall detection",
+                                  maximum=max(len(centerline_ras) - 1, 1))
 
     def onApplySegmentationButton(self):
         if not self._current_segment_nodes:
@@ -381,24 +647,11 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
         print(f"Applying the segmentation with factor : {threshold_factor:.2f}")
 
-        segmentationNode = self._current_segment_nodes['segmentation']
-        
         self._current_segment_nodes['rayon_estime'] = rayon_estime
 
-        segmentId = segmentationNode.GetSegmentation().GetSegmentIdBySegmentName("Paroi_Intestinale")
-        if segmentId:
-            segmentationNode.GetSegmentation().RemoveSegment(segmentId)
-        
-        segmentationNode.GetSegmentation().AddEmptySegment("Paroi_Intestinale")
-        
-        inputVolume = self._current_segment_nodes['volume']
-        wall_points = self._current_segment_nodes['wall_points']
-        centerline_points = self._current_segment_nodes['centerline_points']
-        
-        with slicer.util.tryWithErrorDisplay("Segmentation update failed", waitCursor=True):
-            self.logic.mettreAJourSegmentation(inputVolume, centerline_points, wall_points, 
-                                            segmentationNode, threshold_factor)
-            self._updateLesionVolume(segmentationNode, inputVolume)
+        # The Paroi_Intestinale segment is replaced once the task has succeeded
+        # (importerSegmentationLesion): a cancelled or failed run keeps the current one
+        self._startLesionSegmentation()
 
     def onSaveSegButtonClicked(self):
         try:
@@ -657,26 +910,23 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.aiSegmentButton.enabled = False
 
         try:
-            self.ui.aiStatusLabel.text = "Checking AI dependencies..."
-            self.ui.aiProgressBar.value = 10
-            slicer.app.processEvents()
-            if not self.logic.ensureAIDependencies():
-                self.ui.aiStatusLabel.text = "❌ Failed to install dependencies"
-                return
-
-            self.ui.aiStatusLabel.text = "Checking AI model..."
-            self.ui.aiProgressBar.value = 30
-            slicer.app.processEvents()
-            model_path = self.logic.ensureModelDownloaded()
+            model_path = self._checkAIReady()
             if not model_path:
-                self.ui.aiStatusLabel.text = "❌ Failed to download model"
                 return
 
             self.ui.aiStatusLabel.text = "🧠 AI segmentation in progress..."
             self.ui.aiProgressBar.value = 50
             slicer.app.processEvents()
 
-            segmentationNode = self.logic.runNNUNetPrediction(inputVolume, model_path)
+            region, regionNode = self._aiRegion()
+            if self.ui.aiWorkerCheckBox.checked:
+                # Out of process: the viewer stays responsive, _pollAIJobs finishes the job
+                self._startAIJobs(pending=[inputVolume], submitArgs=(model_path, self._cpuOptions(), region, regionNode))
+                return
+
+            with CrohnBOOSTLib.span('ai.inference', volume=inputVolume.GetName()):
+                segmentationNode = self.logic.runNNUNetPrediction(inputVolume, model_path, self._cpuOptions(),
+                                                                  region, regionNode)
             self.ui.aiProgressBar.value = 90
 
             if segmentationNode:
@@ -692,7 +942,259 @@ class CrohnBOOSTWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             import traceback
             traceback.print_exc()
         finally:
-            self.ui.aiSegmentButton.enabled = True
+            self.ui.aiSegmentButton.enabled = not self._aiTimer.isActive()
+
+    def _startAIJobs(self, jobs=None, pending=None, submitArgs=None, task=None):
+        """
+        Follow AI jobs from the main thread: in-process InferenceJobs (with their queue task),
+        and/or volumes to submit to the worker (pending, with the soumettreInferenceAI arguments).
+        """
+        self._aiJobs = [[job, node, False] for job, node in (jobs or [])]
+        self._aiPending = list(pending or [])
+        self._aiSubmitArgs = submitArgs
+        self._aiQueueTask = task
+        self.ui.aiSegmentButton.enabled = False
+        if hasattr(self.ui, 'aiQueueButton'):
+            self.ui.aiQueueButton.enabled = False
+        self._aiTimer.start()
+
+    def _pollAIJobs(self):
+        """
+        Submit the next queued volumes to the worker (two in flight: one running, one waiting
+        in shared memory) and import each segmentation as soon as its job is finished.
+        """
+        while self._aiPending and sum(not entry[0].finished for entry in self._aiJobs) < 2:
+            node = self._aiPending.pop(0)
+            try:
+                job = self.logic.soumettreInferenceAI(node, *self._aiSubmitArgs)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                job = CrohnBOOSTLib.InferenceJob(-1)
+                job.finish(error=e)
+            self._aiJobs.append([job, node, False])
+
+        task = self._aiQueueTask
+        if task is not None and task.finished:
+            for job, _, _ in self._aiJobs:
+                if not job.finished:
+                    job.finish(error=task.error or RuntimeError("AI queue stopped"))
+
+        total = len(self._aiJobs) + len(self._aiPending)
+        for entry in self._aiJobs:
+            job, node, imported = entry
+            if imported or not job.finished:
+                continue
+            entry[2] = True
+            self._importAIResult(job, node, 'Crohn_Segmentation' if total == 1
+                                 else f"Crohn_Segmentation_{node.GetName()}")
+
+        done = sum(entry[2] for entry in self._aiJobs)
+        running = next((entry[0] for entry in self._aiJobs if not entry[0].finished), None)
+        if total == 1 and running is not None:
+            self.ui.aiProgressBar.value = 50 + int(0.4 * running.value)
+            if running.text:
+                self.ui.aiStatusLabel.text = running.text
+        elif total > 1:
+            self.ui.aiProgressBar.value = int(100 * done / total)
+            if done < total:
+                self.ui.aiStatusLabel.text = f"🧠 AI queue: {done}/{total} volumes done..."
+        if done < total:
+            return
+
+        self._aiTimer.stop()
+        failed = sum(entry[0].error is not None for entry in self._aiJobs)
+        if total > 1:
+            self.ui.aiStatusLabel.text = (f"✅ AI queue: {total - failed}/{total} volumes segmented"
+                                          + (f" ({failed} failed, see the Python console)" if failed else ""))
+        self._aiJobs = []
+        self._aiQueueTask = None
+        self.ui.aiSegmentButton.enabled = True
+        if hasattr(self.ui, 'aiQueueButton'):
+            self.ui.aiQueueButton.enabled = True
+
+    def _importAIResult(self, job, inputVolume, name):
+        if job.error is not None:
+            print(f"AI segmentation of {inputVolume.GetName()} failed: {job.error}")
+            self.ui.aiStatusLabel.text = f"❌ AI segmentation failed: {job.error}"
+            return
+        try:
+            segmentationNode = self.logic.importerPredictionAI(inputVolume, job.result, name)
+        except Exception as e:
+            job.error = e
+            self.ui.aiStatusLabel.text = f"❌ Error: {str(e)}"
+            import traceback
+            traceback.print_exc()
+            return
+        job.result = None
+        segmentationNode.GetDisplayNode().SetOpacity(0.5)
+        self.ui.aiStatusLabel.text = (f"✅ AI segmentation complete ({job.info.get('device', '')}"
+                                      + (f", {job.info['seconds']:.0f} s)" if 'seconds' in job.info else ")"))
+        self.ui.aiProgressBar.value = 100
+        self._updateLesionVolume(segmentationNode, inputVolume)
+
+    def _checkAIReady(self):
+        """Dependencies and model, with status updates; the model folder, or None."""
+        self.ui.aiStatusLabel.text = "Checking AI dependencies..."
+        self.ui.aiProgressBar.value = 10
+        slicer.app.processEvents()
+        if not self.logic.ensureAIDependencies():
+            self.ui.aiStatusLabel.text = "❌ Failed to install dependencies"
+            return None
+
+        self.ui.aiStatusLabel.text = "Checking AI model..."
+        self.ui.aiProgressBar.value = 30
+        slicer.app.processEvents()
+        model_path = self.logic.ensureModelDownloaded()
+        if not model_path:
+            self.ui.aiStatusLabel.text = "❌ Failed to download model"
+        return model_path
+
+    def onAIQueueButtonClicked(self):
+        """Segment every volume checked in the AI queue with a single loaded model."""
+        volumes = list(self.ui.aiQueueSelector.checkedNodes())
+        if not volumes:
+            slicer.util.errorDisplay("Please check the volumes to segment in the AI queue.")
+            return
+
+        self.ui.aiProgressBar.visible = True
+        self.ui.aiProgressBar.value = 0
+        self.ui.aiQueueButton.enabled = False
+        started = False
+        try:
+            model_path = self._checkAIReady()
+            if not model_path:
+                return
+            region, regionNode = self._aiRegion()
+            self.ui.aiStatusLabel.text = f"🧠 AI queue: 0/{len(volumes)} volumes done..."
+            slicer.app.processEvents()
+            if self.ui.aiWorkerCheckBox.checked:
+                self._startAIJobs(pending=volumes, submitArgs=(model_path, self._cpuOptions(), region, regionNode))
+            else:
+                task, jobs = self.logic.lancerFileInferenceAI(volumes, model_path, self._cpuOptions(),
+                                                              region, regionNode)
+                self._startAIJobs(jobs=list(zip(jobs, volumes)), task=task)
+            started = True
+        except Exception as e:
+            self.ui.aiStatusLabel.text = f"❌ Error: {str(e)}"
+            import traceback
+            traceback.print_exc()
+        finally:
+            if not started:
+                self.ui.aiQueueButton.enabled = True
+
+    def onAIQueueFolderButtonClicked(self):
+        """Load every _W image of a folder and check it in the AI queue."""
+        folder = qt.QFileDialog.getExistingDirectory(None, "Folder of _W images")
+        if not folder:
+            return
+        import glob
+        paths = sorted(path for pattern in ('*_W.nii.gz', '*_W.nii', '*_W.nrrd')
+                       for path in glob.glob(os.path.join(folder, pattern)))
+        if not paths:
+            slicer.util.warningDisplay(f"No _W image (.nii.gz, .nii, .nrrd) in {folder}")
+            return
+        for path in paths:
+            try:
+                node = slicer.util.loadVolume(path)
+            except RuntimeError as e:
+                print(f"Could not load {path}: {e}")
+                continue
+            self.ui.aiQueueSelector.setCheckState(node, qt.Qt.Checked)
+        print(f"AI queue: {len(paths)} _W image(s) loaded from {folder}")
+
+    def onAIWarmUpToggled(self, checked):
+        qt.QSettings().setValue(self.logic.AI_WARMUP_SETTING, checked)
+
+    def onAIWorkerToggled(self, checked):
+        qt.QSettings().setValue(self.logic.AI_WORKER_SETTING, checked)
+        if not checked:
+            self.logic.arreterWorker()
+
+    def _aiRegion(self):
+        """(region, regionNode) of the AI inference crop selected in the AI tab."""
+        if not hasattr(self.ui, 'aiRegionComboBox'):
+            return 'volume', None
+        region = CrohnBOOSTLib.AI_REGIONS[self.ui.aiRegionComboBox.currentIndex]
+        if region == 'centerline':
+            try:
+                return region, slicer.util.getNode('Centerline')
+            except slicer.util.MRMLNodeNotFoundException:
+                return region, None
+        if region == 'markups_roi':
+            return region, self.ui.aiRoiSelector.currentNode()
+        return region, None
+
+    def onAIRegionChanged(self, index):
+        self.ui.aiRoiSelector.enabled = CrohnBOOSTLib.AI_REGIONS[index] == 'markups_roi'
+
+    def _cpuOptions(self, force=False):
+        """OptionsCPU from the AI tab, or None when the optimised CPU mode is off (unless force)."""
+        if not hasattr(self.ui, 'aiCpuOptimizedCheckBox'):
+            return None
+        if not (force or self.ui.aiCpuOptimizedCheckBox.checked):
+            return None
+        return CrohnBOOSTLib.OptionsCPU(
+            threads=self.ui.aiCpuThreadsSpinBox.value,
+            precision=CrohnBOOSTLib.CPU_PRECISIONS[self.ui.aiCpuPrecisionComboBox.currentIndex],
+            channels_last=self.ui.aiChannelsLastCheckBox.checked)
+
+    def _loadCpuSettings(self):
+        settings = qt.QSettings()
+        def value(name, default):
+            v = settings.value(self.logic.AI_CPU_SETTING + name, default)
+            return v if v is not None else default
+        self.ui.aiCpuOptimizedCheckBox.checked = str(value("Enabled", False)).lower() == 'true'
+        self.ui.aiCpuThreadsSpinBox.value = int(value("Threads", 0))
+        precision = str(value("Precision", 'fp32'))
+        if precision in CrohnBOOSTLib.CPU_PRECISIONS:
+            self.ui.aiCpuPrecisionComboBox.currentIndex = CrohnBOOSTLib.CPU_PRECISIONS.index(precision)
+        self.ui.aiChannelsLastCheckBox.checked = str(value("ChannelsLast", False)).lower() == 'true'
+
+    def _saveCpuSettings(self, *args):
+        settings = qt.QSettings()
+        settings.setValue(self.logic.AI_CPU_SETTING + "Enabled", self.ui.aiCpuOptimizedCheckBox.checked)
+        settings.setValue(self.logic.AI_CPU_SETTING + "Threads", self.ui.aiCpuThreadsSpinBox.value)
+        settings.setValue(self.logic.AI_CPU_SETTING + "Precision",
+                          CrohnBOOSTLib.CPU_PRECISIONS[self.ui.aiCpuPrecisionComboBox.currentIndex])
+        settings.setValue(self.logic.AI_CPU_SETTING + "ChannelsLast", self.ui.aiChannelsLastCheckBox.checked)
+
+    def onAICpuCompareButtonClicked(self):
+        """Time the standard and optimised CPU paths on the selected volume and report speed-up and Dice."""
+        inputVolume = self.ui.inputSelector.currentNode()
+        if not inputVolume:
+            slicer.util.errorDisplay("Please select an input volume.")
+            return
+
+        try:
+            model_path = self._checkAIReady()
+            if not model_path:
+                return
+            options = self._cpuOptions(force=True)
+            region, regionNode = self._aiRegion()
+            # Node data and the crop are read here, on the main thread; the task only runs the predictions
+            volume = self.logic.donneesVolume(inputVolume)
+            roi = None
+            if region != 'volume':
+                roi = self.logic.regionInference(volume, region, regionNode,
+                                                 CrohnBOOSTLib.margePatchModele(model_path))
+        except Exception as e:
+            self.ui.aiStatusLabel.text = f"❌ Error: {str(e)}"
+            import traceback
+            traceback.print_exc()
+            return
+
+        def compute(task):
+            return self.logic.comparerInferenceCPU(volume, model_path, options, roi, task=task)
+
+        def finished(result):
+            self.ui.aiStatusLabel.text = (
+                f"Optimised CPU: {result['speedup']:.2f}x "
+                f"({result['standard_s']:.0f} s → {result['optimise_s']:.0f} s), "
+                f"Dice vs standard {result['dice']:.3f}")
+
+        self.ui.aiStatusLabel.text = "⏱ Comparing CPU inference modes (warm-up and timed prediction each)..."
+        self._startBackgroundTask(compute, finished, title="Comparing CPU inference modes")
 
     def _refreshVolumes(self):
         """Recalculate and display volumes for any existing segmentations."""
@@ -729,9 +1231,45 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
     https://github.com/Slicer/Slicer/blob/main/Base/Python/slicer/ScriptedLoadableModule.py
     """
     import numpy as np
-    def __init__(self) -> None:
+
+    # Lesion pipeline stage graph (see CrohnBOOSTLib.lesion)
+    LESION_STAGE_INPUTS = CrohnBOOSTLib.LESION_STAGE_INPUTS
+
+    # Application setting: minutes before an unused nnU-Net predictor is released (0 = keep it)
+    AI_IDLE_SETTING = "CrohnBOOST/AIPredictorIdleMinutes"
+    AI_IDLE_DEFAULT_MINUTES = 10
+
+    # Folder the AI model is downloaded to
+    MODEL_DIR = os.path.join(os.path.expanduser("~"), ".crohnboost", "models",
+                             "nnUNetTrainerRanger_250epochs__nnUNetPlans__3d_fullres")
+
+    # Application settings: cached result of the AI dependency probe, and opt-in warm-up on module entry
+    AI_AVAILABLE_SETTING = "CrohnBOOST/AIDependenciesAvailable"
+    AI_WARMUP_SETTING = "CrohnBOOST/AIWarmUp"
+
+    # Application setting: run AI inference in the out-of-process worker (CrohnBOOSTLib.InferenceWorker)
+    AI_WORKER_SETTING = "CrohnBOOST/AIWorker"
+
+    # Application settings prefix of the optimised CPU inference mode (Enabled, Threads, Precision, ChannelsLast)
+    AI_CPU_SETTING = "CrohnBOOST/AICPU"
+
+    def __init__(self, stageCacheMaxBytes=1024**3) -> None:
         """Called when the logic class is instantiated. Can be used for initializing member variables."""
         ScriptedLoadableModuleLogic.__init__(self)
+        self.pipeline = CrohnBOOSTLib.LesionPipeline(stageCacheMaxBytes=stageCacheMaxBytes)
+        self.stageCache = self.pipeline.stageCache
+        self.dernierMasqueLesion = None
+        self.tracer = CrohnBOOSTLib.TRACER
+        # Initialised nnU-Net predictor reused across AI runs: (key, predictor)
+        self._predicteur = None
+        self._predicteurLock = threading.Lock()
+        self._predicteurEnUtilisation = 0
+        self._minuterieLiberation = None
+        # Out-of-process inference (CrohnBOOSTLib.InferenceWorker), started on first use
+        self._worker = None
+        # Model folder once found, and the warm-up thread (prechaufferAI)
+        self._dossierModele = None
+        self._prechauffage = None
 
     def getParameterNode(self):
         return CrohnBOOSTParameterNode(super().getParameterNode())
@@ -745,23 +1283,21 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         if not inputVolume or not outputVolume:
             raise ValueError("Input or output volume is invalid")
 
-        import time
-
-        startTime = time.time()
         logging.info("Processing started")
 
-        cliParams = {
-            "InputVolume": inputVolume.GetID(),
-            "OutputVolume": outputVolume.GetID(),
-            "ThresholdValue": imageThreshold,
-            "ThresholdType": "Above" if invert else "Below",
-        }
-        cliNode = slicer.cli.run(slicer.modules.thresholdscalarvolume, None, cliParams, wait_for_completion=True, update_display=showResult)
+        with CrohnBOOSTLib.span('process', threshold=imageThreshold) as processSpan:
+            cliParams = {
+                "InputVolume": inputVolume.GetID(),
+                "OutputVolume": outputVolume.GetID(),
+                "ThresholdValue": imageThreshold,
+                "ThresholdType": "Above" if invert else "Below",
+            }
+            cliNode = slicer.cli.run(slicer.modules.thresholdscalarvolume, None, cliParams, wait_for_completion=True, update_display=showResult)
 
-        slicer.mrmlScene.RemoveNode(cliNode)
+            slicer.mrmlScene.RemoveNode(cliNode)
 
-        stopTime = time.time()
-        logging.info(f"Processing completed in {stopTime-startTime:.2f} seconds")
+        if processSpan.duration is not None:
+            logging.info(f"Processing completed in {processSpan.duration:.2f} seconds")
     
     
     def obtenirPointsDeLaCourbe(self, noeudMarkups):
@@ -771,35 +1307,7 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         return polyData.GetPoints()
     
     def trouverParoi(self, intensities, debut, fin):
-        import numpy as np
-        if len(intensities) == 0:
-            return None
-
-        if np.all(intensities == 0):
-            return None
-
-        intensity_range = np.max(intensities) - np.min(intensities)
-        if intensity_range == 0:
-            return None
-            
-        intensities_norm = (intensities - np.min(intensities)) / intensity_range
-        
-        gradients = np.gradient(intensities_norm)
-        grad_threshold = 0.2
-        grad_peaks = np.where(gradients > grad_threshold)[0]
-        
-        intensity_threshold = 0.5
-        intensity_peaks = np.where(intensities_norm > intensity_threshold)[0]
-        
-        combined_peaks = np.union1d(grad_peaks, intensity_peaks)
-        
-        if len(combined_peaks) == 0:
-            return None
-            
-        peak_idx = combined_peaks[np.argmax(intensities_norm[combined_peaks])]
-        position_relative = peak_idx / len(intensities)
-        
-        return debut + (fin - debut) * position_relative
+        return CrohnBOOSTLib.trouverParoi(intensities, debut, fin)
 
     def sampleIntensitiesAlongLine(self, startPoint, endPoint, volumeNode):
         import numpy as np
@@ -840,50 +1348,10 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
             intensities = gaussian_filter1d(intensities, sigma=0.5)
         
         return intensities
-    
+
     def expansion_locale_adjacente(self, mask, volume_array, n_iterations=3, valley_mask=None):
-        """
-        Expanse le masque en capturant les voxels adjacents avec intensités similaires.
-        valley_mask: binary mask of low-intensity barrier voxels that block region growing.
-        """
-        
-        from scipy import ndimage
-        
-        intensities_mask = volume_array[mask > 0]
-        mean_int = np.mean(intensities_mask)
-        std_int = np.std(intensities_mask)
-        
-        int_min = mean_int - 2.5 * std_int
-        int_max = mean_int + 2.5 * std_int
-        
-        print(f"Local expansion – Intensities: {mean_int:.1f} ± {std_int:.1f}")
-        if valley_mask is not None:
-            print(f"  Valley barrier active: {np.sum(valley_mask)} barrier voxels")
-        
-        result_mask = mask.copy()
-        
-        for iteration in range(n_iterations):
-            dilated = ndimage.binary_dilation(result_mask, iterations=1)
-            
-            border = (dilated & ~result_mask).astype(bool)
-            
-            intensity_valid = (volume_array >= int_min) & (volume_array <= int_max)
-            
-            valid_border = border & intensity_valid
-            
-            # ADDED: block growth into valley (dark) voxels
-            if valley_mask is not None:
-                valid_border = valid_border & ~valley_mask
-            
-            new_voxels = np.sum(valid_border)
-            if new_voxels == 0:
-                print(f"  Itération {iteration+1}: Plus de voxels à ajouter")
-                break
-                
-            result_mask = result_mask | valid_border
-            print(f"  Itération {iteration+1}: +{new_voxels} voxels")
-        
-        return result_mask.astype(np.uint8)
+        """Expanse le masque en capturant les voxels adjacents avec intensités similaires."""
+        return CrohnBOOSTLib.expansion_locale_adjacente(mask, volume_array, n_iterations, valley_mask)
 
     def placerMarqueur(self, position):
         import slicer
@@ -912,200 +1380,74 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         print(f"- Max : {np.max(intensities):.2f}")
         return intensities
 
-    def _computeValleyMask(self, volume_array, wall_intensities):
+    def donneesVolume(self, volumeNode):
         """
-        Compute a binary barrier mask of "valley" voxels — regions with intensity
-        significantly below the detected wall points. These are typically lumen,
-        mesentery, or other dark structures that the segmentation should not cross.
-        
-        Uses mean - 2.5*std of wall intensities: conservative enough to only block
-        truly dark regions (lumen, air, mesentery) without eating into legitimate
-        wall voxels that are slightly below average.
-        
-        Safety: if the mask would block >50% of the volume, it is clearly miscalibrated
-        and is disabled entirely to avoid breaking the segmentation.
+        CrohnBOOSTLib.VolumeData view of a scalar volume node (the voxel array is not copied).
+        The cache key is the node ID and image data modification time.
+        Main thread only (VTK and MRML calls): BackgroundTask functions get the VolumeData
+        built beforehand, which is passed through unchanged.
         """
-        mean_wall = np.mean(wall_intensities)
-        std_wall = np.std(wall_intensities)
-        valley_threshold = mean_wall - 2.5 * std_wall
-        
-        valley_mask = volume_array < valley_threshold
-        
-        n_valley = int(np.sum(valley_mask))
-        pct = 100.0 * n_valley / valley_mask.size
-        print(f"Valley mask: threshold = {valley_threshold:.1f} "
-              f"(mean wall = {mean_wall:.1f}, std = {std_wall:.1f})")
-        print(f"  Valley voxels: {n_valley} / {valley_mask.size} ({pct:.1f}%)")
-        
-        # Safety: if valley mask is too aggressive, disable it
-        if pct > 50.0:
-            print(f"  WARNING: Valley mask blocks {pct:.1f}% of volume — too aggressive, disabling")
-            return np.zeros_like(volume_array, dtype=bool)
-        
-        return valley_mask
-
-    def _computeCenterlineTangents(self, centerline_points):
+        if isinstance(volumeNode, CrohnBOOSTLib.VolumeData):
+            return volumeNode
+        ijkToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRAS)
+        rasToIJK = vtk.vtkMatrix4x4()
+        volumeNode.GetRASToIJKMatrix(rasToIJK)
+        imageData = volumeNode.GetImageData()
+        return CrohnBOOSTLib.VolumeData(
+            slicer.util.arrayFromVolume(volumeNode), volumeNode.GetSpacing(),
+            ijkToRAS=slicer.util.arrayFromVTKMatrix(ijkToRAS),
+            rasToIJK=slicer.util.arrayFromVTKMatrix(rasToIJK),
+            key=(volumeNode.GetID(), imageData.GetMTime() if imageData else 0))
+
+    def _calculerROI(self, volumeInput, centerline_points, wall_points, rayon_estime=6):
+        """Padded (k, j, i) bounding box of the centerline and wall points (see CrohnBOOSTLib.calculerROI)."""
+        return CrohnBOOSTLib.calculerROI(self.donneesVolume(volumeInput), self._pointsToArray(centerline_points),
+                                         self._pointsToArray(wall_points), rayon_estime)
+
+    def _pointsToArray(self, points):
+        """(N, 3) numpy array of the coordinates of a vtkPoints (None stays None, arrays pass through)."""
+        if points is None:
+            return None
+        if isinstance(points, np.ndarray):
+            return points.reshape(-1, 3)
+        return np.array([points.GetPoint(i) for i in range(points.GetNumberOfPoints())], dtype=np.float64).reshape(-1, 3)
+
+    def _arrayToPoints(self, points_ras):
+        """vtkPoints of an (N, 3) RAS array (main thread only), in double precision so
+        _pointsToArray gives the same array back (same stage cache keys)."""
+        points = vtk.vtkPoints()
+        points.SetDataTypeToDouble()
+        for point in points_ras:
+            points.InsertNextPoint(point)
+        return points
+
+    def exporterTrace(self, path, chrome=True):
         """
-        Compute unit tangent vectors for each point along the centerline.
-        Uses central differences for interior points, forward/backward for endpoints.
+        Write the recorded spans (wall detection, lesion stages, fat growth, AI inference)
+        to path, in Chrome trace format (chrome://tracing, ui.perfetto.dev) or as JSON
+        with a per-stage summary.
         """
-        n_points = centerline_points.GetNumberOfPoints()
-        centerline_ras = np.zeros((n_points, 3))
-        for i in range(n_points):
-            centerline_ras[i] = centerline_points.GetPoint(i)
-        
-        tangents = np.zeros_like(centerline_ras)
-        
-        for i in range(n_points):
-            if i == 0:
-                t = centerline_ras[1] - centerline_ras[0]
-            elif i == n_points - 1:
-                t = centerline_ras[-1] - centerline_ras[-2]
-            else:
-                t = centerline_ras[i + 1] - centerline_ras[i - 1]
-            
-            norm = np.linalg.norm(t)
-            if norm > 1e-8:
-                tangents[i] = t / norm
-            else:
-                tangents[i] = tangents[max(0, i - 1)]
-        
-        return centerline_ras, tangents
-
-    def segmenterParRegionSimple(self, volumeInput, centerline_points, wall_points, segmentationNode, threshold_factor, rayon_estime=6):
-
-        from scipy import ndimage
-        from scipy.spatial import cKDTree
+        if chrome:
+            self.tracer.exporterChrome(path)
+        else:
+            self.tracer.exporterJSON(path)
+        print(f"Trace exported to {path}")
 
-        volume_array = slicer.util.arrayFromVolume(volumeInput)
-        mask = np.zeros_like(volume_array)
-        
-        spacing = volumeInput.GetSpacing()
-        rayon_voxels = int(rayon_estime / min(spacing))
+    def clearStageCache(self):
+        """Drop every cached lesion pipeline stage."""
+        self.pipeline.clearStageCache()
 
-        rasToIJK = vtk.vtkMatrix4x4()
-        volumeInput.GetRASToIJKMatrix(rasToIJK)
-        
-        wall_ijk = []   
-        wall_intensities = []
-        for i in range(wall_points.GetNumberOfPoints()):
-            point = wall_points.GetPoint(i)
-            point_ijk = rasToIJK.MultiplyPoint((*point, 1.0))
-            x, y, z = [int(round(v)) for v in point_ijk[:3]]
-            
-            if (0 <= z < mask.shape[0] and 
-                0 <= y < mask.shape[1] and 
-                0 <= x < mask.shape[2]):
-                intensity = volume_array[z, y, x]
-                wall_intensities.append(intensity)
-                wall_ijk.append([z, y, x])
-
-        wall_ijk = np.array(wall_ijk)
-        wall_intensities = np.array(wall_intensities)
-        
-        mean_intensity = np.mean(wall_intensities)
-        std_intensity = np.std(wall_intensities)
-        min_intensity = np.min(wall_intensities)
-        
-        intensity_margin = std_intensity * threshold_factor
-        intensity_threshold_low = min_intensity * 0.8 - intensity_margin
-        intensity_threshold_high = mean_intensity + 2.0 * std_intensity + intensity_margin
-        
-        rayon_physique = rayon_estime
-        base_radius_physique = rayon_physique * 0.7
-        expanded_radius_physique = base_radius_physique + threshold_factor * base_radius_physique * 0.3
-
-        radius_x_vox = int(np.ceil(expanded_radius_physique / spacing[0]))
-        radius_y_vox = int(np.ceil(expanded_radius_physique / spacing[1]))
-        radius_z_vox = int(np.ceil(expanded_radius_physique / spacing[2]))
-
-        print(f"Physical search radius: {expanded_radius_physique:.2f} mm")
-        print(f"Equivalent voxel: (x:{radius_x_vox}, y:{radius_y_vox}, z:{radius_z_vox})")
-
-        # ADDED: Compute valley barrier mask (sequence-adaptive)
-        valley_mask = self._computeValleyMask(volume_array, wall_intensities)
-
-        # Region growing initial
-        for point_idx, (z, y, x) in enumerate(wall_ijk):
-            z_min = max(0, z - radius_z_vox)
-            z_max = min(mask.shape[0], z + radius_z_vox + 1)
-            y_min = max(0, y - radius_y_vox)
-            y_max = min(mask.shape[1], y + radius_y_vox + 1)
-            x_min = max(0, x - radius_x_vox)
-            x_max = min(mask.shape[2], x + radius_x_vox + 1)
-            
-            ref_intensity = volume_array[z, y, x]
-            intensity_tolerance = std_intensity * (1.0 + threshold_factor)
-            
-            for lz in range(z_min, z_max):
-                for ly in range(y_min, y_max):
-                    for lx in range(x_min, x_max):
-                        dx = (lx - x) * spacing[0]
-                        dy = (ly - y) * spacing[1]
-                        dz = (lz - z) * spacing[2]
-                        dist_to_point = np.sqrt(dx**2 + dy**2 + dz**2)
-                        
-                        if dist_to_point <= expanded_radius_physique:
-                            # ADDED: Skip valley (barrier) voxels
-                            if valley_mask[lz, ly, lx]:
-                                continue
-                            
-                            current_intensity = volume_array[lz, ly, lx]
-                            if (current_intensity >= intensity_threshold_low and
-                                current_intensity <= intensity_threshold_high and
-                                abs(current_intensity - ref_intensity) <= intensity_tolerance):
-                                mask[lz, ly, lx] = 1
-        
-        mask = mask.astype(np.uint8)
-
-        # MODIFIED: pass valley_mask to expansion
-        print("Local expansion of adjacent areas…")
-        mask = self.expansion_locale_adjacente(mask, volume_array, n_iterations=3, valley_mask=valley_mask)
-
-        print("Filtering by radial distance to the centerline…")
-        mask = self.filtrer_par_distance_centerline(mask, centerline_points, volumeInput, 
-                                            rayon_estime=rayon_estime, 
-                                            threshold_factor=threshold_factor)
-
-        # Fermeture morphologique adaptée à l'anisotropie
-        taille_physique = 2.0 
-        taille_x = max(int(np.round(taille_physique / spacing[0])), 1) 
-        taille_y = max(int(np.round(taille_physique / spacing[1])), 1) 
-        taille_z = max(int(np.round(taille_physique / spacing[2])), 1) 
-        struct_el_aniso = np.ones((taille_z, taille_y, taille_x), dtype=np.uint8)
-
-        mask = ndimage.binary_closing(mask, structure=struct_el_aniso, iterations=2)
-        print("Filling holes in the mask…")
-        
-        for z in range(mask.shape[0]):
-            mask[z, :, :] = ndimage.binary_fill_holes(mask[z, :, :])
-        
-        for y in range(mask.shape[1]):
-            mask[:, y, :] = ndimage.binary_fill_holes(mask[:, y, :])
-        
-        for x in range(mask.shape[2]):
-            mask[:, :, x] = ndimage.binary_fill_holes(mask[:, :, x])
-        
-        mask = ndimage.binary_fill_holes(mask)
-        
-        mask = ndimage.binary_closing(mask, structure=struct_el_aniso, iterations=1)
-        
-        mask = mask.astype(np.uint8)
-
-        labeled_array, num_features = ndimage.label(mask)
-        if num_features > 0:
-            sizes = np.bincount(labeled_array.ravel())[1:]
-            if len(sizes) > 0:
-                threshold_size = np.max(sizes) * 0.05
-                mask_cleaned = np.zeros_like(mask)
-                for label in range(1, num_features + 1):
-                    if sizes[label-1] >= threshold_size:
-                        mask_cleaned[labeled_array == label] = 1
-                mask = mask_cleaned
-        
-        print(f"Nombre final de voxels segmentés : {np.sum(mask)}")
-        
-        mask_final = self.expanderSegmentation(mask, volumeInput, threshold_factor, rayon_estime)
+    def segmenterParRegionSimple(self, volumeInput, centerline_points, wall_points, segmentationNode, threshold_factor, rayon_estime=6, min_volume_mm3=0.0, roi=None):
+        """
+        Lesion segmentation from the detected wall points, imported into segmentationNode.
+        roi: optional tuple of slices from _calculerROI; the whole pipeline then runs on
+        that sub-volume and only the ROI result is scattered into the full-size mask.
+        """
+        # Full-size masks, the ROI result scattered back (no ROI: the whole volume)
+        mask, mask_final = self.pipeline.calculerSegmentation(
+            self.donneesVolume(volumeInput), self._pointsToArray(centerline_points), self._pointsToArray(wall_points),
+            threshold_factor, rayon_estime, min_volume_mm3=min_volume_mm3, use_roi=False, roi=roi)
 
         labelmapVolumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
         slicer.util.updateVolumeFromArray(labelmapVolumeNode, mask_final)
@@ -1126,6 +1468,14 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
             seg.SetName("Paroi_Intestinale")
             seg.SetColor(0.95, 0.65, 0.3)
             
+        self._afficherDICE(mask)
+        
+        slicer.mrmlScene.RemoveNode(labelmapVolumeNode)
+
+        return mask
+
+    def _afficherDICE(self, mask):
+        """Print the DICE score against a 'Test_slicer' ground truth node, if loaded."""
         try:
             ground_truth = slicer.util.getNode('Test_slicer')
             if ground_truth:
@@ -1133,142 +1483,56 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
                 print(f"Score DICE : {dice_score:.4f}")
         except:
             print("Ground truth non trouvé pour le calcul du DICE")
-        
-        slicer.mrmlScene.RemoveNode(labelmapVolumeNode)
-
-        return mask
     
-    def expanderSegmentation(self, mask, volumeInput, factor, rayon_estime=6):
-        import numpy as np
-        from scipy import ndimage
-        
-        mask = mask.astype(np.uint8)
-        
-        spacing = volumeInput.GetSpacing()
-        rayon_voxels = int(rayon_estime / min(spacing))
-        
-        expansion_size = int((factor - 0.5) * rayon_voxels * 0.2)
-        struct_element = ndimage.generate_binary_structure(3, 1)
-        
+    def expanderSegmentation(self, mask, volumeInput, factor, rayon_estime=6, roi=None):
+        """
+        Dilate (factor > 0.5) or erode (factor < 0.5) the mask proportionally to the radius.
+        roi: optional tuple of slices; when given, mask is the ROI crop of the volume.
+        """
         volume_array = slicer.util.arrayFromVolume(volumeInput)
-        
-        if expansion_size == 0:
-            return mask
-        
-        elif expansion_size > 0:
-            mask_expanded = ndimage.binary_dilation(mask, 
-                                                structure=struct_element,
-                                                iterations=expansion_size)
-            mask_expanded = mask_expanded.astype(np.uint8)
-            
-            dilated_region = (mask_expanded & ~mask).astype(np.uint8)
-            mean_intensity = np.mean(volume_array[mask == 1])
-            std_intensity = np.std(volume_array[mask == 1])
-            
-            intensity_mask = ((volume_array >= mean_intensity - 2*std_intensity) & 
-                            (volume_array <= mean_intensity + 2*std_intensity)).astype(np.uint8)
-            
-            result = mask_expanded.copy()
-            result[dilated_region == 1] = intensity_mask[dilated_region == 1]
-            
-            return result.astype(np.uint8)
-        else:
-            result = ndimage.binary_erosion(mask, 
-                                        structure=struct_element,
-                                        iterations=abs(expansion_size))
-            return result.astype(np.uint8)
-                                        
+        if roi is not None:
+            volume_array = volume_array[roi]
+        return CrohnBOOSTLib.expanderSegmentation(mask, volume_array, volumeInput.GetSpacing(), factor, rayon_estime)
+
     def calculerDICE(self, segmentation, ground_truth):
         """Calcule le score DICE entre la segmentation et le ground truth"""
-        import numpy as np
-        
-        ground_truth_array = slicer.util.arrayFromVolume(ground_truth)
-        ground_truth_array = (ground_truth_array > 0).astype(np.uint8)
-        
-        segmentation = segmentation.astype(np.uint8)
-        
-        intersection = np.sum(segmentation * ground_truth_array)
-        
-        sum_seg = np.sum(segmentation)
-        sum_gt = np.sum(ground_truth_array)
-        
-        dice = (2.0 * intersection) / (sum_seg + sum_gt)
-        
-        return dice
-    
+        return CrohnBOOSTLib.calculerDICE(segmentation, slicer.util.arrayFromVolume(ground_truth))
+
     def calculerVolume(self, mask, volumeInput):
         """Compute the segmented volume from the binary mask and voxel spacing.
         Returns volume in mm³, cm³, and number of voxels."""
-        spacing = volumeInput.GetSpacing()
-        voxel_volume_mm3 = spacing[0] * spacing[1] * spacing[2]
-        n_voxels = int(np.sum(mask > 0))
-        volume_mm3 = n_voxels * voxel_volume_mm3
-        volume_cm3 = volume_mm3 / 1000.0
-        print(f"Volume: {n_voxels} voxels = {volume_mm3:.1f} mm³ = {volume_cm3:.2f} cm³")
-        return volume_mm3, volume_cm3, n_voxels
-    
-    def _interpolerPointsManquants(self, p1, detected_angles, detected_distances, all_angles, vecteur_perpendiculaire):
-        import numpy as np
+        return CrohnBOOSTLib.calculerVolume(mask, volumeInput.GetSpacing())
 
-        if len(detected_angles) < 4:
-            return [], []
-
-        detected_set = set(np.round(detected_angles, 4))
-        missing_angles = [a for a in all_angles if round(a, 4) not in detected_set]
-
-        if not missing_angles:
-            return [], []
-
-        sorted_indices = np.argsort(detected_angles)
-        sorted_angles = np.array(detected_angles)[sorted_indices]
-        sorted_distances = np.array(detected_distances)[sorted_indices]
-
-        extended_angles = np.concatenate([
-            sorted_angles - 2 * np.pi,
-            sorted_angles,
-            sorted_angles + 2 * np.pi
-        ])
-        extended_distances = np.concatenate([
-            sorted_distances, sorted_distances, sorted_distances
-        ])
-
-        interpolated_distances = np.interp(missing_angles, extended_angles, extended_distances)
-
-        new_points = []
-        new_distances = []
-        for angle, dist in zip(missing_angles, interpolated_distances):
-            rot_matrix = np.array([
-                [np.cos(angle), -np.sin(angle), 0],
-                [np.sin(angle),  np.cos(angle), 0],
-                [0,              0,              1]
-            ])
-            direction = np.dot(rot_matrix, vecteur_perpendiculaire)
-            direction = direction / np.linalg.norm(direction)
-            new_point = p1 + direction * dist
-            new_points.append(new_point)
-            new_distances.append(dist)
-
-        return new_points, new_distances
-    
-    def ensureAIDependencies(self):
-        """Install PyTorch and nnU-Net if not already available."""
-        import os
-        
+    def _configurerEnvironnementNNUNet(self):
+        """nnU-Net reads its data folders from the environment when imported: point them to a dummy folder."""
         dummy_path = os.path.join(os.path.expanduser("~"), ".crohnboost", "nnunet_dummy")
         os.makedirs(dummy_path, exist_ok=True)
         os.environ.setdefault("nnUNet_raw", dummy_path)
         os.environ.setdefault("nnUNet_preprocessed", dummy_path)
         os.environ.setdefault("nnUNet_results", dummy_path)
-        
-        try:
-            import torch
-            import nnunetv2
-            import blosc2
+
+    def sonderDependancesAI(self, refresh=False):
+        """
+        Whether PyTorch and nnU-Net are installed, without importing them (importing torch
+        takes seconds). The find_spec result is cached in the application settings, so
+        module entry can read it for free; refresh probes again.
+        """
+        settings = qt.QSettings()
+        if not refresh:
+            cached = settings.value(self.AI_AVAILABLE_SETTING)
+            if cached is not None:
+                return str(cached).lower() == 'true'
+        available = CrohnBOOSTLib.dependancesAIDisponibles()
+        settings.setValue(self.AI_AVAILABLE_SETTING, available)
+        return available
+
+    def ensureAIDependencies(self):
+        """Install PyTorch and nnU-Net if not already available (found with a probe, not imported here)."""
+        self._configurerEnvironnementNNUNet()
+        if self.sonderDependancesAI(refresh=True):
             self._registerCustomTrainer()
-            print(f"AI ready — PyTorch {torch.__version__}, CUDA: {torch.cuda.is_available()}")
+            print("AI ready — PyTorch and nnU-Net installed")
             return True
-        except ImportError:
-            pass
 
         print("Installing AI dependencies (first time, may take several minutes)...")
         try:
@@ -1278,7 +1542,10 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
             )
             slicer.util.pip_install("acvl_utils==0.2.0")
             slicer.util.pip_install("nnunetv2")
+            import importlib
+            importlib.invalidate_caches()
             self._registerCustomTrainer()
+            qt.QSettings().setValue(self.AI_AVAILABLE_SETTING, True)
             import torch
             print(f"Installed PyTorch {torch.__version__}")
             return True
@@ -1288,9 +1555,10 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
 
     def _registerCustomTrainer(self):
         """Create the custom trainer class file so nnU-Net can find it at inference."""
-        import nnunetv2
-        trainer_dir = os.path.join(os.path.dirname(nnunetv2.__file__), 
-                                    "training", "nnUNetTrainer")
+        import importlib.util
+        # Located without importing nnunetv2
+        nnunet_dir = importlib.util.find_spec("nnunetv2").submodule_search_locations[0]
+        trainer_dir = os.path.join(nnunet_dir, "training", "nnUNetTrainer")
         trainer_file = os.path.join(trainer_dir, "nnUNetTrainerRanger_250epochs.py")
         
         if not os.path.exists(trainer_file):
@@ -1309,22 +1577,43 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         else:
             print("Custom trainer already registered")
 
-    def ensureModelDownloaded(self):
-        """Check local model or download from GitHub Releases."""
-        import os, zipfile
+    def _modeleInstalle(self, model_folder):
+        """Whether fold 0 has a training or a slim inference checkpoint."""
+        return any(os.path.exists(os.path.join(model_folder, "fold_0", name))
+                   for name in (CrohnBOOSTLib.model.TRAINING_CHECKPOINT, CrohnBOOSTLib.model.SLIM_CHECKPOINT))
+
+    def dossierModeleLocal(self):
+        """
+        Folder of the model if it is already on this machine (never downloads), else None.
+        Found once per session: later calls do not touch the file system. Predictions load
+        its slim inference checkpoint when there is one (see CrohnBOOSTLib.model).
+        """
+        if self._dossierModele is not None:
+            return self._dossierModele
 
         local_dir = "/home/iadi.lan/akne/mount/locdata/nnUNet/nnUNet_results/Dataset001_EntroIRM/nnUNetTrainerRanger_250epochs__nnUNetPlans__3d_fullres"
-        local_ckpt = os.path.join(local_dir, "fold_0", "checkpoint_best.pth")
-        if os.path.exists(local_ckpt):
+        if self._modeleInstalle(local_dir):
             print(f"Local model found: {local_dir}")
+            self._dossierModele = local_dir
             return local_dir
 
-        model_dir = os.path.join(os.path.expanduser("~"), ".crohnboost", "models",
-                                  "nnUNetTrainerRanger_250epochs__nnUNetPlans__3d_fullres")
-        checkpoint = os.path.join(model_dir, "fold_0", "checkpoint_best.pth")
-        if os.path.exists(checkpoint):
+        model_dir = self.MODEL_DIR
+        if self._modeleInstalle(model_dir):
             print(f"Cached model found: {model_dir}")
+            self._dossierModele = model_dir
             return model_dir
+        return None
+
+    def ensureModelDownloaded(self):
+        """Check local model or download from GitHub Releases."""
+        import zipfile
+
+        model_folder = self.dossierModeleLocal()
+        if model_folder is not None:
+            return model_folder
+
+        model_dir = self.MODEL_DIR
+        checkpoint = os.path.join(model_dir, "fold_0", "checkpoint_best.pth")
 
         MODEL_URL = "https://github.com/AntoineKneib/CrohnBOOST/releases/download/v1.0-beta/crohnboost_model_v1.zip"
 
@@ -1342,6 +1631,12 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
 
             if os.path.exists(checkpoint):
                 print("Model downloaded successfully")
+                self._dossierModele = model_dir
+                try:
+                    # Every later load reads the slim, memory-mapped weights instead
+                    CrohnBOOSTLib.model.convertirCheckpoint(model_dir)
+                except Exception as e:
+                    print(f"Slim checkpoint not written ({e}), the training checkpoint will be used")
                 return model_dir
             else:
                 print("ERROR: checkpoint not found after extraction")
@@ -1353,102 +1648,267 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
                 f"Check your internet connection.\n\nError: {str(e)}")
             return None
 
-    def runNNUNetPrediction(self, inputVolume, model_folder):
-        """Run nnU-Net inference and return a segmentation node."""
-        import os, tempfile, shutil
-        import numpy as np
+    def delaiInactivitePredicteur(self):
+        """Idle minutes before the cached predictor is released, from the application settings."""
+        try:
+            return float(qt.QSettings().value(self.AI_IDLE_SETTING, self.AI_IDLE_DEFAULT_MINUTES))
+        except (TypeError, ValueError):
+            return float(self.AI_IDLE_DEFAULT_MINUTES)
 
-        temp_dir = tempfile.mkdtemp(prefix="crohnboost_ai_")
+    def _clePredicteur(self, model_folder, device, use_folds=(0,), checkpoint_name=None, optionsCPU=None):
+        cpu_key = optionsCPU.key if optionsCPU is not None else None
+        return (os.path.abspath(model_folder), tuple(use_folds), checkpoint_name, str(device), cpu_key)
 
-        try:
-            input_path = os.path.join(temp_dir, "case_0000.nii.gz")
-            slicer.util.exportNode(inputVolume, input_path)
-            print(f"Exported volume to: {input_path}")
+    def obtenirPredicteur(self, model_folder, device, use_folds=(0,), checkpoint_name=None, optionsCPU=None):
+        """
+        Initialised nnUNetPredictor for the model folder, folds, checkpoint and device.
+        Loading the checkpoint takes seconds, so the predictor is kept and reused as long
+        as the key is unchanged; a different key replaces it (only one model is kept in memory).
+        optionsCPU: CrohnBOOSTLib.OptionsCPU applied to the network (CPU device only).
+        checkpoint_name: default the slim inference checkpoint when present (CrohnBOOSTLib.model).
+        """
+        if device.type != 'cpu':
+            optionsCPU = None
+        if checkpoint_name is None:
+            checkpoint_name = CrohnBOOSTLib.model.choisirCheckpoint(model_folder, use_folds)
+        self.attendrePrechauffage()
+        key = self._clePredicteur(model_folder, device, use_folds, checkpoint_name, optionsCPU)
+        with self._predicteurLock:
+            self._annulerLiberation()
+            if self._predicteur is not None and self._predicteur[0] == key:
+                print("Reusing the loaded AI model")
+                return self._predicteur[1]
+
+        self.libererPredicteur()
+
+        predictor = CrohnBOOSTLib.creerPredicteur(model_folder, device, use_folds, checkpoint_name, optionsCPU)
+        with self._predicteurLock:
+            self._predicteur = (key, predictor)
+        return predictor
+
+    def libererPredicteur(self):
+        """Release the cached nnU-Net predictor and the memory it holds (CPU and GPU)."""
+        with self._predicteurLock:
+            self._annulerLiberation()
+            if self._predicteur is None:
+                return
+            self._predicteur = None
 
-            from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+        import gc
+        gc.collect()
+        try:
             import torch
-
-            use_gpu = False
             if torch.cuda.is_available():
-                gpu_name = torch.cuda.get_device_name(0)
-                gpu_mem = torch.cuda.get_device_properties(0).total_memory / 1e9
-                print(f"GPU detected: {gpu_name} ({gpu_mem:.1f} GB)")
-                if gpu_mem >= 6.0:
-                    use_gpu = True
-                else:
-                    print(f"GPU VRAM too low ({gpu_mem:.1f} GB), using CPU instead")
-            
-            device = torch.device('cuda' if use_gpu else 'cpu')
-            print(f"Using device: {device}")
-
-            predictor = nnUNetPredictor(
-                tile_step_size=0.5,
-                use_gaussian=True,
-                use_mirroring=False,
-                perform_everything_on_device=False,
-                device=device,
-                verbose=True,
-                verbose_preprocessing=True,
-                allow_tqdm=True
-            )
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        print("AI model released from memory")
+
+    def prechaufferAI(self, optionsCPU=None, useWorker=False):
+        """
+        Opt-in warm-up on module entry: when the dependencies (cached probe) and the model are
+        already installed, import PyTorch / nnU-Net and load the predictor on a thread (or in
+        the worker process with useWorker), so the first AI run only pays for inference.
+        Never installs or downloads anything. Returns whether a warm-up was started.
+        """
+        if self._prechauffage is not None and self._prechauffage.is_alive():
+            return False
+        if not self.sonderDependancesAI():
+            return False
+        model_folder = self.dossierModeleLocal()
+        if model_folder is None:
+            return False
+        self._configurerEnvironnementNNUNet()
+        try:
+            self._registerCustomTrainer()
+        except Exception as e:
+            print(f"AI warm-up skipped: {e}")
+            return False
+
+        if useWorker:
+            self.libererPredicteur()
+            self.obtenirWorker().preload(model_folder, optionsCPU)
+            return True
+
+        def prechauffer():
+            try:
+                with CrohnBOOSTLib.span('ai.warmup'):
+                    device, options = self._preparerDevice(None, optionsCPU)
+                    self.obtenirPredicteur(model_folder, device, optionsCPU=options)
+                print("AI model warmed up")
+                self._planifierLiberation()
+            except ImportError as e:
+                # Stale probe cache: the packages are gone
+                print(f"AI warm-up failed: {e}")
+                qt.QSettings().setValue(self.AI_AVAILABLE_SETTING, False)
+            except Exception as e:
+                print(f"AI warm-up failed: {e}")
+
+        self._prechauffage = threading.Thread(target=prechauffer, name='CrohnBOOST AI warm-up', daemon=True)
+        self._prechauffage.start()
+        return True
+
+    def attendrePrechauffage(self):
+        """Wait for a running warm-up, so a prediction does not load the model a second time."""
+        thread = self._prechauffage
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            print("Waiting for the AI warm-up to finish...")
+            thread.join()
+
+    def _annulerLiberation(self):
+        if self._minuterieLiberation is not None:
+            self._minuterieLiberation.cancel()
+            self._minuterieLiberation = None
+
+    def _planifierLiberation(self):
+        """Restart the idle eviction countdown of the cached predictor."""
+        minutes = self.delaiInactivitePredicteur()
+        with self._predicteurLock:
+            self._annulerLiberation()
+            if minutes <= 0 or self._predicteur is None:
+                return
+            self._minuterieLiberation = threading.Timer(minutes * 60.0, self._libererSiInactif)
+            self._minuterieLiberation.daemon = True
+            self._minuterieLiberation.start()
+
+    def _libererSiInactif(self):
+        with self._predicteurLock:
+            self._minuterieLiberation = None
+            busy = self._predicteurEnUtilisation > 0
+        if busy:
+            self._planifierLiberation()
+        else:
+            print("AI model idle, releasing it")
+            self.libererPredicteur()
+
+    def choisirDevice(self):
+        """CUDA when a GPU with at least 6 GB of memory is available, otherwise the CPU."""
+        return CrohnBOOSTLib.choisirDevice()
+
+    def regionInference(self, volume, region, regionNode, marge_mm):
+        """
+        (k, j, i) slices the AI inference is restricted to, or None for the whole volume.
+        region: one of CrohnBOOSTLib.AI_REGIONS; regionNode: the centerline curve ('centerline')
+        or the markups ROI ('markups_roi'). marge_mm: (k, j, i) padding of the box, half the
+        network patch size (CrohnBOOSTLib.margePatch / margePatchModele).
+        """
+        if region == 'centerline':
+            boite = CrohnBOOSTLib.boiteDesPoints(volume, self._pointsToArray(self.obtenirPointsDeLaCourbe(regionNode))) \
+                if regionNode is not None and regionNode.GetNumberOfControlPoints() >= 2 else None
+        elif region == 'markups_roi':
+            boite = None
+            if regionNode is not None:
+                bounds = np.zeros(6)
+                regionNode.GetRASBounds(bounds)
+                corners = np.array([[x, y, z] for x in bounds[0:2] for y in bounds[2:4] for z in bounds[4:6]])
+                boite = CrohnBOOSTLib.boiteDesPoints(volume, corners)
+        elif region == 'body':
+            boite = CrohnBOOSTLib.boiteCorps(volume)
+        else:
+            return None
+
+        if boite is None:
+            print(f"No usable {region} region, running AI inference on the whole volume")
+            return None
+        return CrohnBOOSTLib.roiInference(volume, boite, marge_mm)
+
+    def _preparerDevice(self, device, optionsCPU):
+        """(device, optionsCPU) of a prediction: thread counts applied on the CPU, options dropped on GPU."""
+        if device is None:
+            device = self.choisirDevice()
+        print(f"Using device: {device}")
+        if device.type != 'cpu':
+            return device, None
+        if optionsCPU is not None:
+            threads = CrohnBOOSTLib.configurerThreadsCPU(optionsCPU)
+            print(f"Optimised CPU mode: {optionsCPU}, threads (intra-op, inter-op): {threads}")
+        else:
+            CrohnBOOSTLib.restaurerThreadsCPU()
+        return device, optionsCPU
+
+    def _verifierRepliCPU(self, model_folder, predictor, device):
+        if predictor.device != device:
+            # GPU out of memory: the cached predictor now lives on the CPU
+            with self._predicteurLock:
+                self._predicteur = (self._clePredicteur(model_folder, predictor.device), predictor)
+
+    def predireNNUNet(self, inputVolume, model_folder, optionsCPU=None, device=None, region='volume', regionNode=None):
+        """
+        nnU-Net prediction of a volume node as a (k, j, i) label array.
+        optionsCPU: CrohnBOOSTLib.OptionsCPU for the optimised CPU mode (thread counts,
+        inference_mode, bf16 autocast, channels-last); ignored on GPU.
+        None keeps the standard path. device: forces a torch device (default: choisirDevice()).
+        region, regionNode: restrict inference to a padded crop (see regionInference), z-score
+        normalised with the statistics of the whole volume; the crop prediction is pasted back
+        into the full geometry.
+        """
+        device, optionsCPU = self._preparerDevice(device, optionsCPU)
+
+        with CrohnBOOSTLib.span('ai.load_model', device=str(device)):
+            predictor = self.obtenirPredicteur(model_folder, device, optionsCPU=optionsCPU)
+        with self._predicteurLock:
+            self._predicteurEnUtilisation += 1
+
+        try:
+            volume = self.donneesVolume(inputVolume)
+            roi = self.regionInference(volume, region, regionNode, CrohnBOOSTLib.margePatch(predictor))
+            normalisation = None
+            with CrohnBOOSTLib.span('ai.prepare', region=region if roi is not None else 'volume'):
+                if roi is not None:
+                    normalisation = CrohnBOOSTLib.statistiquesNormalisation(
+                        volume, *CrohnBOOSTLib.normalisationPredicteur(predictor))
+                data, properties = CrohnBOOSTLib.preparerEntreeNNUNet(
+                    volume.sousVolume(roi) if roi is not None else volume)
 
-            predictor.initialize_from_trained_model_folder(
-                model_folder,
-                use_folds=(0,),
-                checkpoint_name='checkpoint_best.pth'
-            )
             print("Model loaded, starting prediction...")
             slicer.app.processEvents()
 
-            import SimpleITK as sitk
-            sitk_img = sitk.ReadImage(input_path)
-            data = sitk.GetArrayFromImage(sitk_img).astype(np.float32)
-            data = data[np.newaxis]
+            print(f"Input shape: {data.shape}, spacing: {properties['spacing']}")
+            slicer.app.processEvents()
 
-            spacing = list(sitk_img.GetSpacing())[::-1]
+            mode = optionsCPU.precision if optionsCPU is not None else 'standard'
+            with CrohnBOOSTLib.span('ai.predict', input=data, cpu_mode=mode) as predictSpan:
+                prediction = CrohnBOOSTLib.predireTableau(predictor, data, properties, optionsCPU, normalisation)
+                self._verifierRepliCPU(model_folder, predictor, device)
 
-            properties = {
-                'sitk_stuff': {
-                    'spacing': list(sitk_img.GetSpacing()),
-                    'origin': list(sitk_img.GetOrigin()),
-                    'direction': list(sitk_img.GetDirection())
-                },
-                'spacing': spacing
-            }
+                predictSpan.set(device=str(predictor.device))
+        finally:
+            with self._predicteurLock:
+                self._predicteurEnUtilisation -= 1
+            self._planifierLiberation()
 
-            print(f"Input shape: {data.shape}, spacing: {spacing}")
-            slicer.app.processEvents()
+        print(f"Using device: {predictor.device}")
+        print(f"Prediction done, shape: {prediction.shape}")
+        return CrohnBOOSTLib.collerPrediction(volume.shape, roi, prediction)
 
-            try:
-                prediction = predictor.predict_single_npy_array(
-                    data, properties, None, None, False
-                )
-            except RuntimeError as e:
-                if "out of memory" in str(e).lower():
-                    print("GPU out of memory, falling back to CPU...")
-                    torch.cuda.empty_cache()
-                    predictor.device = torch.device('cpu')
-                    predictor.network = predictor.network.to('cpu')
-                    prediction = predictor.predict_single_npy_array(
-                        data, properties, None, None, False
-                    )
-                else:
-                    raise
-            
-            print(f"Using device: {predictor.device}")
-            print(f"Prediction done, shape: {prediction.shape}")
+    def runNNUNetPrediction(self, inputVolume, model_folder, optionsCPU=None, region='volume', regionNode=None):
+        """
+        Run nnU-Net inference and return a segmentation node.
+        The input array and its geometry are taken from the volume node and the prediction
+        is imported from memory: no temporary NIfTI file is written or read.
+        optionsCPU, region, regionNode: see predireNNUNet.
+        """
+        try:
+            prediction = self.predireNNUNet(inputVolume, model_folder, optionsCPU,
+                                            region=region, regionNode=regionNode)
+            return self.importerPredictionAI(inputVolume, prediction)
 
-            output_path = os.path.join(temp_dir, "prediction.nii.gz")
-            pred_sitk = sitk.GetImageFromArray(prediction.astype(np.uint8))
-            pred_sitk.SetSpacing(sitk_img.GetSpacing())
-            pred_sitk.SetOrigin(sitk_img.GetOrigin())
-            pred_sitk.SetDirection(sitk_img.GetDirection())
-            sitk.WriteImage(pred_sitk, output_path)
+        except Exception as e:
+            print(f"nnU-Net prediction failed: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
 
-            loadedNode = slicer.util.loadLabelVolume(output_path)
+    def importerPredictionAI(self, inputVolume, prediction, name='Crohn_Segmentation'):
+        """New segmentation node (named name) from a full-size (k, j, i) AI label array."""
+        with CrohnBOOSTLib.span('ai.import', voxels=int(np.count_nonzero(prediction))):
+            loadedNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+            loadedNode.SetName("AI_Prediction")
+            slicer.util.updateVolumeFromArray(loadedNode, np.asarray(prediction, dtype=np.uint8))
+            loadedNode.CopyOrientation(inputVolume)
 
             segNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
-            segNode.SetName('Crohn_Segmentation')
+            segNode.SetName(name)
             segNode.CreateDefaultDisplayNodes()
             segNode.SetReferenceImageGeometryParameterFromVolumeNode(inputVolume)
 
@@ -1463,40 +1923,186 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
                 segment.SetColor(0.95, 0.65, 0.3)
 
             slicer.mrmlScene.RemoveNode(loadedNode)
-            print(f"AI segmentation complete — {segmentation.GetNumberOfSegments()} segment(s)")
-            return segNode
+        print(f"AI segmentation complete — {segmentation.GetNumberOfSegments()} segment(s)")
+        return segNode
+
+    def _executablePython(self):
+        """PythonSlicer next to the application: in the GUI, sys.executable is Slicer itself."""
+        import sys
+        name = 'PythonSlicer.exe' if os.name == 'nt' else 'PythonSlicer'
+        path = os.path.join(os.path.dirname(sys.executable), name)
+        return path if os.path.exists(path) else None
+
+    def obtenirWorker(self):
+        """The inference worker process, started (or restarted after a crash) if needed."""
+        if self._worker is None:
+            self._worker = CrohnBOOSTLib.InferenceWorker(executable=self._executablePython(),
+                                                         idle_minutes=self.delaiInactivitePredicteur())
+        return self._worker.start()
+
+    def arreterWorker(self):
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+
+    def soumettreInferenceAI(self, inputVolume, model_folder, optionsCPU=None, region='volume', regionNode=None):
+        """
+        Queue the AI inference of a volume node on the worker process and return its
+        CrohnBOOSTLib.InferenceJob (poll it, then importerPredictionAI(inputVolume, job.result)).
+        The input and the labels go through shared memory; the model stays loaded in the worker.
+        optionsCPU, region, regionNode: see predireNNUNet.
+        """
+        # Only one copy of the model in memory: the worker's (the in-process predictor is dropped)
+        self.libererPredicteur()
+        volume = self.donneesVolume(inputVolume)
+        roi = normalisation = None
+        if region != 'volume':
+            roi = self.regionInference(volume, region, regionNode, CrohnBOOSTLib.margePatchModele(model_folder))
+        with CrohnBOOSTLib.span('ai.prepare', region=region if roi is not None else 'volume'):
+            if roi is not None:
+                normalisation = CrohnBOOSTLib.statistiquesNormalisation(
+                    volume, *CrohnBOOSTLib.normalisationModele(model_folder))
+            data, properties = CrohnBOOSTLib.preparerEntreeNNUNet(
+                volume.sousVolume(roi) if roi is not None else volume)
+        return self.obtenirWorker().submit(data, properties, model_folder, optionsCPU, roi=roi, shape=volume.shape,
+                                           normalisation=normalisation)
+
+    def lancerFileInferenceAI(self, inputVolumes, model_folder, optionsCPU=None, region='volume', regionNode=None):
+        """
+        AI inference of several volume nodes in process, with the model loaded once.
+        CrohnBOOSTLib.predireFile runs on a BackgroundTask thread: each volume is prepared and
+        preprocessed while the network runs on the previous one.
+        Returns (task, jobs): one CrohnBOOSTLib.InferenceJob per volume, in order, finished as
+        its prediction arrives; import each with importerPredictionAI (main thread).
+        region, regionNode: see predireNNUNet, applied to every volume (a region outside a
+        volume falls back to the whole volume).
+        """
+        volumes = [self.donneesVolume(node) for node in inputVolumes]
+        marge = CrohnBOOSTLib.margePatchModele(model_folder) if region != 'volume' else None
+        rois = [self.regionInference(volume, region, regionNode, marge) for volume in volumes]
+        jobs = [CrohnBOOSTLib.InferenceJob(index) for index in range(len(volumes))]
+        device, optionsCPU = self._preparerDevice(None, optionsCPU)
 
-        except Exception as e:
-            print(f"nnU-Net prediction failed: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-        finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        def compute(task):
+            try:
+                with CrohnBOOSTLib.span('ai.load_model', device=str(device)):
+                    predictor = self.obtenirPredicteur(model_folder, device, optionsCPU=optionsCPU)
+                with self._predicteurLock:
+                    self._predicteurEnUtilisation += 1
+                try:
+                    results = CrohnBOOSTLib.predireFile(predictor, volumes, optionsCPU, rois)
+                    try:
+                        for done, (index, labels, error) in enumerate(results, 1):
+                            jobs[index].info = {'device': str(predictor.device)}
+                            jobs[index].finish(labels, error)
+                            task.report(int(100 * done / len(jobs)), f"{done}/{len(jobs)} volumes")
+                            task.checkCancelled()
+                    finally:
+                        results.close()
+                    self._verifierRepliCPU(model_folder, predictor, device)
+                finally:
+                    with self._predicteurLock:
+                        self._predicteurEnUtilisation -= 1
+                    self._planifierLiberation()
+            finally:
+                for job in jobs:
+                    if not job.finished:
+                        job.finish(error=RuntimeError("AI queue stopped"))
 
-    def mettreAJourSegmentation(self, volumeInput, centerline_points, wall_points, segmentationNode, threshold_factor, rayon_estime=6):
-        """Updates the segmentation with the existing points."""
-        segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(volumeInput)
+        return BackgroundTask(compute).start(), jobs
 
-        mask = self.segmenterParRegionSimple(volumeInput, centerline_points, wall_points, segmentationNode, threshold_factor, rayon_estime)
+    def comparerInferenceCPU(self, volume, model_folder, optionsCPU, roi=None, task=None):
+        """
+        Run the volume on the CPU with the standard path and with the optimised mode, and
+        check they agree. Each mode gets an untimed warm-up prediction first (lazy PyTorch
+        and oneDNN initialisation), so neither pays for it; model loading is not timed either.
+        volume: VolumeData (donneesVolume, built on the main thread); roi: (k, j, i) slices
+        of a crop (regionInference), used for both modes and normalised with the statistics
+        of the whole volume, as in predireNNUNet. task: optional BackgroundTask for
+        progress and cancellation. No MRML access, so it can run on a BackgroundTask thread.
+        Returns a dict: standard_s, optimise_s, speedup and dice (agreement of the two label maps).
+        """
+        import copy
+        import time
+        import torch
+
+        cpu = torch.device('cpu')
+        normalisation = None
+        if roi is not None:
+            normalisation = CrohnBOOSTLib.statistiquesNormalisation(
+                volume, *CrohnBOOSTLib.normalisationModele(model_folder))
+        data, properties = CrohnBOOSTLib.preparerEntreeNNUNet(volume.sousVolume(roi) if roi is not None else volume)
+        modes = (('standard', None), ('optimised', optionsCPU))
+        predictions, seconds = {}, {}
+        with CrohnBOOSTLib.span('ai.compare_cpu', input=data, options=repr(optionsCPU)):
+            for index, (name, options) in enumerate(modes):
+                if task is not None:
+                    task.report(50 * index, f"Loading the model ({name} CPU path)...")
+                    task.checkCancelled()
+                _, options = self._preparerDevice(cpu, options)
+                predictor = self.obtenirPredicteur(model_folder, cpu, optionsCPU=options)
+                with self._predicteurLock:
+                    self._predicteurEnUtilisation += 1
+                try:
+                    if task is not None:
+                        task.report(50 * index + 10, f"Warm-up prediction ({name} CPU path)...")
+                    CrohnBOOSTLib.predireTableau(predictor, data, copy.deepcopy(properties), options, normalisation)
+                    if task is not None:
+                        task.report(50 * index + 30, f"Timed prediction ({name} CPU path)...")
+                        task.checkCancelled()
+                    t0 = time.perf_counter()
+                    predictions[name] = CrohnBOOSTLib.predireTableau(predictor, data, copy.deepcopy(properties),
+                                                                     options, normalisation)
+                    seconds[name] = time.perf_counter() - t0
+                finally:
+                    with self._predicteurLock:
+                        self._predicteurEnUtilisation -= 1
+                    self._planifierLiberation()
+
+        standard, optimise = predictions['standard'], predictions['optimised']
+        if not np.any(standard) and not np.any(optimise):
+            dice = 1.0
+        else:
+            dice = float(CrohnBOOSTLib.calculerDICE(standard > 0, optimise > 0))
+        standard_s, optimise_s = seconds['standard'], seconds['optimised']
+        result = {
+            'standard_s': standard_s,
+            'optimise_s': optimise_s,
+            'speedup': standard_s / optimise_s if optimise_s > 0 else float('inf'),
+            'dice': dice,
+        }
+        print(f"CPU inference (after a warm-up pass each): standard {standard_s:.1f} s, "
+              f"optimised {optimise_s:.1f} s ({result['speedup']:.2f}x), Dice {dice:.4f}")
+        return result
 
-        if mask is None:
-            return False
-        
-        print(f"After applying the trajectory mask: {np.sum(mask)} remaining voxels")
-        
-        full_dims = volumeInput.GetImageData().GetDimensions()
-        full_mask = np.zeros(full_dims[::-1], dtype=np.uint8)
-        
-        mask_shape = mask.shape
-        
-        z_max = min(full_mask.shape[0], mask_shape[0])
-        y_max = min(full_mask.shape[1], mask_shape[1])
-        x_max = min(full_mask.shape[2], mask_shape[2])
-        
-        full_mask[0:z_max, 0:y_max, 0:x_max] = mask[0:z_max, 0:y_max, 0:x_max]
-        
-        full_mask_final = self.expanderSegmentation(full_mask, volumeInput, threshold_factor, rayon_estime)
+    def calculerSegmentationLesion(self, volumeInput, centerline_points, wall_points, threshold_factor, rayon_estime=6, min_volume_mm3=0.0, use_roi=True, roi=None, task=None):
+        """
+        Compute the lesion masks without touching the MRML scene. On a BackgroundTask thread,
+        pass the VolumeData (donneesVolume) and RAS point arrays (_pointsToArray) built
+        on the main thread instead of the nodes.
+        use_roi: run the lesion pipeline on the padded centerline bounding box only.
+        roi: explicit tuple of slices overriding the computed ROI (e.g. a slab for previews).
+        task: optional BackgroundTask for progress and cancellation.
+        Returns (mask, full_mask_final), both full-size uint8 arrays.
+        """
+        return self.pipeline.calculerSegmentation(
+            self.donneesVolume(volumeInput), self._pointsToArray(centerline_points), self._pointsToArray(wall_points),
+            threshold_factor, rayon_estime, min_volume_mm3=min_volume_mm3, use_roi=use_roi, roi=roi, task=task)
+
+    def calculerApercuCoupe(self, volumeInput, centerline_points, wall_points, threshold_factor, rayon_estime, slice_index, task=None):
+        """
+        Fast preview of one axial slice (index k of arrayFromVolume) of the lesion segmentation,
+        computed on a thin slab of the ROI (see LesionPipeline.calculerApercuCoupe).
+        Takes the same node or NumPy inputs as calculerSegmentationLesion.
+        task: optional BackgroundTask for progress and cancellation.
+        Returns the 2D uint8 mask of the slice.
+        """
+        return self.pipeline.calculerApercuCoupe(
+            self.donneesVolume(volumeInput), self._pointsToArray(centerline_points), self._pointsToArray(wall_points),
+            threshold_factor, rayon_estime, slice_index, task=task)
+
+    def importerSegmentationLesion(self, segmentationNode, volumeInput, full_mask_final):
+        """Replace the Paroi_Intestinale segment of segmentationNode by full_mask_final (main thread only)."""
         full_mask_final = full_mask_final.astype(np.uint8)
         
         segmentation = segmentationNode.GetSegmentation()
@@ -1514,6 +2120,7 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         segmentId = segmentation.GetSegmentIdBySegmentName("Paroi_Intestinale")
         if not segmentId:
             print("ERROR: Paroi_Intestinale segment not found!")
+            slicer.mrmlScene.RemoveNode(labelmapVolumeNode)
             return False
 
         slicer.modules.segmentations.logic().ImportLabelmapToSegmentationNode(
@@ -1529,6 +2136,28 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         
         segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(volumeInput)
         slicer.mrmlScene.RemoveNode(labelmapVolumeNode)
+        return True
+
+    def appliquerSegmentationLesion(self, segmentationNode, volumeInput, mask, full_mask_final):
+        """Main-thread part of a lesion update: DICE report and MRML import of calculerSegmentationLesion's result."""
+        self._afficherDICE(mask)
+        with CrohnBOOSTLib.span('lesion.import', voxels=int(np.count_nonzero(full_mask_final))):
+            imported = self.importerSegmentationLesion(segmentationNode, volumeInput, full_mask_final)
+        if not imported:
+            return False
+        self.dernierMasqueLesion = full_mask_final
+        return True
+
+    def mettreAJourSegmentation(self, volumeInput, centerline_points, wall_points, segmentationNode, threshold_factor, rayon_estime=6, min_volume_mm3=0.0, use_roi=True):
+        """Updates the segmentation with the existing points.
+        use_roi: run the lesion pipeline on the padded centerline bounding box only."""
+        segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(volumeInput)
+
+        mask, full_mask_final = self.calculerSegmentationLesion(
+            volumeInput, centerline_points, wall_points, threshold_factor, rayon_estime,
+            min_volume_mm3=min_volume_mm3, use_roi=use_roi)
+        if not self.appliquerSegmentationLesion(segmentationNode, volumeInput, mask, full_mask_final):
+            return False
         
         #try:
         #    slicer.util.selectModule("SegmentEditor")
@@ -1549,351 +2178,98 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         
         return True
     
-    def filtrer_par_distance_centerline(self, mask, centerline_points, volumeInput, rayon_estime=6, threshold_factor=0.5):
+    def calculerChampDistance(self, volumeInput, centerline_points, roi, workers=-1, chunk_size=1000000):
         """
-        Keeps only the mask voxels that are within distance_max of the centerline.
-        Now uses RADIAL distance (perpendicular to local tangent) instead of
-        raw Euclidean distance. This prevents voxels near a different portion
-        of the centerline (when the curve loops back) from being kept.
+        Centerline distance field over the ROI (tuple of slices): nearest centerline index,
+        radial distance in mm and signed axial offset in mm of every ROI voxel.
         """
-        
-        from scipy.spatial import cKDTree
-        
-        distance_factor = 2.0 + (threshold_factor * 1.0)
-        distance_max_mm = rayon_estime * distance_factor
-        
-        print(f"Maximum allowed radial distance: {distance_max_mm:.1f} mm "
-              f"(radius {rayon_estime}mm × {distance_factor:.2f})")
-        
-        # Compute centerline positions and tangent vectors
-        centerline_ras, tangents = self._computeCenterlineTangents(centerline_points)
-        
-        tree = cKDTree(centerline_ras)
-        
-        ijkToRAS = vtk.vtkMatrix4x4()
-        volumeInput.GetIJKToRASMatrix(ijkToRAS)
-        
-        segmented_coords_ijk = np.argwhere(mask > 0)
-        
-        if len(segmented_coords_ijk) == 0:
-            return mask
-        
-        # Convert all segmented voxels to RAS
-        segmented_coords_ras = np.zeros((len(segmented_coords_ijk), 3))
-        for idx, (z, y, x) in enumerate(segmented_coords_ijk):
-            point_ijk = [x, y, z, 1.0]
-            point_ras = [0, 0, 0, 1.0]
-            ijkToRAS.MultiplyPoint(point_ijk, point_ras)
-            segmented_coords_ras[idx] = point_ras[:3]
-        
-        # Find nearest centerline point for each voxel
-        _, nearest_indices = tree.query(segmented_coords_ras)
-        
-        # Compute RADIAL distance (perpendicular to tangent)
-        vectors_to_voxels = segmented_coords_ras - centerline_ras[nearest_indices]
-        local_tangents = tangents[nearest_indices]
-        
-        # Project onto tangent to get axial component
-        axial_components = np.sum(vectors_to_voxels * local_tangents, axis=1, keepdims=True)
-        
-        # Radial = total minus axial projection
-        radial_vectors = vectors_to_voxels - axial_components * local_tangents
-        radial_distances = np.linalg.norm(radial_vectors, axis=1)
-        
-        # Also limit axial distance
-        axial_distances = np.abs(axial_components.ravel())
-        axial_max_mm = distance_max_mm * 1.5
-        
-        valid_indices = (radial_distances <= distance_max_mm) & (axial_distances <= axial_max_mm)
-        
-        filtered_mask = np.zeros_like(mask)
-        valid_coords = segmented_coords_ijk[valid_indices]
-        filtered_mask[valid_coords[:, 0], valid_coords[:, 1], valid_coords[:, 2]] = 1
-        
-        removed_voxels = len(segmented_coords_ijk) - np.sum(valid_indices)
-        removed_percent = 100 * removed_voxels / len(segmented_coords_ijk) if len(segmented_coords_ijk) > 0 else 0
-        print(f"  Voxels kept: {np.sum(valid_indices)}/{len(segmented_coords_ijk)} "
-              f"({removed_percent:.1f}% eliminated)")
-        
-        # Debug: compare radial vs euclidean
-        euclidean_distances, _ = tree.query(segmented_coords_ras)
-        n_would_differ = np.sum((euclidean_distances <= distance_max_mm) & (radial_distances > distance_max_mm))
-        print(f"  Radial filter rejected {n_would_differ} voxels that Euclidean would have kept")
-        
-        return filtered_mask.astype(np.uint8)
-    
-    def detecterPointsParoi(self, noeudMarkups, volumeInput, rayon_estime=6):
+        return CrohnBOOSTLib.calculerChampDistance(self.donneesVolume(volumeInput), self._pointsToArray(centerline_points),
+                                                   roi, workers=workers, chunk_size=chunk_size)
+
+    def preparerChampDistance(self, volumeInput, centerline_points, wall_points, rayon_estime=6, task=None):
+        """
+        Build the centerline distance field over the lesion ROI ahead of the first segmentation
+        (see LesionPipeline.preparerChampDistance). Takes the same node or NumPy inputs as
+        calculerSegmentationLesion. Returns the ROI.
+        """
+        return self.pipeline.preparerChampDistance(
+            self.donneesVolume(volumeInput), self._pointsToArray(centerline_points), self._pointsToArray(wall_points),
+            rayon_estime, task=task)
+
+    def invaliderChampDistance(self):
+        """Drop the cached centerline distance field (call when the centerline is modified)."""
+        self.pipeline.invaliderChampDistance()
+
+    def filtrer_par_distance_centerline(self, mask, centerline_points, volumeInput, rayon_estime=6, threshold_factor=0.5, workers=-1, offset_ijk=None):
+        """
+        Keeps only the mask voxels within the radial/axial distance limits of the centerline.
+        offset_ijk: (k, j, i) position of mask[0, 0, 0] in the volume when mask is an ROI crop;
+        the distances are then read from the cached centerline distance field.
+        """
+        volume = self.donneesVolume(volumeInput)
+        centerline_ras = self._pointsToArray(centerline_points)
+        champ = None
+        if offset_ijk is not None:
+            roi = tuple(slice(int(o), int(o) + n) for o, n in zip(offset_ijk, mask.shape))
+            champ = self.pipeline.obtenirChampDistance(volume, centerline_ras, roi, workers=workers)
+        return CrohnBOOSTLib.filtrerParDistanceCenterline(mask, centerline_ras, volume.ijkToRAS, rayon_estime,
+                                                          threshold_factor, workers=workers, champ=champ)
+
+    def detecterPointsParoi(self, noeudMarkups, volumeInput, rayon_estime=6, n_angles=32, n_samples=51):
         """
         Detects the wall points from the centerline.
         Returns the wall points or None if detection fails.
-        Now includes max distance outlier rejection per cross-section.
+        Synchronous wrapper around calculerPointsParoi for scripted use.
         """
-        import numpy as np
-        
         points = self.obtenirPointsDeLaCourbe(noeudMarkups)
         if points is None or points.GetNumberOfPoints() < 2:
             print("Not enough points to plot the curve.")
             return None
-                
-        progressDialog = slicer.util.createProgressDialog(
-            windowTitle="Wall detection",
-            labelText="Analysis in progress...",
-            maximum=points.GetNumberOfPoints(),
-            cancelButton=True
-        )
-        
-        wall_points = vtk.vtkPoints()
-        wall_cells = vtk.vtkCellArray()
-        point_count = 0
-        
-        spacing = volumeInput.GetSpacing()
-        search_distance = min(20, rayon_estime / min(spacing) * 0.8)
+        return self.calculerPointsParoi(points, volumeInput, rayon_estime, n_angles, n_samples)
 
-        print(f"Search distance : {search_distance} voxels")
-    
-        try:
-            for i in range(points.GetNumberOfPoints() - 1):
-                progressDialog.setValue(i)
-                progressDialog.setLabelText(f"Point analysis {i+1}/{points.GetNumberOfPoints()-1}...")
-                slicer.app.processEvents()
-                
-                if progressDialog.wasCanceled:
-                    return None
-                
-                p1 = np.array(points.GetPoint(i))
-                p2 = np.array(points.GetPoint(i + 1))
-                vecteur = p2 - p1
-                vecteur = vecteur / np.linalg.norm(vecteur)
-                vecteur_perpendiculaire = np.array([-vecteur[1], vecteur[0], 0])
-                
-                current_points = []
-                current_distances = []
-                detected_angles = []
-
-                angles = np.linspace(0, 2*np.pi, 32, endpoint=False)
-                for angle in angles:
-                    rot_matrix = np.array([[np.cos(angle), -np.sin(angle), 0],
-                                        [np.sin(angle), np.cos(angle), 0],
-                                        [0, 0, 1]])
-
-                    search_vector = np.dot(rot_matrix, vecteur_perpendiculaire) * search_distance
-                    end_point = p1 + search_vector
-                    intensities = self.sampleIntensitiesAlongLine(p1, end_point, volumeInput)
-                    wall_position = self.trouverParoi(intensities, p1, end_point)
-                    
-                    if wall_position is not None:
-                        distance = np.linalg.norm(wall_position - p1)
-                        current_points.append(wall_position)
-                        current_distances.append(distance)
-                        detected_angles.append(angle)
-
-                # Interpolate wall points for missing angular directions
-                if len(detected_angles) >= 4 and len(detected_angles) < len(angles):
-                    new_points, new_distances = self._interpolerPointsManquants(
-                        p1, detected_angles, current_distances,
-                        angles, vecteur_perpendiculaire)
-                    current_points.extend(new_points)
-                    current_distances.extend(new_distances)
-
-                if len(current_distances) > 0:
-                    median_distance = np.median(current_distances)
-                    distance_threshold_min = median_distance * 0.3
-                    distance_threshold_max = median_distance * 1.8  # ADDED: reject outliers too far
-                    
-                    for point, distance in zip(current_points, current_distances):
-                        if distance > distance_threshold_min and distance < distance_threshold_max:
-                            point_id = wall_points.InsertNextPoint(point)
-                            cell = vtk.vtkVertex()
-                            cell.GetPointIds().SetId(0, point_count)
-                            wall_cells.InsertNextCell(cell)
-                            point_count += 1
-        finally:
-            progressDialog.close()
-            
-        if point_count == 0:
-            print("No wall point detected!")
+    def calculerPointsParoi(self, points, volumeInput, rayon_estime=6, n_angles=32, n_samples=51):
+        """
+        Wall points (vtkPoints) from the centerline points, or None if detection fails.
+        Main thread only; see calculerPointsParoiRAS for a BackgroundTask.
+        """
+        wall_ras = self.calculerPointsParoiRAS(self._pointsToArray(points), self.donneesVolume(volumeInput),
+                                               rayon_estime, n_angles, n_samples)
+        if wall_ras is None:
             return None
-            
-        return wall_points
-    
-    def segmenterGraisse(self, fatVolumeInput, lesionVolumeInput, pointsNode, segmentationNode, lesionSegNode=None):
-        import numpy as np 
-        from scipy import ndimage
-        
+        return self._arrayToPoints(wall_ras)
+
+    def calculerPointsParoiRAS(self, centerline_ras, volume, rayon_estime=6, n_angles=32, n_samples=51, task=None):
+        """
+        (M, 3) RAS wall points from an (N, 3) RAS centerline and a VolumeData, or None if
+        detection fails. NumPy only, so it can run on a BackgroundTask thread.
+        task: optional BackgroundTask for progress and cancellation.
+        """
+        if centerline_ras is None:
+            print("Not enough points to plot the curve.")
+            return None
+        return CrohnBOOSTLib.detecterPointsParoi(volume, centerline_ras, rayon_estime, n_angles, n_samples, task=task)
+
+    def segmenterGraisse(self, fatVolumeInput, lesionVolumeInput, pointsNode, segmentationNode, lesionSegNode=None, min_volume_mm3=0.0):
         lesion_mask = None 
         if lesionSegNode is not None: 
-            labelmapVolumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
-            slicer.modules.segmentations.logic().ExportVisibleSegmentsToLabelmapNode(
-                lesionSegNode, labelmapVolumeNode, lesionVolumeInput)
-            lesion_mask = slicer.util.arrayFromVolume(labelmapVolumeNode)
-            slicer.mrmlScene.RemoveNode(labelmapVolumeNode)
+            with CrohnBOOSTLib.span('fat.export_lesion'):
+                labelmapVolumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+                slicer.modules.segmentations.logic().ExportVisibleSegmentsToLabelmapNode(
+                    lesionSegNode, labelmapVolumeNode, lesionVolumeInput)
+                lesion_mask = slicer.util.arrayFromVolume(labelmapVolumeNode)
+                slicer.mrmlScene.RemoveNode(labelmapVolumeNode)
             print("Lesion mask loaded to guide fat segmentation")
-        
-        volume_array = slicer.util.arrayFromVolume(fatVolumeInput)
-        spacing = fatVolumeInput.GetSpacing()
-        print(f"Voxel spacing: {spacing[0]:.2f} x {spacing[1]:.2f} x {spacing[2]:.2f} mm")
-        xy_spacing = min(spacing[0], spacing[1])
-        z_spacing = spacing[2]
-        anisotropy_ratio = z_spacing / xy_spacing
-        print(f"Ratio d'anisotropie Z/XY: {anisotropy_ratio:.2f}")
-        
-        mask = np.zeros_like(volume_array, dtype=np.uint8)
-        
-        rasToIJK = vtk.vtkMatrix4x4()
-        fatVolumeInput.GetRASToIJKMatrix(rasToIJK)
-
-        fat_intensities = []
-        fat_points_ijk = []
 
+        fat_points_ras = []
         for i in range(pointsNode.GetNumberOfControlPoints()): 
             pos = [0, 0, 0]
             pointsNode.GetNthControlPointPosition(i, pos) 
+            fat_points_ras.append(pos)
 
-            posRAS = list(pos) + [1.0]
-            posIJK = [0, 0, 0, 1.0]
-            rasToIJK.MultiplyPoint(posRAS, posIJK)
-            x, y, z = [int(round(posIJK[j])) for j in range(3)]
-
-            if (0 <= z < mask.shape[0] and
-                0 <= y < mask.shape[1] and 
-                0 <= x < mask.shape[2]):
-                intensity = volume_array[z, y, x]
-                fat_intensities.append(intensity) 
-                fat_points_ijk.append([z, y, x]) 
-        
-        if not fat_intensities:
-            print("No valid point for fat segmentation.") 
+        fat_mask = CrohnBOOSTLib.segmenterGraisse(self.donneesVolume(fatVolumeInput), fat_points_ras,
+                                                  lesion_mask=lesion_mask, min_volume_mm3=min_volume_mm3)
+        if fat_mask is None:
             return False
-
-        fat_intensities = np.array(fat_intensities)
-        fat_points_ijk = np.array(fat_points_ijk)
-
-        mean_intensity = np.mean(fat_intensities) 
-        std_intensity = np.std(fat_intensities)
-        
-        intensity_min = mean_intensity - 3.0 * std_intensity
-        intensity_max = mean_intensity + 3.0 * std_intensity
-        
-        print(f"Detected fat points: {len(fat_intensities)}")
-        print(f"Mean intensity: {mean_intensity:.2f} ± {std_intensity:.2f}")
-        print(f"Intensity range: [{intensity_min:.2f}, {intensity_max:.2f}]")
-
-        intensity_mask = np.zeros_like(volume_array, dtype=np.uint8)
-        if lesion_mask is not None: 
-            intensity_mask[(volume_array >= intensity_min) & 
-                        (volume_array <= intensity_max) &
-                        (lesion_mask == 0)] = 1 
-        else: 
-            intensity_mask[(volume_array >= intensity_min) &
-                        (volume_array <= intensity_max)] = 1 
-        
-        z_scale = max(1, int(round(anisotropy_ratio)))
-        struct_size = (
-            max(1, min(3, int(round(5 / spacing[2])))),
-            3,
-            3
-        )
-        print(f"Size of the anisotropic structuring element: {struct_size}")
-        struct_aniso = np.ones(struct_size, dtype=np.uint8)
-        
-        seed_mask = np.zeros_like(volume_array, dtype=np.uint8)
-        for z, y, x in fat_points_ijk: 
-            seed_mask[z, y, x] = 1
-        
-        if lesion_mask is not None:
-            border_struct = ndimage.generate_binary_structure(3, 1)
-            lesion_border = ndimage.binary_dilation(
-                lesion_mask > 0, 
-                structure=border_struct,
-                iterations=1
-            ) & ~(lesion_mask > 0)
-            
-            border_points = np.where(lesion_border & intensity_mask)
-            for z, y, x in zip(*border_points):
-                seed_mask[z, y, x] = 1
-        
-        fat_mask = seed_mask.copy()
-        max_iterations = 25
-        
-        for iteration in range(max_iterations):
-            struct_xy = np.zeros((1, 3, 3), dtype=np.uint8)
-            struct_xy[0, 1, 1] = 1
-            struct_xy[0, 0, 1] = 1
-            struct_xy[0, 2, 1] = 1
-            struct_xy[0, 1, 0] = 1
-            struct_xy[0, 1, 2] = 1
-            
-            dilated_xy = ndimage.binary_dilation(fat_mask, structure=struct_xy)
-            new_mask_xy = (dilated_xy & intensity_mask).astype(np.uint8)
-            
-            if lesion_mask is not None:
-                new_mask_xy = new_mask_xy & (lesion_mask == 0)
-            
-            if np.array_equal(new_mask_xy, fat_mask):
-                break
-                
-            fat_mask = new_mask_xy
-        
-        z_iterations = max(3, int(max_iterations / anisotropy_ratio))
-        print(f"Itérations en Z: {z_iterations}")
-        
-        for iteration in range(z_iterations):
-            struct_z = np.zeros((3, 1, 1), dtype=np.uint8)
-            struct_z[0, 0, 0] = 1
-            struct_z[1, 0, 0] = 1
-            struct_z[2, 0, 0] = 1
-            
-            dilated_z = ndimage.binary_dilation(fat_mask, structure=struct_z)
-            new_mask_z = (dilated_z & intensity_mask).astype(np.uint8)
-            
-            support_xy = ndimage.binary_dilation(
-                new_mask_z, 
-                structure=struct_xy,
-                iterations=1
-            )
-            new_mask_z = new_mask_z & support_xy
-            
-            if lesion_mask is not None:
-                new_mask_z = new_mask_z & (lesion_mask == 0)
-            
-            if np.array_equal(new_mask_z, fat_mask):
-                break
-                
-            fat_mask = new_mask_z
-        
-        
-        fat_mask = ndimage.binary_closing(
-            fat_mask, 
-            structure=struct_aniso,
-            iterations=2
-        ).astype(np.uint8)
-        
-        fat_mask = ndimage.binary_opening(
-            fat_mask, 
-            structure=struct_aniso,
-            iterations=1
-        ).astype(np.uint8)
-        
-        labeled_array, num_features = ndimage.label(fat_mask)
-        if num_features > 1:
-            sizes = np.bincount(labeled_array.ravel())[1:]
-            
-            threshold_size = max(10, int(np.max(sizes) * 0.1))
-            mask_cleaned = np.zeros_like(fat_mask)
-            
-            for label in range(1, num_features + 1):
-                if sizes[label-1] >= threshold_size:
-                    mask_cleaned[labeled_array == label] = 1
-                    
-            fat_mask = mask_cleaned.astype(np.uint8)
-        
-        fat_mask = ndimage.binary_closing(
-            fat_mask, 
-            structure=struct_aniso,
-            iterations=1
-        ).astype(np.uint8)
-        
-        print(f"Final number of segmented voxels: {np.sum(fat_mask)}")
         
         segmentId = segmentationNode.GetSegmentation().GetSegmentIdBySegmentName("Creeping_Fat")
         if not segmentId:
@@ -1903,18 +2279,19 @@ class CrohnBOOSTLogic(ScriptedLoadableModuleLogic):
         else:
             print("Updating the existing Creeping_Fat segment")
         
-        labelmapVolumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
-        labelmapVolumeNode.SetName("TempLabelMap_Fat")
-        slicer.util.updateVolumeFromArray(labelmapVolumeNode, fat_mask)
-        labelmapVolumeNode.CopyOrientation(fatVolumeInput) 
-        
-        segmentIds = vtk.vtkStringArray()
-        segmentIds.InsertNextValue(segmentId)
-        slicer.modules.segmentations.logic().ImportLabelmapToSegmentationNode(
-            labelmapVolumeNode, 
-            segmentationNode,
-            segmentIds
-        )
+        with CrohnBOOSTLib.span('fat.import'):
+            labelmapVolumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+            labelmapVolumeNode.SetName("TempLabelMap_Fat")
+            slicer.util.updateVolumeFromArray(labelmapVolumeNode, fat_mask)
+            labelmapVolumeNode.CopyOrientation(fatVolumeInput) 
+            
+            segmentIds = vtk.vtkStringArray()
+            segmentIds.InsertNextValue(segmentId)
+            slicer.modules.segmentations.logic().ImportLabelmapToSegmentationNode(
+                labelmapVolumeNode, 
+                segmentationNode,
+                segmentIds
+            )
         
         # Force yellow color after import
         seg = segmentationNode.GetSegmentation().GetSegment(segmentId)
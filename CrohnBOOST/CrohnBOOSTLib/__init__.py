@@ -0,0 +1,55 @@
+"""
+Headless CrohnBOOST core: wall detection, lesion and creeping fat segmentation on
+NumPy arrays. Depends on NumPy and SciPy only (no Slicer, VTK or Qt), so it can be
+profiled, tested and run outside the Slicer GUI; CrohnBOOSTLogic adapts MRML nodes to it.
+"""
+
+from .ai import (
+    AI_PACKAGES,
+    AI_REGIONS,
+    CPU_PRECISIONS,
+    OptionsCPU,
+    boiteCorps,
+    boiteDesPoints,
+    choisirDevice,
+    collerPrediction,
+    configurerThreadsCPU,
+    contexteInferenceCPU,
+    creerPredicteur,
+    dependancesAIDisponibles,
+    margePatch,
+    margePatchModele,
+    normalisationModele,
+    normalisationPredicteur,
+    normaliserZScore,
+    optimiserPredicteurCPU,
+    predireFile,
+    predirePretraite,
+    predireTableau,
+    preparerEntreeNNUNet,
+    pretraiterNNUNet,
+    restaurerThreadsCPU,
+    roiInference,
+    statistiquesNormalisation,
+)
+from .cache import StageCache
+from .fat import croissanceGeodesique, croissanceGraisse, segmenterGraisse
+from .lesion import (
+    LESION_STAGE_INPUTS,
+    LesionPipeline,
+    calculerChampDistance,
+    calculerROI,
+    computeValleyMask,
+    expanderSegmentation,
+    expansion_locale_adjacente,
+    filtrerComposantes,
+    filtrerParDistanceCenterline,
+    margesROI,
+    remplirTrous,
+)
+from .metrics import calculerDICE, calculerVolume
+from .tasks import BackgroundTask, TaskCancelled
+from .tracing import TRACER, Span, Tracer, span
+from .volume import VolumeData, pointsFingerprint
+from .wall import detecterPointsParoi, trouverParoi, trouverParoiBatch
+from .worker import InferenceJob, InferenceWorker
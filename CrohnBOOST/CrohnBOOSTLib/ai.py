@@ -0,0 +1,500 @@
+import contextlib
+import os
+import queue
+import threading
+
+import numpy as np
+
+from .fileio import geometrieLPS
+
+
+def preparerEntreeNNUNet(volume):
+    """
+    nnU-Net input of a VolumeData without going through a NIfTI file: the (1, k, j, i)
+    float32 image and the properties dictionary predict_single_npy_array expects
+    (what nnU-Net's SimpleITK reader would have produced from the exported volume).
+    """
+    spacing, origin, direction = geometrieLPS(volume)
+    data = volume.array.astype(np.float32)[np.newaxis]
+    properties = {
+        'sitk_stuff': {
+            'spacing': spacing,
+            'origin': origin,
+            'direction': direction,
+        },
+        'spacing': spacing[::-1],
+    }
+    return data, properties
+
+
+# Packages the AI segmentation imports (blosc2: nnU-Net's compressed arrays)
+AI_PACKAGES = ('torch', 'nnunetv2', 'blosc2')
+
+CPU_PRECISIONS = ('fp32', 'bf16')
+
+# Intra-op / inter-op thread counts PyTorch had before configurerThreadsCPU first changed them
+_threadsParDefaut = None
+
+
+def dependancesAIDisponibles():
+    """Whether the AI packages are installed, found with importlib.util.find_spec (nothing is imported)."""
+    import importlib.util
+
+    for name in AI_PACKAGES:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return False
+        except (ImportError, ValueError):
+            return False
+    return True
+
+
+class OptionsCPU:
+    """
+    Settings of the optimised CPU inference mode.
+    threads: intra-op threads (0 = one per CPU core); interop_threads: inter-op threads (0 = PyTorch default)
+    precision: 'fp32' or 'bf16' (bfloat16 autocast)
+    channels_last: store the convolution weights in channels-last layout
+    """
+
+    def __init__(self, threads=0, interop_threads=0, precision='fp32', channels_last=False):
+        if precision not in CPU_PRECISIONS:
+            raise ValueError(f"precision must be one of {CPU_PRECISIONS}, got {precision!r}")
+        self.threads = int(threads)
+        self.interop_threads = int(interop_threads)
+        self.precision = precision
+        self.channels_last = bool(channels_last)
+
+    @property
+    def key(self):
+        """What changes the network itself (part of the predictor cache key)."""
+        return (self.precision, self.channels_last)
+
+    def __repr__(self):
+        return (f"OptionsCPU(threads={self.threads}, interop_threads={self.interop_threads}, "
+                f"precision={self.precision!r}, channels_last={self.channels_last})")
+
+
+def _fixerThreadsNNUNet(n):
+    # predict_logits_from_preprocessed_data caps torch threads to nnU-Net's default_num_processes
+    try:
+        from nnunetv2.inference import predict_from_raw_data
+    except ImportError:
+        return
+    predict_from_raw_data.default_num_processes = n
+
+
+def configurerThreadsCPU(options):
+    """
+    Apply the thread counts of an OptionsCPU to PyTorch (and to nnU-Net, which otherwise
+    caps inference to its own default). Returns the (intra-op, inter-op) counts in effect.
+    """
+    import torch
+
+    global _threadsParDefaut
+    if _threadsParDefaut is None:
+        _threadsParDefaut = (torch.get_num_threads(), torch.get_num_interop_threads())
+
+    threads = options.threads or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    _fixerThreadsNNUNet(threads)
+    if options.interop_threads and options.interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(options.interop_threads)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel work of the process
+            print("Inter-op thread count already fixed for this session, keeping "
+                  f"{torch.get_num_interop_threads()}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def restaurerThreadsCPU():
+    """Put back the intra-op thread count PyTorch used before configurerThreadsCPU."""
+    if _threadsParDefaut is None:
+        return
+    import torch
+    torch.set_num_threads(_threadsParDefaut[0])
+    _fixerThreadsNNUNet(_threadsParDefaut[0])
+
+
+def optimiserPredicteurCPU(predictor, options):
+    """
+    Prepare the network of an initialised nnUNetPredictor for CPU inference:
+    eval mode and optional channels-last weights.
+    nnU-Net reloads the fold parameters before every prediction, so with a single fold
+    they are replaced by the converted network's own state dict.
+    """
+    import torch
+
+    network = predictor.network
+    network.eval()
+    single_fold = len(predictor.list_of_parameters) == 1
+
+    if options.channels_last:
+        conv3d = any(isinstance(m, torch.nn.Conv3d) for m in network.modules())
+        network = network.to(memory_format=torch.channels_last_3d if conv3d else torch.channels_last)
+
+    predictor.network = network
+    if single_fold:
+        predictor.list_of_parameters = [network.state_dict()]
+    return predictor
+
+
+@contextlib.contextmanager
+def contexteInferenceCPU(options):
+    """torch.inference_mode, plus bfloat16 autocast when options.precision is 'bf16'."""
+    import torch
+
+    with torch.inference_mode():
+        if options.precision == 'bf16':
+            with torch.autocast('cpu', dtype=torch.bfloat16):
+                yield
+        else:
+            yield
+
+
+# Where AI inference runs: the whole volume or a padded crop around the centerline curve,
+# a markups ROI or the detected body
+AI_REGIONS = ('volume', 'centerline', 'markups_roi', 'body')
+
+
+def margePatch(predictor):
+    """
+    Half the network patch size in mm, in the (k, j, i) order of the input volume.
+    Padding an ROI by this much gives every voxel of interest a full patch of context.
+    """
+    configuration = predictor.configuration_manager
+    transpose_forward = predictor.plans_manager.transpose_forward
+    marge = np.zeros(3)
+    for axis_pre, axis_kji in enumerate(transpose_forward):
+        marge[axis_kji] = 0.5 * configuration.patch_size[axis_pre] * configuration.spacing[axis_pre]
+    return marge
+
+
+def boiteDesPoints(volume, points_ras):
+    """(lower, upper) (k, j, i) bounding box of (N, 3) RAS points, upper exclusive, clipped to the volume."""
+    points_ras = np.asarray(points_ras, dtype=np.float64).reshape(-1, 3)
+    if len(points_ras) == 0:
+        return None
+    points_kji = volume.rasToKJI(points_ras)
+    lower = np.maximum(points_kji.min(axis=0), 0)
+    upper = np.minimum(points_kji.max(axis=0) + 1, volume.shape)
+    if np.any(upper <= lower):
+        return None
+    return lower, upper
+
+
+def boiteCorps(volume, fraction=0.1, min_profile=0.02):
+    """
+    (lower, upper) (k, j, i) bounding box of the body: voxels brighter than fraction of the
+    99.5th intensity percentile, ignoring planes holding less than min_profile of the
+    busiest plane of their axis (isolated noise and artefacts outside the patient).
+    """
+    array = volume.array
+    threshold = fraction * np.percentile(array[::2, ::4, ::4], 99.5)
+    mask = array > threshold
+    lower, upper = [], []
+    for axis in range(3):
+        profile = mask.sum(axis=tuple(a for a in range(3) if a != axis))
+        kept = np.flatnonzero(profile > min_profile * profile.max()) if profile.max() > 0 else []
+        if len(kept) == 0:
+            return None
+        lower.append(kept[0])
+        upper.append(kept[-1] + 1)
+    return np.array(lower), np.array(upper)
+
+
+def roiInference(volume, boite, marge_mm):
+    """
+    Tuple of (k, j, i) slices of a (lower, upper) box padded by marge_mm (per axis, in mm),
+    clipped to the volume. None when the box is missing.
+    """
+    if boite is None:
+        return None
+    lower, upper = boite
+    spacing_kji = np.array(volume.spacing[::-1])
+    pad = np.ceil(np.asarray(marge_mm, dtype=np.float64) / spacing_kji).astype(int)
+    lower = np.maximum(np.asarray(lower) - pad, 0)
+    upper = np.minimum(np.asarray(upper) + pad, volume.shape)
+    roi = tuple(slice(int(lo), int(hi)) for lo, hi in zip(lower, upper))
+    roi_fraction = 100.0 * np.prod(upper - lower) / np.prod(volume.shape)
+    print(f"AI inference ROI: {tuple(int(v) for v in upper - lower)} voxels ({roi_fraction:.1f}% of the volume)")
+    return roi
+
+
+def collerPrediction(shape, roi, prediction):
+    """Full-size uint8 label array with the ROI prediction pasted back (background elsewhere)."""
+    if roi is None:
+        return np.asarray(prediction, dtype=np.uint8)
+    full = np.zeros(shape, dtype=np.uint8)
+    full[roi] = prediction
+    return full
+
+
+def statistiquesNormalisation(volume, schemes, use_mask_for_norm):
+    """
+    (mean, std) nnU-Net's ZScoreNormalization computes on the whole single-channel
+    VolumeData: over the filled nonzero mask with use_mask_for_norm, else over the mask's
+    bounding box (crop_to_nonzero). None when channel 0 is not z-score normalised.
+    An ROI crop z-scored with its own statistics would not see the intensities the network
+    sees on the whole volume; pretraiterNNUNet(normalisation=...) applies these instead.
+    schemes, use_mask_for_norm: per-channel settings of the configuration
+    (normalisationPredicteur / normalisationModele).
+    """
+    from scipy import ndimage
+
+    if schemes[0] != 'ZScoreNormalization':
+        if schemes[0] == 'RescaleTo01Normalization':
+            print("AI inference ROI: per-image 0-1 rescaling uses the crop's own range")
+        return None
+    array = volume.array
+    mask = ndimage.binary_fill_holes(array != 0)
+    if not np.any(mask):
+        values = array
+    elif use_mask_for_norm[0]:
+        values = array[mask]
+    else:
+        bbox = tuple(slice(int(indices.min()), int(indices.max()) + 1) for indices in np.nonzero(mask))
+        values = array[bbox]
+    return float(np.mean(values, dtype=np.float64)), float(np.std(values, dtype=np.float64))
+
+
+def normalisationPredicteur(predictor):
+    """(normalization_schemes, use_mask_for_norm) of an initialised nnUNetPredictor."""
+    configuration = predictor.configuration_manager
+    return configuration.normalization_schemes, configuration.use_mask_for_norm
+
+
+def normaliserZScore(image, mask, normalisation):
+    """
+    ZScoreNormalization.run with fixed (mean, std) statistics: float32 image z-scored
+    inside mask (a boolean array, or None for every voxel), in place.
+    """
+    mean, std = normalisation
+    std = max(std, 1e-8)
+    if mask is None:
+        image -= mean
+        image /= std
+    else:
+        image[mask] = (image[mask] - mean) / std
+    return image
+
+
+def choisirDevice(min_gpu_gb=6.0):
+    """CUDA when a GPU with at least min_gpu_gb of memory is available, otherwise the CPU."""
+    import torch
+
+    if torch.cuda.is_available():
+        gpu_name = torch.cuda.get_device_name(0)
+        gpu_mem = torch.cuda.get_device_properties(0).total_memory / 1e9
+        print(f"GPU detected: {gpu_name} ({gpu_mem:.1f} GB)")
+        if gpu_mem >= min_gpu_gb:
+            return torch.device('cuda')
+        print(f"GPU VRAM too low ({gpu_mem:.1f} GB), using CPU instead")
+    return torch.device('cpu')
+
+
+def creerPredicteur(model_folder, device, use_folds=(0,), checkpoint_name=None, optionsCPU=None):
+    """
+    Initialised nnUNetPredictor (optionsCPU, if given, applied to its network).
+    checkpoint_name: default the slim inference checkpoint when present (memory-mapped,
+    see CrohnBOOSTLib.model), else the training checkpoint.
+    """
+    from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+
+    from .model import SLIM_CHECKPOINT, choisirCheckpoint, initialiserPredicteurLeger
+
+    if checkpoint_name is None:
+        checkpoint_name = choisirCheckpoint(model_folder, use_folds)
+
+    predictor = nnUNetPredictor(
+        tile_step_size=0.5,
+        use_gaussian=True,
+        use_mirroring=False,
+        perform_everything_on_device=False,
+        device=device,
+        verbose=True,
+        verbose_preprocessing=True,
+        allow_tqdm=True
+    )
+    if checkpoint_name == SLIM_CHECKPOINT:
+        initialiserPredicteurLeger(predictor, model_folder, use_folds)
+    else:
+        predictor.initialize_from_trained_model_folder(
+            model_folder,
+            use_folds=use_folds,
+            checkpoint_name=checkpoint_name
+        )
+    print(f"AI model loaded from {checkpoint_name}")
+    if optionsCPU is not None:
+        optimiserPredicteurCPU(predictor, optionsCPU)
+    return predictor
+
+
+def _avecRepliCPU(predictor, passe):
+    """passe(), retried on the CPU when a GPU runs out of memory (predictor.device tells which ran)."""
+    import torch
+
+    try:
+        return passe()
+    except RuntimeError as e:
+        if "out of memory" not in str(e).lower():
+            raise
+        print("GPU out of memory, falling back to CPU...")
+        torch.cuda.empty_cache()
+        predictor.device = torch.device('cpu')
+        predictor.network = predictor.network.to('cpu')
+        return passe()
+
+
+def predireTableau(predictor, data, properties, optionsCPU=None, normalisation=None):
+    """
+    Label array of a preparerEntreeNNUNet input. When a GPU runs out of memory the
+    predictor is moved to the CPU and the prediction retried (predictor.device tells which ran).
+    normalisation: full-volume statistics of a crop (statistiquesNormalisation), see pretraiterNNUNet.
+    """
+    if normalisation is not None:
+        return predirePretraite(predictor, *pretraiterNNUNet(predictor, data, properties, normalisation),
+                                optionsCPU)
+
+    def passe():
+        if optionsCPU is not None and predictor.device.type == 'cpu':
+            with contexteInferenceCPU(optionsCPU):
+                return predictor.predict_single_npy_array(data, properties, None, None, False)
+        return predictor.predict_single_npy_array(data, properties, None, None, False)
+
+    return _avecRepliCPU(predictor, passe)
+
+
+def pretraiterNNUNet(predictor, data, properties, normalisation=None):
+    """
+    nnU-Net preprocessing (cropping, normalisation, resampling) of a preparerEntreeNNUNet
+    input, as (tensor, properties). NumPy/SciPy work only, so it can run beside a network pass.
+    normalisation: (mean, std) z-scoring channel 0 instead of the input's own statistics,
+    for a crop to be normalised like its whole volume (statistiquesNormalisation).
+    """
+    import copy
+    import torch
+
+    preprocessor = predictor.configuration_manager.preprocessor_class(verbose=False)
+    if normalisation is not None:
+        def normaliser(data, seg, configuration_manager, foreground_intensity_properties_per_channel):
+            # seg is -1 outside the nonzero mask (crop_to_nonzero)
+            mask = seg[0] >= 0 if configuration_manager.use_mask_for_norm[0] else None
+            data[0] = normaliserZScore(data[0].astype(np.float32, copy=False), mask, normalisation)
+            return data
+        preprocessor._normalize = normaliser
+    properties = copy.deepcopy(properties)
+    data, _ = preprocessor.run_case_npy(data, None, properties, predictor.plans_manager,
+                                        predictor.configuration_manager, predictor.dataset_json)
+    return torch.from_numpy(data).to(dtype=torch.float32, memory_format=torch.contiguous_format), properties
+
+
+def predirePretraite(predictor, data, properties, optionsCPU=None):
+    """Label array of a pretraiterNNUNet output: network pass, then back to the input geometry."""
+    from nnunetv2.inference.export_prediction import convert_predicted_logits_to_segmentation_with_correct_shape
+
+    def passe():
+        if optionsCPU is not None and predictor.device.type == 'cpu':
+            with contexteInferenceCPU(optionsCPU):
+                return predictor.predict_logits_from_preprocessed_data(data).cpu()
+        return predictor.predict_logits_from_preprocessed_data(data).cpu()
+
+    logits = _avecRepliCPU(predictor, passe)
+    return convert_predicted_logits_to_segmentation_with_correct_shape(
+        logits, predictor.plans_manager, predictor.configuration_manager, predictor.label_manager,
+        properties, return_probabilities=False)
+
+
+def predireFile(predictor, volumes, optionsCPU=None, rois=None, profondeur=1):
+    """
+    Predict a sequence of VolumeData with one loaded predictor. Generator of
+    (index, labels, error) in input order, as each prediction is done: labels is the
+    full-size uint8 array (ROI prediction pasted back), error the exception of a failed volume.
+    A producer thread prepares and preprocesses up to profondeur volumes ahead while the
+    network runs on the current one. rois: optional (k, j, i) slices (or None) per volume,
+    normalised with the statistics of the whole volume.
+    Closing the generator stops the producer.
+    """
+    file = queue.Queue(maxsize=max(1, profondeur))
+    arret = threading.Event()
+
+    def deposer(item):
+        while not arret.is_set():
+            try:
+                file.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produire():
+        try:
+            for index, volume in enumerate(volumes):
+                if arret.is_set():
+                    return
+                roi = rois[index] if rois is not None else None
+                try:
+                    normalisation = None
+                    if roi is not None:
+                        normalisation = statistiquesNormalisation(volume, *normalisationPredicteur(predictor))
+                    data, properties = preparerEntreeNNUNet(volume.sousVolume(roi) if roi is not None else volume)
+                    deposer((index, roi, volume.shape,
+                             pretraiterNNUNet(predictor, data, properties, normalisation), None))
+                except Exception as e:
+                    deposer((index, roi, None, None, e))
+        finally:
+            deposer(None)
+
+    producteur = threading.Thread(target=produire, name='nnU-Net preprocessing', daemon=True)
+    producteur.start()
+    try:
+        while True:
+            item = file.get()
+            if item is None:
+                return
+            index, roi, shape, pretraite, erreur = item
+            if erreur is not None:
+                yield index, None, erreur
+                continue
+            try:
+                prediction = predirePretraite(predictor, *pretraite, optionsCPU)
+            except Exception as e:
+                yield index, None, e
+                continue
+            yield index, collerPrediction(shape, roi, prediction), None
+    finally:
+        arret.set()
+        producteur.join()
+
+
+def _configurationModele(model_folder):
+    """
+    (plans, configuration) dictionaries of a trained model folder (named
+    <trainer>__<plans>__<configuration>), inheritance resolved, from its plans.json.
+    """
+    import json
+
+    configuration_name = os.path.basename(os.path.normpath(model_folder)).split('__')[-1]
+    with open(os.path.join(model_folder, 'plans.json'), encoding='utf-8') as f:
+        plans = json.load(f)
+    configuration = dict(plans['configurations'][configuration_name])
+    while 'inherits_from' in configuration:
+        parent = plans['configurations'][configuration.pop('inherits_from')]
+        configuration = {**parent, **configuration}
+    return plans, configuration
+
+
+def margePatchModele(model_folder):
+    """margePatch read from the plans.json of a trained model folder, without loading the network."""
+    plans, configuration = _configurationModele(model_folder)
+    transpose_forward = plans.get('transpose_forward', [0, 1, 2])
+    marge = np.zeros(3)
+    for axis_pre, axis_kji in enumerate(transpose_forward):
+        marge[axis_kji] = 0.5 * configuration['patch_size'][axis_pre] * configuration['spacing'][axis_pre]
+    return marge
+
+
+def normalisationModele(model_folder):
+    """normalisationPredicteur read from the plans.json of a trained model folder."""
+    _, configuration = _configurationModele(model_folder)
+    return configuration['normalization_schemes'], configuration['use_mask_for_norm']
@@ -0,0 +1,297 @@
+"""
+Batch segmentation of a cohort without Slicer:
+
+    python -m CrohnBOOSTLib.batch manifest.csv --output results/ [--workers N] [--threads T] [--timeout 900]
+
+manifest.csv has one case per row, paths relative to the manifest:
+    case_id, lesion_volume (_W NIfTI/NRRD), centerline (.mrk.json)
+    optional: fat_volume (_F), fat_points (.mrk.json), sensitivity (0-100, default 50),
+              radius (mm, default 6), min_volume_mm3 (default 0)
+
+Each case runs in its own process (up to --workers at a time, default one per CPU)
+and is killed after --timeout seconds. The CPUs are shared between the processes:
+each case uses --threads threads (default CPUs / workers) for the KD-tree queries,
+hole filling and BLAS/OpenMP, so the machine is not oversubscribed. Labelmaps and a result.json are written to
+results/<case_id>/; cases whose result.json reports success are skipped on the next
+run unless --force is given. results/volumes.csv collects the volumes of all cases.
+With --trace, each case also gets a Chrome trace of its pipeline stages (trace.json).
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+
+DEFAULT_SENSITIVITY = 50
+DEFAULT_RADIUS = 6
+RESULT_FILE = 'result.json'
+CSV_COLUMNS = ['case_id', 'status', 'seconds',
+               'lesion_mm3', 'lesion_cm3', 'lesion_voxels',
+               'fat_mm3', 'fat_cm3', 'fat_voxels', 'error']
+# Read by the OpenMP/BLAS runtimes when NumPy and SciPy are imported in a case process
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def caseIdValide(case_id):
+    """case_id is used as a directory name under the output directory: no path separator or '..'."""
+    return bool(case_id) and not any(sep in case_id for sep in ('/', '\\')) and '..' not in case_id
+
+
+def lireManifeste(path):
+    """Cases of a manifest CSV, with paths resolved relative to the manifest."""
+    path = Path(path)
+    cases = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+            if not row.get('case_id'):
+                continue
+            for key in ('lesion_volume', 'centerline', 'fat_volume', 'fat_points'):
+                if row.get(key):
+                    row[key] = str(path.parent / row[key])
+            cases.append(row)
+
+    missing = [case['case_id'] for case in cases if not case.get('lesion_volume') or not case.get('centerline')]
+    if missing:
+        raise ValueError(f"Cases without lesion_volume or centerline: {', '.join(missing)}")
+    invalid = [case['case_id'] for case in cases if not caseIdValide(case['case_id'])]
+    if invalid:
+        raise ValueError(f"case_id values must not contain path separators or '..': {', '.join(invalid)}")
+    ids = [case['case_id'] for case in cases]
+    if len(set(ids)) != len(ids):
+        raise ValueError("case_id values must be unique")
+    return cases
+
+
+def _ecrireJSON(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def segmenterCas(case, case_dir, threads=-1):
+    """
+    Segment one manifest case and write its labelmaps into case_dir.
+    threads: KD-tree and hole filling threads of the lesion pipeline (-1 = all cores).
+    Returns the result dictionary (also written to case_dir/result.json).
+    """
+    from .fat import segmenterGraisse
+    from .fileio import ecrireLabelmap, interpolerCourbe, lireMarkups, lireVolume
+    from .lesion import LesionPipeline
+    from .metrics import calculerVolume
+    from .wall import detecterPointsParoi
+
+    start = time.time()
+    case_dir = Path(case_dir)
+    case_dir.mkdir(parents=True, exist_ok=True)
+
+    threshold_factor = float(case.get('sensitivity') or DEFAULT_SENSITIVITY) / 100.0
+    rayon_estime = float(case.get('radius') or DEFAULT_RADIUS)
+    min_volume_mm3 = float(case.get('min_volume_mm3') or 0.0)
+    result = {'case_id': case['case_id'], 'status': 'ok', 'error': ''}
+
+    volume = lireVolume(case['lesion_volume'])
+    centerline = interpolerCourbe(lireMarkups(case['centerline']))
+    wall = detecterPointsParoi(volume, centerline, rayon_estime)
+    if wall is None:
+        raise RuntimeError("No wall point detected")
+
+    _, lesion_mask = LesionPipeline(workers=threads).calculerSegmentation(
+        volume, centerline, wall, threshold_factor, rayon_estime, min_volume_mm3=min_volume_mm3)
+    ecrireLabelmap(case_dir / 'lesion.nrrd', lesion_mask, volume)
+    result['lesion_mm3'], result['lesion_cm3'], result['lesion_voxels'] = calculerVolume(lesion_mask, volume.spacing)
+
+    if case.get('fat_volume') and case.get('fat_points'):
+        fat_volume = lireVolume(case['fat_volume'])
+        # Like the module, the lesion is only excluded when both volumes share the same grid
+        guide = lesion_mask if fat_volume.shape == volume.shape else None
+        if guide is None:
+            print(f"{case['case_id']}: fat volume grid differs from the lesion volume, lesion not excluded")
+        fat_mask = segmenterGraisse(fat_volume, lireMarkups(case['fat_points']),
+                                    lesion_mask=guide, min_volume_mm3=min_volume_mm3)
+        if fat_mask is not None:
+            ecrireLabelmap(case_dir / 'fat.nrrd', fat_mask, fat_volume)
+            result['fat_mm3'], result['fat_cm3'], result['fat_voxels'] = calculerVolume(fat_mask, fat_volume.spacing)
+
+    result['seconds'] = round(time.time() - start, 2)
+    _ecrireJSON(case_dir / RESULT_FILE, result)
+    return result
+
+
+def _executerCas(case, case_dir, trace=False, threads=-1):
+    """Process entry point: a failure is recorded in result.json instead of being raised."""
+    from .tracing import TRACER
+
+    TRACER.enabled = trace
+    start = time.time()
+    try:
+        with TRACER.span('batch.case', case_id=case['case_id'], threads=threads):
+            segmenterCas(case, case_dir, threads)
+    except Exception as e:
+        traceback.print_exc()
+        _ecrireJSON(Path(case_dir) / RESULT_FILE, {
+            'case_id': case['case_id'], 'status': 'error', 'error': f"{type(e).__name__}: {e}",
+            'seconds': round(time.time() - start, 2)})
+    finally:
+        if trace:
+            TRACER.exporterChrome(Path(case_dir) / 'trace.json')
+
+
+@contextlib.contextmanager
+def _environnement(variables):
+    """Temporarily set environment variables (restored on exit)."""
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def lireResultat(case_dir):
+    try:
+        with open(Path(case_dir) / RESULT_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ecrireCSV(path, results):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+
+
+def executerLot(cases, output_dir, workers=None, timeout=None, force=False, trace=False, threads=None):
+    """
+    Segment the cases in parallel processes (one per case, at most `workers` at a time).
+    threads: threads per case process (default: CPUs / workers, at least 1).
+    Returns the list of result dictionaries, in manifest order, and the run summary.
+    """
+    invalid = [case['case_id'] for case in cases if not caseIdValide(case['case_id'])]
+    if invalid:
+        raise ValueError(f"case_id values must not contain path separators or '..': {', '.join(invalid)}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cpus = os.cpu_count() or 1
+    workers = max(1, workers or cpus)
+    threads = max(1, threads or cpus // workers)
+
+    pending = []
+    skipped = 0
+    for case in cases:
+        previous = lireResultat(output_dir / case['case_id'])
+        if not force and previous is not None and previous.get('status') == 'ok':
+            skipped += 1
+        else:
+            pending.append(case)
+    print(f"{len(cases)} cases: {skipped} already done, {len(pending)} to run on {workers} worker(s), "
+          f"{threads} thread(s) each")
+
+    # spawn: the parent may hold threads (SciPy, KD-tree workers) that must not be forked
+    context = multiprocessing.get_context('spawn')
+    running = {}
+    timed_out = set()
+    start = time.time()
+
+    while pending or running:
+        while pending and len(running) < workers:
+            case = pending.pop(0)
+            case_dir = output_dir / case['case_id']
+            case_dir.mkdir(parents=True, exist_ok=True)
+            result_path = case_dir / RESULT_FILE
+            if result_path.exists():
+                result_path.unlink()
+            process = context.Process(target=_executerCas, args=(case, str(case_dir), trace, threads), daemon=True)
+            # The thread pools are sized when the child imports NumPy/SciPy: set the limits in
+            # the environment it inherits, not in the child
+            with _environnement({name: str(threads) for name in THREAD_VARIABLES}):
+                process.start()
+            running[case['case_id']] = (process, case_dir, time.time())
+
+        time.sleep(0.1)
+        for case_id, (process, case_dir, started) in list(running.items()):
+            if process.is_alive():
+                if timeout and time.time() - started > timeout:
+                    process.terminate()
+                    process.join()
+                    timed_out.add(case_id)
+                else:
+                    continue
+            process.join()
+            del running[case_id]
+
+            result = lireResultat(case_dir)
+            if case_id in timed_out:
+                result = {'case_id': case_id, 'status': 'timeout',
+                          'error': f"Exceeded {timeout} s", 'seconds': round(time.time() - started, 2)}
+                _ecrireJSON(case_dir / RESULT_FILE, result)
+            elif result is None:
+                result = {'case_id': case_id, 'status': 'error',
+                          'error': f"Worker exited with code {process.exitcode}",
+                          'seconds': round(time.time() - started, 2)}
+                _ecrireJSON(case_dir / RESULT_FILE, result)
+            print(f"[{case_id}] {result['status']} in {result.get('seconds', 0):.1f} s"
+                  + (f" ({result['error']})" if result.get('error') else ""))
+
+    elapsed = time.time() - start
+    results = [lireResultat(output_dir / case['case_id']) or {'case_id': case['case_id'], 'status': 'missing'}
+               for case in cases]
+    ecrireCSV(output_dir / 'volumes.csv', results)
+
+    statuses = [result.get('status') for result in results]
+    ran = len(cases) - skipped
+    summary = {
+        'cases': len(cases),
+        'skipped': skipped,
+        'ok': statuses.count('ok'),
+        'error': statuses.count('error'),
+        'timeout': statuses.count('timeout'),
+        'workers': workers,
+        'threads': threads,
+        'wall_seconds': round(elapsed, 2),
+        'cases_per_minute': round(60.0 * ran / elapsed, 2) if ran and elapsed > 0 else 0.0,
+    }
+    _ecrireJSON(output_dir / 'summary.json', summary)
+    print(f"Done: {summary['ok']} ok, {summary['error']} error(s), {summary['timeout']} timeout(s), "
+          f"{skipped} skipped - {ran} case(s) in {elapsed:.1f} s "
+          f"({summary['cases_per_minute']:.2f} cases/min on {workers} worker(s))")
+    return results, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m CrohnBOOSTLib.batch',
+                                     description="CrohnBOOST batch lesion and creeping fat segmentation")
+    parser.add_argument('manifest', help="CSV manifest of the cases")
+    parser.add_argument('--output', '-o', required=True, help="output directory")
+    parser.add_argument('--workers', '-j', type=int, default=None,
+                        help="parallel cases (default: number of CPUs)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="threads per case (default: number of CPUs / workers)")
+    parser.add_argument('--timeout', type=float, default=None, help="per-case timeout in seconds")
+    parser.add_argument('--force', action='store_true', help="re-run cases that already succeeded")
+    parser.add_argument('--trace', action='store_true', help="write a Chrome trace of each case (trace.json)")
+    args = parser.parse_args(argv)
+
+    _, summary = executerLot(lireManifeste(args.manifest), args.output,
+                             workers=args.workers, timeout=args.timeout, force=args.force, trace=args.trace,
+                             threads=args.threads)
+    return 0 if summary['error'] == 0 and summary['timeout'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
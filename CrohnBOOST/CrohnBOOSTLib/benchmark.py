@@ -0,0 +1,320 @@
+"""
+Offline performance benchmark on synthetic bowel phantoms (no data download, no Slicer):
+
+    python -m CrohnBOOSTLib.benchmark --output baseline.json
+    python -m CrohnBOOSTLib.benchmark --output after.json --compare baseline.json
+
+Each phantom is a curved bowel segment (dark lumen, bright wall of configurable
+thickness) in creeping fat, with Gaussian noise, as a lesion (_W-like) and a fat
+(_F-like) image. Every stage of the lesion and fat pipelines is timed separately and
+reported with its throughput (voxels/s) and peak traced memory. Times come from a run
+without tracemalloc (which slows allocations down); peaks from a second, untimed run.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import fat as fat_module
+from .lesion import LesionPipeline
+from .volume import VolumeData
+from .wall import detecterPointsParoi
+
+# name: shape (k, j, i), spacing (x, y, z) in mm
+PHANTOMES = {
+    'small_aniso': {'shape': (24, 128, 128), 'spacing': (0.8, 0.8, 3.0)},
+    'small_iso': {'shape': (96, 96, 96), 'spacing': (1.0, 1.0, 1.0)},
+    'medium_aniso': {'shape': (48, 256, 256), 'spacing': (0.8, 0.8, 2.0)},
+    'large_aniso': {'shape': (80, 384, 384), 'spacing': (0.7, 0.7, 1.5)},
+}
+DEFAULT_PHANTOMES = ['small_aniso', 'small_iso', 'medium_aniso']
+
+
+def genererFantome(shape, spacing, lumen_radius=4.0, wall_thickness=4.0, fat_thickness=8.0,
+                   amplitude=8.0, period=15.0, lumen=60.0, wall=300.0, fat=150.0, background=100.0,
+                   fat_signal=400.0, noise=15.0, seed=0):
+    """
+    Synthetic bowel phantom: a tube running along k whose centre oscillates in j
+    (amplitude and period in mm), with a lumen, a wall of wall_thickness mm and a
+    ring of creeping fat of fat_thickness mm around it.
+    Intensities are those of the lesion image; in the fat image only the fat is bright
+    (fat_signal). Returns (lesion VolumeData, fat VolumeData, centerline (N, 3) RAS,
+    fat seed points (M, 3) RAS), with ijkToRAS = diag(spacing).
+    """
+    rng = np.random.default_rng(seed)
+    z, y, x = np.indices(shape, dtype=np.float32)
+    x *= spacing[0]
+    y *= spacing[1]
+    z *= spacing[2]
+
+    cx = shape[2] * spacing[0] / 2
+    cy = shape[1] * spacing[1] / 2
+    r = np.hypot(x - cx, y - (cy + amplitude * np.sin(z / period)))
+    del x, y, z
+
+    wall_outer = lumen_radius + wall_thickness
+    fat_outer = wall_outer + fat_thickness
+    in_lumen = r < lumen_radius
+    in_wall = ~in_lumen & (r < wall_outer)
+    in_fat = ~in_lumen & ~in_wall & (r < fat_outer)
+
+    lesion = np.select([in_lumen, in_wall, in_fat], [lumen, wall, fat], background)
+    lesion += rng.normal(0, noise, shape)
+    fat_image = np.where(in_fat, fat_signal, background / 2) + rng.normal(0, noise, shape)
+
+    volumes = [VolumeData(np.clip(image, 0, None).astype(np.uint16), spacing)
+               for image in (lesion, fat_image)]
+
+    zs = np.arange(1, shape[0] - 1) * spacing[2]
+    centerline = np.stack([np.full_like(zs, cx), cy + amplitude * np.sin(zs / period), zs], axis=1)
+
+    fat_radius = (wall_outer + fat_outer) / 2
+    z_seeds = zs[len(zs) // 4::max(1, len(zs) // 4)][:3]
+    fat_points = np.concatenate([
+        np.stack([np.full_like(z_seeds, cx + sign * fat_radius),
+                  cy + amplitude * np.sin(z_seeds / period), z_seeds], axis=1)
+        for sign in (-1, 1)])
+
+    return volumes[0], volumes[1], centerline, fat_points
+
+
+class Chronometre:
+    """
+    Wall time, or peak traced memory (memoire=True, tracemalloc running; includes NumPy
+    buffers), of named stages. Stages may be nested: tracemalloc has a single peak, so
+    the peak an outer stage reached before an inner one resets it is kept aside and
+    merged back when the inner stage ends.
+    """
+
+    def __init__(self, memoire=False):
+        self.memoire = memoire
+        self.stages = {}
+        self._ouverts = []  # [traced memory at start, highest traced memory seen] of the open stages
+
+    @contextlib.contextmanager
+    def mesurer(self, name, voxels):
+        if self.memoire:
+            if self._ouverts:
+                self._ouverts[-1][1] = max(self._ouverts[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            current_before = tracemalloc.get_traced_memory()[0]
+            self._ouverts.append([current_before, current_before])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'voxels': 0, 'peak_mb': 0.0})
+            stage['seconds'] += seconds
+            stage['voxels'] += int(voxels)
+            if self.memoire:
+                current_before, highest = self._ouverts.pop()
+                highest = max(highest, tracemalloc.get_traced_memory()[1])
+                if self._ouverts:
+                    self._ouverts[-1][1] = max(self._ouverts[-1][1], highest)
+                stage['peak_mb'] = max(stage['peak_mb'], (highest - current_before) / 1024**2)
+
+
+class _PipelineChronometre(LesionPipeline):
+    """LesionPipeline without stage cache, timing every stage."""
+
+    def __init__(self, chrono, volume):
+        super().__init__(stageCacheMaxBytes=0)
+        self.chrono = chrono
+        self.volume = volume
+        self.roi_voxels = volume.array.size
+
+    def _stage(self, name, inputs, compute, task=None):
+        if inputs.get('roi') is not None:
+            self.roi_voxels = int(np.prod([stop - start for start, stop in inputs['roi']]))
+        voxels = self.volume.array.size if name == 'roi' else self.roi_voxels
+        with self.chrono.mesurer(name, voxels):
+            return super()._stage(name, inputs, compute, task)
+
+
+@contextlib.contextmanager
+def _chronometrerFonction(module, name, chrono, stage, voxels):
+    """Time calls to module.name (a pipeline step not exposed as a stage) as `stage`."""
+    original = getattr(module, name)
+
+    def timed(*args, **kwargs):
+        with chrono.mesurer(stage, voxels):
+            return original(*args, **kwargs)
+
+    setattr(module, name, timed)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def _executerPipelines(chrono, volume, fat_volume, centerline, fat_points, threshold_factor, rayon_estime):
+    """One run of the lesion and fat pipelines, measured by chrono. Returns (pipeline, lesion_mask, fat_mask)."""
+    n_voxels = volume.array.size
+    # The pipelines print diagnostics on every stage; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        with chrono.mesurer('wall_detection', n_voxels):
+            wall = detecterPointsParoi(volume, centerline, rayon_estime)
+        if wall is None:
+            raise RuntimeError("no wall point detected on the phantom")
+
+        pipeline = _PipelineChronometre(chrono, volume)
+        _, lesion_mask = pipeline.calculerSegmentation(volume, centerline, wall, threshold_factor, rayon_estime)
+
+        with _chronometrerFonction(fat_module, 'croissanceGraisse', chrono, 'fat_growth', n_voxels):
+            with chrono.mesurer('fat_total', n_voxels):
+                fat_mask = fat_module.segmenterGraisse(fat_volume, fat_points, lesion_mask=lesion_mask)
+    return pipeline, lesion_mask, fat_mask
+
+
+def executerCas(name, shape, spacing, threshold_factor=0.5, rayon_estime=6, memory=True, **phantom):
+    """
+    Time the lesion and fat pipelines on one phantom. Returns the case report.
+    memory: run the pipelines a second time under tracemalloc for the per-stage peaks
+    (the timed run is not traced).
+    """
+    volume, fat_volume, centerline, fat_points = genererFantome(shape, spacing, **phantom)
+    n_voxels = volume.array.size
+    arguments = (volume, fat_volume, centerline, fat_points, threshold_factor, rayon_estime)
+
+    chrono = Chronometre()
+    start = time.perf_counter()
+    try:
+        pipeline, lesion_mask, fat_mask = _executerPipelines(chrono, *arguments)
+    except RuntimeError as e:
+        raise RuntimeError(f"{name}: {e}") from None
+    total = time.perf_counter() - start
+
+    peaks = {}
+    if memory:
+        memory_chrono = Chronometre(memoire=True)
+        tracemalloc.start()
+        try:
+            _executerPipelines(memory_chrono, *arguments)
+        finally:
+            tracemalloc.stop()
+        peaks = {stage_name: stage['peak_mb'] for stage_name, stage in memory_chrono.stages.items()}
+
+    stages = {}
+    for stage_name, stage in chrono.stages.items():
+        stages[stage_name] = {
+            'seconds': round(stage['seconds'], 4),
+            'voxels_per_second': round(stage['voxels'] / stage['seconds']) if stage['seconds'] > 0 else None,
+            'peak_mb': round(peaks[stage_name], 1) if stage_name in peaks else None,
+        }
+
+    return {
+        'shape': list(shape),
+        'spacing': list(spacing),
+        'voxels': n_voxels,
+        'roi_voxels': pipeline.roi_voxels,
+        'lesion_voxels': int(np.sum(lesion_mask)),
+        'fat_voxels': int(np.sum(fat_mask)) if fat_mask is not None else 0,
+        'total_seconds': round(total, 4),
+        'voxels_per_second': round(n_voxels / total),
+        'stages': stages,
+        'peak_rss_mb': _peakRSS(),
+    }
+
+
+def _peakRSS():
+    """Peak resident memory of the process in MB (None where the resource module is unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def executerBenchmark(names=None, repeat=1, memory=True):
+    """
+    Run the phantom cases, keeping the fastest of `repeat` runs of each. Returns the report.
+    memory: also measure the per-stage peak memory (one extra, untimed run per case).
+    """
+    import scipy
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'cases': {},
+    }
+    # Untimed warm-up: first-call costs (imports, thread pools) would otherwise land in the first case
+    executerCas('warmup', shape=(16, 64, 64), spacing=(0.8, 0.8, 3.0), memory=False)
+
+    for name in names or DEFAULT_PHANTOMES:
+        runs = [executerCas(name, memory=memory and run == 0, **PHANTOMES[name]) for run in range(repeat)]
+        # Peak memory does not depend on the run: keep the measured one with the fastest times
+        peaks = {stage_name: stage['peak_mb'] for stage_name, stage in runs[0]['stages'].items()}
+        case = min(runs, key=lambda run: run['total_seconds'])
+        for stage_name, stage in case['stages'].items():
+            stage['peak_mb'] = peaks.get(stage_name)
+        report['cases'][name] = case
+        print(f"{name} {tuple(case['shape'])}: {case['total_seconds']:.2f} s, "
+              f"{case['voxels_per_second'] / 1e6:.2f} Mvox/s, peak RSS {case['peak_rss_mb']} MB")
+        for stage_name, stage in case['stages'].items():
+            print(f"  {stage_name:<16} {stage['seconds']:8.3f} s  {(stage['voxels_per_second'] or 0) / 1e6:8.2f} Mvox/s"
+                  f"  {_mb(stage['peak_mb']):>8} MB")
+    return report
+
+
+def _mb(value):
+    return '-' if value is None else f"{value:.1f}"
+
+
+def comparer(report, baseline):
+    """Print the per-stage speed-up of report relative to a baseline report."""
+    print("Comparison with baseline (speed-up = baseline time / current time):")
+    for name, case in report['cases'].items():
+        reference = baseline.get('cases', {}).get(name)
+        if reference is None:
+            print(f"{name}: not in baseline")
+            continue
+        print(f"{name}: total x{reference['total_seconds'] / case['total_seconds']:.2f}")
+        for stage_name, stage in case['stages'].items():
+            reference_stage = reference['stages'].get(stage_name)
+            if reference_stage is None or stage['seconds'] == 0:
+                continue
+            print(f"  {stage_name:<16} {reference_stage['seconds']:8.3f} s -> {stage['seconds']:8.3f} s"
+                  f"  x{reference_stage['seconds'] / stage['seconds']:.2f}"
+                  f"  ({_mb(reference_stage.get('peak_mb'))} -> {_mb(stage['peak_mb'])} MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m CrohnBOOSTLib.benchmark',
+                                     description="CrohnBOOST benchmark on synthetic bowel phantoms")
+    parser.add_argument('--cases', nargs='+', choices=sorted(PHANTOMES), default=DEFAULT_PHANTOMES,
+                        help="phantoms to run (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per phantom, the fastest is kept")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the traced run measuring per-stage peak memory")
+    parser.add_argument('--output', '-o', help="write the report as a JSON baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    args = parser.parse_args(argv)
+
+    report = executerBenchmark(args.cases, max(1, args.repeat), memory=not args.no_memory)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            comparer(report, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class StageCache:
+    """
+    LRU cache of pipeline stage outputs, bounded by the memory of the cached arrays.
+    Values are numpy arrays (or tuples of arrays); cached arrays are made read-only
+    since the same object is handed to every later consumer.
+    Thread-safe: a BackgroundTask being cancelled may still use it while a preview runs.
+    """
+
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _arrays(value):
+        if isinstance(value, np.ndarray):
+            return [value]
+        if isinstance(value, (tuple, list)):
+            return [v for item in value for v in StageCache._arrays(item)]
+        return []
+
+    def get(self, key):
+        """Return (found, value) and mark the entry as most recently used."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return True, self._entries[key][0]
+
+    def put(self, key, value):
+        arrays = self._arrays(value)
+        nbytes = sum(array.nbytes for array in arrays)
+        if nbytes > self.max_bytes:
+            return
+        for array in arrays:
+            array.flags.writeable = False
+
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.total_bytes += nbytes
+
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
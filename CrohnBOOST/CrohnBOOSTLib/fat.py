@@ -0,0 +1,165 @@
+import numpy as np
+
+from .lesion import filtrerComposantes
+from .tracing import span
+
+
+def croissanceGeodesique(seed_coords, allowed_mask, offsets, max_levels, result=None):
+    """
+    Level-synchronous flood fill, equivalent to repeating
+    result = binary_dilation(result, structure) & allowed_mask up to max_levels times
+    (stopping when nothing changes). offsets are the (dz, dy, dx) non-zero positions
+    of the structuring element, centre included, so level 1 keeps the seeds that are
+    allowed and adds their allowed neighbours.
+    Only the neighbours of the voxels added by the previous level are examined.
+    Returns the boolean result mask and the number of voxels visited.
+    """
+    shape = np.array(allowed_mask.shape)
+    allowed_flat = allowed_mask.reshape(-1) > 0
+    if result is None:
+        result = np.zeros(allowed_mask.shape, dtype=bool)
+    result_flat = result.reshape(-1)
+
+    offsets = np.asarray(offsets)
+    frontier = np.asarray(seed_coords).reshape(-1, 3)
+    n_visited = 0
+
+    for level in range(max_levels):
+        if len(frontier) == 0:
+            break
+        neighbours = (frontier[:, np.newaxis, :] + offsets[np.newaxis, :, :]).reshape(-1, 3)
+        neighbours = neighbours[np.all((neighbours >= 0) & (neighbours < shape), axis=1)]
+        candidates = np.unique(np.ravel_multi_index(neighbours.T, allowed_mask.shape))
+        n_visited += len(candidates)
+
+        candidates = candidates[~result_flat[candidates] & allowed_flat[candidates]]
+        result_flat[candidates] = True
+        frontier = np.stack(np.unravel_index(candidates, allowed_mask.shape), axis=1)
+
+    return result, n_visited
+
+
+def croissanceGraisse(seed_mask, intensity_mask, max_iterations=25, z_iterations=3):
+    """
+    Creeping-fat growth: in-plane (4-connected) reachability from the seeds within
+    intensity_mask limited to max_iterations steps, then through-plane (z +/- 1)
+    reachability limited to z_iterations steps.
+    intensity_mask already excludes the lesion. Same result as the iterative
+    binary_dilation version (whose in-plane support test in z is always satisfied,
+    since the structuring element contains the voxel itself).
+    """
+    offsets_xy = [[0, 0, 0], [0, -1, 0], [0, 1, 0], [0, 0, -1], [0, 0, 1]]
+    offsets_z = [[0, 0, 0], [-1, 0, 0], [1, 0, 0]]
+
+    with span('fat.growth') as growth_span:
+        fat_mask, visited_xy = croissanceGeodesique(
+            np.argwhere(seed_mask), intensity_mask, offsets_xy, max_iterations)
+        fat_mask, visited_z = croissanceGeodesique(
+            np.argwhere(fat_mask), intensity_mask, offsets_z, z_iterations, result=fat_mask)
+        growth_span.set(visited_xy=visited_xy, visited_z=visited_z, voxels=int(np.sum(fat_mask)))
+
+    print(f"Fat growth: {visited_xy} voxels visited in-plane, {visited_z} in Z "
+          f"({int(np.sum(fat_mask))} fat voxels)")
+    return fat_mask.astype(np.uint8)
+
+
+def segmenterGraisse(volume, fat_points_ras, lesion_mask=None, min_volume_mm3=0.0):
+    """
+    Creeping fat mask of a VolumeData grown from (N, 3) RAS seed points.
+    lesion_mask: optional lesion labelmap array (same grid); the fat then grows from the
+    lesion border and never into the lesion.
+    Returns the uint8 fat mask, or None if no seed point lies in the volume.
+    """
+    from scipy import ndimage
+
+    with span('fat.segmentation', shape=volume.shape, seeds=len(fat_points_ras)) as fat_span:
+        volume_array = volume.array
+        spacing = volume.spacing
+        print(f"Voxel spacing: {spacing[0]:.2f} x {spacing[1]:.2f} x {spacing[2]:.2f} mm")
+        xy_spacing = min(spacing[0], spacing[1])
+        z_spacing = spacing[2]
+        anisotropy_ratio = z_spacing / xy_spacing
+        print(f"Ratio d'anisotropie Z/XY: {anisotropy_ratio:.2f}")
+
+        fat_points_ijk = volume.rasToKJI(fat_points_ras)
+        inside = np.all((fat_points_ijk >= 0) & (fat_points_ijk < volume_array.shape), axis=1)
+        fat_points_ijk = fat_points_ijk[inside]
+
+        if len(fat_points_ijk) == 0:
+            print("No valid point for fat segmentation.")
+            return None
+
+        fat_intensities = volume_array[fat_points_ijk[:, 0], fat_points_ijk[:, 1], fat_points_ijk[:, 2]]
+
+        mean_intensity = np.mean(fat_intensities)
+        std_intensity = np.std(fat_intensities)
+
+        intensity_min = mean_intensity - 3.0 * std_intensity
+        intensity_max = mean_intensity + 3.0 * std_intensity
+
+        print(f"Detected fat points: {len(fat_intensities)}")
+        print(f"Mean intensity: {mean_intensity:.2f} ± {std_intensity:.2f}")
+        print(f"Intensity range: [{intensity_min:.2f}, {intensity_max:.2f}]")
+
+        intensity_mask = np.zeros_like(volume_array, dtype=np.uint8)
+        if lesion_mask is not None:
+            intensity_mask[(volume_array >= intensity_min) &
+                        (volume_array <= intensity_max) &
+                        (lesion_mask == 0)] = 1
+        else:
+            intensity_mask[(volume_array >= intensity_min) &
+                        (volume_array <= intensity_max)] = 1
+
+        struct_size = (
+            max(1, min(3, int(round(5 / spacing[2])))),
+            3,
+            3
+        )
+        print(f"Size of the anisotropic structuring element: {struct_size}")
+        struct_aniso = np.ones(struct_size, dtype=np.uint8)
+
+        seed_mask = np.zeros_like(volume_array, dtype=np.uint8)
+        seed_mask[fat_points_ijk[:, 0], fat_points_ijk[:, 1], fat_points_ijk[:, 2]] = 1
+
+        if lesion_mask is not None:
+            border_struct = ndimage.generate_binary_structure(3, 1)
+            lesion_border = ndimage.binary_dilation(
+                lesion_mask > 0,
+                structure=border_struct,
+                iterations=1
+            ) & ~(lesion_mask > 0)
+
+            seed_mask[(lesion_border & (intensity_mask > 0))] = 1
+
+        max_iterations = 25
+        z_iterations = max(3, int(max_iterations / anisotropy_ratio))
+        print(f"Itérations en Z: {z_iterations}")
+
+        fat_mask = croissanceGraisse(seed_mask, intensity_mask, max_iterations, z_iterations)
+
+        with span('fat.morphology'):
+            fat_mask = ndimage.binary_closing(
+                fat_mask,
+                structure=struct_aniso,
+                iterations=2
+            ).astype(np.uint8)
+
+            fat_mask = ndimage.binary_opening(
+                fat_mask,
+                structure=struct_aniso,
+                iterations=1
+            ).astype(np.uint8)
+
+            fat_mask = filtrerComposantes(fat_mask, relative_fraction=0.1, min_voxels=10,
+                                          floor_threshold=True, min_components=2,
+                                          min_volume_mm3=min_volume_mm3, spacing=spacing)
+
+            fat_mask = ndimage.binary_closing(
+                fat_mask,
+                structure=struct_aniso,
+                iterations=1
+            ).astype(np.uint8)
+
+        fat_span.set(voxels=int(np.sum(fat_mask)))
+        print(f"Final number of segmented voxels: {np.sum(fat_mask)}")
+    return fat_mask
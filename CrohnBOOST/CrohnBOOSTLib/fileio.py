@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+
+from .volume import VolumeData
+
+# LPS (ITK, NIfTI/NRRD files) <-> RAS (Slicer) change of basis
+_LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+
+def _sitk():
+    try:
+        import SimpleITK as sitk
+    except ImportError as e:
+        raise ImportError("Reading and writing NIfTI/NRRD volumes requires SimpleITK "
+                          "(bundled with 3D Slicer, otherwise: pip install SimpleITK)") from e
+    return sitk
+
+
+def lireVolume(path):
+    """Read a 3D scalar NIfTI/NRRD volume into a VolumeData (RAS geometry, like Slicer)."""
+    sitk = _sitk()
+    image = sitk.ReadImage(str(path))
+    if image.GetDimension() != 3 or image.GetNumberOfComponentsPerPixel() != 1:
+        raise ValueError(f"{path}: expected a 3D scalar volume")
+
+    spacing = np.array(image.GetSpacing())
+    direction = np.array(image.GetDirection()).reshape(3, 3)
+    ijkToLPS = np.eye(4)
+    ijkToLPS[:3, :3] = direction * spacing
+    ijkToLPS[:3, 3] = image.GetOrigin()
+
+    return VolumeData(sitk.GetArrayFromImage(image), spacing, ijkToRAS=_LPS_TO_RAS @ ijkToLPS)
+
+
+def geometrieLPS(volume):
+    """ITK (LPS) spacing, origin and row-major direction cosines of a VolumeData, as lists."""
+    ijkToLPS = _LPS_TO_RAS @ volume.ijkToRAS
+    spacing = np.linalg.norm(ijkToLPS[:3, :3], axis=0)
+    return ([float(s) for s in spacing],
+            [float(o) for o in ijkToLPS[:3, 3]],
+            [float(d) for d in (ijkToLPS[:3, :3] / spacing).ravel()])
+
+
+def ecrireLabelmap(path, mask, volume):
+    """Write a (k, j, i) mask as a uint8 labelmap with the geometry of a VolumeData."""
+    sitk = _sitk()
+    spacing, origin, direction = geometrieLPS(volume)
+
+    image = sitk.GetImageFromArray(np.ascontiguousarray(mask, dtype=np.uint8))
+    image.SetSpacing(spacing)
+    image.SetOrigin(origin)
+    image.SetDirection(direction)
+    sitk.WriteImage(image, str(path), True)
+
+
+def lireMarkups(path):
+    """(N, 3) RAS control points of the first markup of a Slicer .mrk.json file."""
+    with open(path, encoding='utf-8') as f:
+        markup = json.load(f)['markups'][0]
+
+    points = np.array([point['position'] for point in markup.get('controlPoints', [])],
+                      dtype=np.float64).reshape(-1, 3)
+    if markup.get('coordinateSystem', 'LPS') == 'LPS':
+        points[:, :2] *= -1
+    return points
+
+
+def interpolerCourbe(control_points, points_per_segment=10):
+    """
+    Dense curve through the control points, as a uniform Catmull-Rom spline with
+    points_per_segment samples per segment (Slicer's default curve type and density).
+    Slicer's own curve generator may differ slightly in the parametrization.
+    """
+    control_points = np.asarray(control_points, dtype=np.float64).reshape(-1, 3)
+    if len(control_points) < 3:
+        return control_points
+
+    padded = np.concatenate([control_points[:1], control_points, control_points[-1:]])
+    t = np.linspace(0.0, 1.0, points_per_segment, endpoint=False)[:, np.newaxis]
+    t2 = t * t
+    t3 = t2 * t
+
+    segments = []
+    for i in range(1, len(padded) - 2):
+        p0, p1, p2, p3 = padded[i - 1:i + 3]
+        segments.append(0.5 * (2 * p1 + (p2 - p0) * t +
+                               (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2 +
+                               (3 * p1 - p0 - 3 * p2 + p3) * t3))
+    segments.append(control_points[-1:])
+    return np.concatenate(segments)
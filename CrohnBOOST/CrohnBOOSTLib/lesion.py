@@ -0,0 +1,775 @@
+import threading
+import time
+
+import numpy as np
+
+from .cache import StageCache
+from .tracing import TRACER, span
+from .volume import pointsFingerprint
+
+
+# Lesion pipeline stage graph: root inputs each cached stage depends on
+# (directly or through the stages it consumes).
+LESION_STAGE_INPUTS = {
+    'roi':          ('volume', 'centerline', 'wall_points', 'rayon_estime'),
+    'wall':         ('volume', 'wall_points', 'roi'),
+    'valley':       ('volume', 'wall_points', 'roi'),
+    'seeds':        ('volume', 'wall_points', 'roi', 'threshold_factor', 'rayon_estime'),
+    'expansion':    ('volume', 'wall_points', 'roi', 'threshold_factor', 'rayon_estime'),
+    'radial':       ('volume', 'wall_points', 'roi', 'threshold_factor', 'rayon_estime', 'centerline'),
+    'morphology':   ('volume', 'wall_points', 'roi', 'threshold_factor', 'rayon_estime', 'centerline',
+                     'min_volume_mm3'),
+    'expander_full': ('volume', 'wall_points', 'roi', 'threshold_factor', 'rayon_estime', 'centerline',
+                      'min_volume_mm3'),
+}
+
+
+def expansion_locale_adjacente(mask, volume_array, n_iterations=3, valley_mask=None):
+    """
+    Expanse le masque en capturant les voxels adjacents avec intensités similaires.
+    valley_mask: binary mask of low-intensity barrier voxels that block region growing.
+
+    Frontier-based: each iteration only examines the 6-neighbours of the voxels added
+    by the previous one (rejected voxels can never become valid later), so the cost is
+    proportional to the number of voxels added rather than to the volume size.
+    """
+
+    intensities_mask = volume_array[mask > 0]
+    result_mask = mask > 0
+    if len(intensities_mask) == 0:
+        return result_mask.astype(np.uint8)
+
+    mean_int = np.mean(intensities_mask)
+    std_int = np.std(intensities_mask)
+
+    int_min = mean_int - 2.5 * std_int
+    int_max = mean_int + 2.5 * std_int
+
+    print(f"Local expansion – Intensities: {mean_int:.1f} ± {std_int:.1f}")
+    if valley_mask is not None:
+        print(f"  Valley barrier active: {np.sum(valley_mask)} barrier voxels")
+
+    shape = np.array(result_mask.shape)
+    volume_flat = volume_array.reshape(-1)
+    result_flat = result_mask.reshape(-1)
+    valley_flat = valley_mask.reshape(-1) if valley_mask is not None else None
+    neighbour_offsets = np.array([[-1, 0, 0], [1, 0, 0],
+                                  [0, -1, 0], [0, 1, 0],
+                                  [0, 0, -1], [0, 0, 1]])
+
+    frontier = np.argwhere(result_mask)
+
+    for iteration in range(n_iterations):
+        neighbours = (frontier[:, np.newaxis, :] + neighbour_offsets[np.newaxis, :, :]).reshape(-1, 3)
+        neighbours = neighbours[np.all((neighbours >= 0) & (neighbours < shape), axis=1)]
+        candidates = np.unique(np.ravel_multi_index(neighbours.T, result_mask.shape))
+        candidates = candidates[~result_flat[candidates]]
+
+        values = volume_flat[candidates]
+        valid = (values >= int_min) & (values <= int_max)
+
+        # ADDED: block growth into valley (dark) voxels
+        if valley_flat is not None:
+            valid &= ~valley_flat[candidates]
+
+        new_voxels_idx = candidates[valid]
+        new_voxels = len(new_voxels_idx)
+        if new_voxels == 0:
+            print(f"  Itération {iteration+1}: Plus de voxels à ajouter")
+            break
+
+        result_flat[new_voxels_idx] = True
+        frontier = np.stack(np.unravel_index(new_voxels_idx, result_mask.shape), axis=1)
+        print(f"  Itération {iteration+1}: +{new_voxels} voxels")
+
+    return result_mask.astype(np.uint8)
+
+
+def computeValleyMask(volume_array, wall_intensities, roi=None):
+    """
+    Compute a binary barrier mask of "valley" voxels — regions with intensity
+    significantly below the detected wall points. These are typically lumen,
+    mesentery, or other dark structures that the segmentation should not cross.
+
+    Uses mean - 2.5*std of wall intensities: conservative enough to only block
+    truly dark regions (lumen, air, mesentery) without eating into legitimate
+    wall voxels that are slightly below average.
+
+    Safety: if the mask would block >50% of the volume, it is clearly miscalibrated
+    and is disabled entirely to avoid breaking the segmentation.
+
+    roi: optional tuple of slices; the safety check still uses the whole volume
+    but only the ROI part of the mask is returned.
+    """
+    mean_wall = np.mean(wall_intensities)
+    std_wall = np.std(wall_intensities)
+    valley_threshold = mean_wall - 2.5 * std_wall
+
+    n_valley = int(np.count_nonzero(volume_array < valley_threshold))
+    volume_size = volume_array.size
+    pct = 100.0 * n_valley / volume_size
+    if roi is not None:
+        volume_array = volume_array[roi]
+    valley_mask = volume_array < valley_threshold
+
+    print(f"Valley mask: threshold = {valley_threshold:.1f} "
+          f"(mean wall = {mean_wall:.1f}, std = {std_wall:.1f})")
+    print(f"  Valley voxels: {n_valley} / {volume_size} ({pct:.1f}%)")
+
+    # Safety: if valley mask is too aggressive, disable it
+    if pct > 50.0:
+        print(f"  WARNING: Valley mask blocks {pct:.1f}% of volume — too aggressive, disabling")
+        return np.zeros_like(volume_array, dtype=bool)
+
+    return valley_mask
+
+
+def computeCenterlineTangents(centerline_ras):
+    """
+    Compute unit tangent vectors for each point of an (N, 3) centerline.
+    Uses central differences for interior points, forward/backward for endpoints.
+    """
+    centerline_ras = np.asarray(centerline_ras, dtype=np.float64).reshape(-1, 3)
+    n_points = len(centerline_ras)
+
+    tangents = np.zeros_like(centerline_ras)
+
+    for i in range(n_points):
+        if i == 0:
+            t = centerline_ras[1] - centerline_ras[0]
+        elif i == n_points - 1:
+            t = centerline_ras[-1] - centerline_ras[-2]
+        else:
+            t = centerline_ras[i + 1] - centerline_ras[i - 1]
+
+        norm = np.linalg.norm(t)
+        if norm > 1e-8:
+            tangents[i] = t / norm
+        else:
+            tangents[i] = tangents[max(0, i - 1)]
+
+    return centerline_ras, tangents
+
+
+def buildEllipsoidKernel(spacing, radius_mm):
+    """
+    Return the (dz, dy, dx) voxel offsets lying within radius_mm of the origin,
+    measured in physical distance with the (x, y, z) voxel spacing.
+    The kernel is anisotropic: fewer slices in z than pixels in-plane on VIBE volumes.
+    """
+    radius_x_vox = int(np.ceil(radius_mm / spacing[0]))
+    radius_y_vox = int(np.ceil(radius_mm / spacing[1]))
+    radius_z_vox = int(np.ceil(radius_mm / spacing[2]))
+
+    dz, dy, dx = np.meshgrid(np.arange(-radius_z_vox, radius_z_vox + 1),
+                             np.arange(-radius_y_vox, radius_y_vox + 1),
+                             np.arange(-radius_x_vox, radius_x_vox + 1),
+                             indexing='ij')
+    dist = np.sqrt((dx * spacing[0])**2 + (dy * spacing[1])**2 + (dz * spacing[2])**2)
+    inside = dist <= radius_mm
+
+    return np.stack([dz[inside], dy[inside], dx[inside]], axis=1)
+
+
+def croissanceEllipsoidale(volume_array, wall_ijk, spacing, radius_mm,
+                           intensity_low, intensity_high, intensity_tolerance,
+                           valley_mask=None, batch_size=1024):
+    """
+    Seed the lesion mask around every wall point in one batched pass.
+    A voxel is kept if it lies inside the physical ellipsoid of a wall point,
+    is not a valley voxel, falls in [intensity_low, intensity_high] and is within
+    intensity_tolerance of that wall point's own intensity.
+    Wall points are processed by batches to bound memory (points x kernel offsets).
+    """
+    mask = np.zeros(volume_array.shape, dtype=np.uint8)
+    if len(wall_ijk) == 0:
+        return mask
+
+    kernel = buildEllipsoidKernel(spacing, radius_mm)
+    shape = np.array(volume_array.shape)
+    print(f"Ellipsoid kernel: {len(kernel)} offsets, {len(wall_ijk)} wall points")
+
+    wall_ijk = np.asarray(wall_ijk, dtype=np.intp)
+    for start in range(0, len(wall_ijk), batch_size):
+        centers = wall_ijk[start:start + batch_size]
+        ref_intensities = volume_array[centers[:, 0], centers[:, 1], centers[:, 2]]
+
+        coords = centers[:, np.newaxis, :] + kernel[np.newaxis, :, :]
+        inside = np.all((coords >= 0) & (coords < shape), axis=2)
+        point_idx = np.nonzero(inside)[0]
+        coords = coords[inside]
+
+        values = volume_array[coords[:, 0], coords[:, 1], coords[:, 2]]
+        keep = ((values >= intensity_low) &
+                (values <= intensity_high) &
+                (abs(values - ref_intensities[point_idx]) <= intensity_tolerance))
+        if valley_mask is not None:
+            keep &= ~valley_mask[coords[:, 0], coords[:, 1], coords[:, 2]]
+
+        coords = coords[keep]
+        mask[coords[:, 0], coords[:, 1], coords[:, 2]] = 1
+
+    return mask
+
+
+def filtrerComposantes(mask, relative_fraction, min_voxels=0, floor_threshold=False,
+                       min_components=1, min_volume_mm3=0.0, spacing=None):
+    """
+    Drop small connected components with a keep/drop lookup table indexed by label.
+    Relative rule: keep components of size >= max(min_voxels, relative_fraction * largest)
+    (threshold truncated to an integer if floor_threshold), applied only when there are
+    at least min_components components.
+    Absolute rule: keep components of at least min_volume_mm3 (needs the (x, y, z) spacing).
+    """
+    from scipy import ndimage
+
+    labeled_array, num_features = ndimage.label(mask)
+    if num_features == 0:
+        return mask.astype(np.uint8)
+
+    sizes = np.bincount(labeled_array.ravel())
+    keep = np.ones(num_features + 1, dtype=bool)
+    keep[0] = False
+
+    if num_features >= min_components:
+        threshold_size = np.max(sizes[1:]) * relative_fraction
+        if floor_threshold:
+            threshold_size = int(threshold_size)
+        threshold_size = max(min_voxels, threshold_size)
+        keep &= sizes >= threshold_size
+
+    if min_volume_mm3 > 0 and spacing is not None:
+        voxel_volume_mm3 = spacing[0] * spacing[1] * spacing[2]
+        keep &= sizes * voxel_volume_mm3 >= min_volume_mm3
+
+    print(f"  Components kept: {int(np.sum(keep))}/{num_features}")
+    return keep[labeled_array].astype(np.uint8)
+
+
+def remplirTrous(mask, max_workers=None):
+    """
+    Fill holes slice by slice along z, then y, then x, followed by a full 3D fill.
+    Work is restricted to the bounding box of the mask (holes cannot extend past it)
+    and, within each axis pass, to slices containing mask voxels. The slices of one
+    pass are independent and are dispatched to a thread pool; passes stay sequential
+    so the result is identical to filling every slice in order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from scipy import ndimage
+
+    result = np.zeros(mask.shape, dtype=bool)
+    coords = np.argwhere(mask)
+    if len(coords) == 0:
+        return result
+
+    bbox = tuple(slice(lo, hi + 1) for lo, hi in zip(coords.min(axis=0), coords.max(axis=0)))
+    roi = np.array(mask[bbox], dtype=bool)
+
+    def fill_slice(view, index):
+        view[index] = ndimage.binary_fill_holes(view[index])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for axis, axis_name in enumerate("zyx"):
+            start = time.perf_counter()
+            view = np.moveaxis(roi, axis, 0)
+            other_axes = tuple(a for a in range(3) if a != axis)
+            occupied = np.flatnonzero(np.any(roi, axis=other_axes))
+            list(executor.map(lambda index: fill_slice(view, index), occupied))
+            print(f"  Hole filling {axis_name}: {len(occupied)}/{roi.shape[axis]} slices "
+                  f"in {time.perf_counter() - start:.3f} s")
+
+    start = time.perf_counter()
+    roi = ndimage.binary_fill_holes(roi)
+    print(f"  Hole filling 3D: {time.perf_counter() - start:.3f} s")
+
+    result[bbox] = roi
+    return result
+
+
+def margesROI(spacing, rayon_estime=6):
+    """(k, j, i) ROI padding in voxels around the wall points, for the largest sensitivity."""
+    # Seed radius in mm (same formula as LesionPipeline.segmenterROI, threshold_factor = 1)
+    base_radius_physique = rayon_estime * 0.7
+    expanded_radius_physique = base_radius_physique + base_radius_physique * 0.3
+    spacing_kji = np.array(spacing[::-1])
+    seed_margin = np.ceil(expanded_radius_physique / spacing_kji).astype(int)
+
+    # Morphological margins in voxels: 3 local expansions, closing (2 + 1 iterations)
+    # and the two expanderSegmentation dilations
+    taille = np.maximum(np.round(2.0 / spacing_kji).astype(int), 1)
+    rayon_voxels = int(rayon_estime / min(spacing))
+    expansion_size = abs(int(0.5 * rayon_voxels * 0.2))
+    return seed_margin + 3 + 3 * taille + 2 * expansion_size + 1
+
+
+def calculerROI(volume, centerline_ras, wall_ras, rayon_estime=6):
+    """
+    Padded (k, j, i) bounding box of the centerline and wall points, as a tuple of slices.
+    Every lesion voxel lies within the seed radius (+3 local expansion iterations) of a
+    wall point, so padding by that radius plus the closing and expanderSegmentation
+    margins keeps the mask away from the ROI border: processing the ROI alone gives the
+    same result as processing the full volume.
+    Margins are taken for the largest sensitivity (threshold_factor = 1) so the ROI,
+    and every cached stage computed on it, stays valid when the sensitivity changes.
+    """
+    shape = volume.shape
+
+    points_ras = [np.asarray(pts, dtype=np.float64).reshape(-1, 3)
+                  for pts in (centerline_ras, wall_ras) if pts is not None]
+    points_ras = np.concatenate(points_ras)
+    if len(points_ras) == 0:
+        return None
+    points_kji = volume.rasToKJI(points_ras)
+
+    margin = margesROI(volume.spacing, rayon_estime)
+    lower = np.maximum(points_kji.min(axis=0) - margin, 0)
+    upper = np.minimum(points_kji.max(axis=0) + margin + 1, shape)
+    if np.any(upper <= lower):
+        return None
+
+    roi = tuple(slice(int(lo), int(hi)) for lo, hi in zip(lower, upper))
+    roi_fraction = 100.0 * np.prod(upper - lower) / np.prod(shape)
+    print(f"Lesion ROI: {tuple(int(v) for v in upper - lower)} voxels ({roi_fraction:.1f}% of the volume)")
+    return roi
+
+
+def expanderSegmentation(mask, volume_array, spacing, factor, rayon_estime=6):
+    """
+    Dilate (factor > 0.5) or erode (factor < 0.5) the mask proportionally to the radius.
+    volume_array has the shape of mask (crop it to the same ROI).
+    """
+    from scipy import ndimage
+
+    mask = mask.astype(np.uint8)
+
+    rayon_voxels = int(rayon_estime / min(spacing))
+
+    expansion_size = int((factor - 0.5) * rayon_voxels * 0.2)
+    struct_element = ndimage.generate_binary_structure(3, 1)
+
+    if expansion_size == 0:
+        return mask
+
+    elif expansion_size > 0:
+        mask_expanded = ndimage.binary_dilation(mask,
+                                            structure=struct_element,
+                                            iterations=expansion_size)
+        mask_expanded = mask_expanded.astype(np.uint8)
+
+        dilated_region = (mask_expanded & ~mask).astype(np.uint8)
+        mean_intensity = np.mean(volume_array[mask == 1])
+        std_intensity = np.std(volume_array[mask == 1])
+
+        intensity_mask = ((volume_array >= mean_intensity - 2*std_intensity) &
+                        (volume_array <= mean_intensity + 2*std_intensity)).astype(np.uint8)
+
+        result = mask_expanded.copy()
+        result[dilated_region == 1] = intensity_mask[dilated_region == 1]
+
+        return result.astype(np.uint8)
+    else:
+        result = ndimage.binary_erosion(mask,
+                                    structure=struct_element,
+                                    iterations=abs(expansion_size))
+        return result.astype(np.uint8)
+
+
+def distancesCenterline(coords_kji, ijkToRAS, centerline_ras, tangents, tree, workers=-1):
+    """
+    Nearest centerline index, radial distance (perpendicular to the local tangent)
+    and signed axial offset (along the tangent), in mm, of (k, j, i) voxel coordinates.
+    """
+    coords_ras = coords_kji[:, ::-1] @ ijkToRAS[:3, :3].T + ijkToRAS[:3, 3]
+
+    # Find nearest centerline point for each voxel
+    _, nearest_indices = tree.query(coords_ras, workers=workers)
+
+    # Compute RADIAL distance (perpendicular to tangent)
+    vectors_to_voxels = coords_ras - centerline_ras[nearest_indices]
+    local_tangents = tangents[nearest_indices]
+
+    # Project onto tangent to get axial component
+    axial_components = np.sum(vectors_to_voxels * local_tangents, axis=1, keepdims=True)
+
+    # Radial = total minus axial projection
+    radial_vectors = vectors_to_voxels - axial_components * local_tangents
+    radial_distances = np.linalg.norm(radial_vectors, axis=1)
+
+    return nearest_indices, radial_distances, axial_components.ravel()
+
+
+def calculerChampDistance(volume, centerline_ras, roi, workers=-1, chunk_size=1000000):
+    """
+    Centerline distance field over the ROI (tuple of slices): nearest centerline index,
+    radial distance in mm and signed axial offset in mm of every ROI voxel.
+    Computed once per centerline (LesionPipeline.preparerChampDistance builds it when wall
+    detection completes); the radial filter is then a threshold on these arrays for any
+    threshold_factor or rayon_estime. Distances are stored as float32 (12 bytes per ROI
+    voxel with the int32 index).
+    """
+    from scipy.spatial import cKDTree
+
+    centerline_ras, tangents = computeCenterlineTangents(centerline_ras)
+    tree = cKDTree(centerline_ras)
+
+    roi_shape = tuple(sl.stop - sl.start for sl in roi)
+    roi_offset = np.array([sl.start for sl in roi])
+    n_voxels = int(np.prod(roi_shape))
+
+    nearest = np.empty(n_voxels, dtype=np.int32)
+    radial = np.empty(n_voxels, dtype=np.float32)
+    axial = np.empty(n_voxels, dtype=np.float32)
+    for start in range(0, n_voxels, chunk_size):
+        flat = np.arange(start, min(start + chunk_size, n_voxels))
+        coords_kji = np.stack(np.unravel_index(flat, roi_shape), axis=1) + roi_offset
+        nearest[flat], radial[flat], axial[flat] = distancesCenterline(
+            coords_kji, volume.ijkToRAS, centerline_ras, tangents, tree, workers)
+
+    print(f"Centerline distance field: {roi_shape} voxels")
+    return {
+        'roi': roi,
+        'nearest': nearest.reshape(roi_shape),
+        'radial': radial.reshape(roi_shape),
+        'axial': axial.reshape(roi_shape),
+    }
+
+
+def filtrerParDistanceCenterline(mask, centerline_ras, ijkToRAS, rayon_estime=6, threshold_factor=0.5,
+                                 workers=-1, champ=None):
+    """
+    Keeps only the mask voxels that are within distance_max of the centerline.
+    Now uses RADIAL distance (perpendicular to local tangent) instead of
+    raw Euclidean distance. This prevents voxels near a different portion
+    of the centerline (when the curve loops back) from being kept.
+    workers: number of threads for the KD-tree query (-1 = all cores).
+    champ: optional distance field ('radial' and 'axial' arrays) with the shape of mask;
+    otherwise distances are computed for the mask voxels, mask being the full volume.
+    """
+
+    from scipy.spatial import cKDTree
+
+    distance_factor = 2.0 + (threshold_factor * 1.0)
+    distance_max_mm = rayon_estime * distance_factor
+
+    print(f"Maximum allowed radial distance: {distance_max_mm:.1f} mm "
+          f"(radius {rayon_estime}mm × {distance_factor:.2f})")
+
+    segmented_coords_ijk = np.argwhere(mask > 0)
+
+    if len(segmented_coords_ijk) == 0:
+        return mask
+
+    if champ is not None:
+        radial_distances = champ['radial'][mask > 0]
+        axial_components = champ['axial'][mask > 0]
+    else:
+        # Compute centerline positions and tangent vectors
+        centerline_ras, tangents = computeCenterlineTangents(centerline_ras)
+        tree = cKDTree(centerline_ras)
+
+        _, radial_distances, axial_components = distancesCenterline(
+            segmented_coords_ijk, ijkToRAS, centerline_ras, tangents, tree, workers)
+
+    # Also limit axial distance
+    axial_distances = np.abs(axial_components)
+    axial_max_mm = distance_max_mm * 1.5
+
+    valid_indices = (radial_distances <= distance_max_mm) & (axial_distances <= axial_max_mm)
+
+    filtered_mask = np.zeros_like(mask)
+    valid_coords = segmented_coords_ijk[valid_indices]
+    filtered_mask[valid_coords[:, 0], valid_coords[:, 1], valid_coords[:, 2]] = 1
+
+    removed_voxels = len(segmented_coords_ijk) - np.sum(valid_indices)
+    removed_percent = 100 * removed_voxels / len(segmented_coords_ijk) if len(segmented_coords_ijk) > 0 else 0
+    print(f"  Voxels kept: {np.sum(valid_indices)}/{len(segmented_coords_ijk)} "
+          f"({removed_percent:.1f}% eliminated)")
+
+    # Debug: compare radial vs euclidean (distance to the nearest centerline point)
+    euclidean_distances = np.hypot(radial_distances, axial_components)
+    n_would_differ = np.sum((euclidean_distances <= distance_max_mm) & (radial_distances > distance_max_mm))
+    print(f"  Radial filter rejected {n_would_differ} voxels that Euclidean would have kept")
+
+    return filtered_mask.astype(np.uint8)
+
+
+class LesionPipeline:
+    """
+    Lesion segmentation from the centerline and wall points of a VolumeData.
+    Holds the stage cache, which also stores the centerline distance field, so repeated
+    runs with a different sensitivity only re-execute the stages that depend on it.
+    workers: threads of the KD-tree queries and slice-wise hole filling (-1 = all cores);
+    1 when several pipelines run in parallel processes.
+    """
+
+    def __init__(self, stageCacheMaxBytes=1024**3, workers=-1):
+        self.stageCache = StageCache(max_bytes=stageCacheMaxBytes)
+        self.workers = workers
+        # Guards _champDistance: the GUI preview and a BackgroundTask may both ask for the field
+        self._lock = threading.Lock()
+        self._champDistance = None  # (volume/centerline key, roi) of the last field put in the stage cache
+
+    def _stage(self, name, inputs, compute, task=None):
+        """
+        Run one lesion pipeline stage through the stage cache.
+        The cache key is the stage name plus the values of the root inputs the stage
+        depends on (LESION_STAGE_INPUTS), so e.g. the valley mask is reused when only
+        the sensitivity changes.
+        task: optional BackgroundTask, checked for cancellation and given the stage as progress.
+        """
+        if task is not None:
+            task.checkCancelled()
+            task.report(list(LESION_STAGE_INPUTS).index(name), f"Lesion segmentation: {name}")
+        key = (name,) + tuple(inputs[input_name] for input_name in LESION_STAGE_INPUTS[name])
+        with span(f"lesion.{name}") as stage_span:
+            found, value = self.stageCache.get(key)
+            stage_span.set(cached=found)
+            if found:
+                print(f"  [cache] {name}")
+                return value
+            value = compute()
+            if TRACER.enabled and isinstance(value, np.ndarray):
+                stage_span.set(output=value, voxels=int(np.count_nonzero(value)))
+            self.stageCache.put(key, value)
+            return value
+
+    def clearStageCache(self):
+        """Drop every cached lesion pipeline stage."""
+        self.stageCache.clear()
+
+    def obtenirChampDistance(self, volume, centerline_ras, roi, workers=None):
+        """
+        Centerline distance field cropped to roi. The field is kept in the stage cache, so it
+        counts against its memory cap, and is reused as long as the volume and centerline are
+        unchanged, its ROI contains the requested one and it has not been evicted.
+        workers: KD-tree query threads (default: the pipeline's).
+        """
+        if workers is None:
+            workers = self.workers
+        key = (volume.key, pointsFingerprint(centerline_ras))
+        with self._lock:
+            last = self._champDistance
+        arrays = None
+        if (last is not None and last[0] == key and
+                all(start <= sl.start and sl.stop <= stop for sl, (start, stop) in zip(roi, last[1]))):
+            _, arrays = self.stageCache.get(('distance_field',) + last)
+            bounds = last[1]
+
+        if arrays is None:
+            # Computed outside the lock: a concurrent caller may compute it too, but is never blocked
+            with span('lesion.distance_field', roi_voxels=int(np.prod([sl.stop - sl.start for sl in roi]))):
+                field = calculerChampDistance(volume, centerline_ras, roi, workers=workers)
+            arrays = (field['nearest'], field['radial'], field['axial'])
+            bounds = tuple((sl.start, sl.stop) for sl in roi)
+            self.stageCache.put(('distance_field', key, bounds), arrays)
+            with self._lock:
+                self._champDistance = (key, bounds)
+
+        crop = tuple(slice(sl.start - start, sl.stop - start) for sl, (start, _) in zip(roi, bounds))
+        return {name: array[crop] for name, array in zip(('nearest', 'radial', 'axial'), arrays)}
+
+    def preparerChampDistance(self, volume, centerline_ras, wall_ras, rayon_estime=6, task=None):
+        """
+        Build the centerline distance field over the lesion ROI (calculerROI, cached as the
+        'roi' stage) once the centerline and wall points are final, e.g. right after wall
+        detection. The first segmentation and every preview slab then only crop it.
+        Returns the ROI (None when the points give no usable box).
+        """
+        if task is not None:
+            task.checkCancelled()
+            task.report(task.maximum, "Centerline distance field...")
+        inputs = self._entrees(volume, centerline_ras, wall_ras, rayon_estime=rayon_estime)
+        roi = self._stage('roi', inputs, lambda: calculerROI(volume, centerline_ras, wall_ras, rayon_estime))
+        if roi is not None:
+            self.obtenirChampDistance(volume, centerline_ras, roi)
+        return roi
+
+    def invaliderChampDistance(self):
+        """Forget the centerline distance field (call when the centerline is modified)."""
+        with self._lock:
+            self._champDistance = None
+
+    def _entrees(self, volume, centerline_ras, wall_ras, **parameters):
+        inputs = {
+            'volume': volume.key,
+            'wall_points': pointsFingerprint(wall_ras),
+            'centerline': pointsFingerprint(centerline_ras),
+        }
+        inputs.update(parameters)
+        return inputs
+
+    def segmenterROI(self, volume, centerline_ras, wall_ras, threshold_factor, rayon_estime=6, min_volume_mm3=0.0, roi=None, task=None):
+        """
+        Lesion masks on the ROI of a VolumeData.
+        roi: optional tuple of slices from calculerROI; the whole pipeline then runs on
+        that sub-volume. Returns (mask, roi): the ROI-sized cleaned mask, before
+        expanderSegmentation (applied by calculerSegmentation).
+        Each stage is cached (see LESION_STAGE_INPUTS), so changing the sensitivity
+        only re-executes the stages that depend on it.
+        """
+        from scipy import ndimage
+
+        full_volume_array = volume.array
+        # The cached centerline distance field is only built over an ROI, never the full volume
+        use_distance_field = roi is not None
+        if roi is None:
+            roi = tuple(slice(0, n) for n in full_volume_array.shape)
+        roi_offset = np.array([sl.start for sl in roi])
+        volume_array = full_volume_array[roi]
+
+        spacing = volume.spacing
+
+        inputs = self._entrees(volume, centerline_ras, wall_ras,
+                               roi=tuple((sl.start, sl.stop) for sl in roi),
+                               threshold_factor=threshold_factor,
+                               rayon_estime=rayon_estime,
+                               min_volume_mm3=min_volume_mm3)
+
+        def stage_wall():
+            wall_ijk = volume.rasToKJI(wall_ras)
+            inside = np.all((wall_ijk >= 0) & (wall_ijk < full_volume_array.shape), axis=1)
+            wall_ijk = wall_ijk[inside]
+            wall_intensities = full_volume_array[wall_ijk[:, 0], wall_ijk[:, 1], wall_ijk[:, 2]]
+
+            # Wall points in ROI coordinates (points outside the ROI cannot seed it)
+            wall_ijk = wall_ijk - roi_offset
+            in_roi = np.all((wall_ijk >= 0) & (wall_ijk < volume_array.shape), axis=1)
+            return wall_ijk[in_roi], wall_intensities
+
+        wall_ijk, wall_intensities = self._stage('wall', inputs, stage_wall, task=task)
+
+        mean_intensity = np.mean(wall_intensities)
+        std_intensity = np.std(wall_intensities)
+        min_intensity = np.min(wall_intensities)
+
+        intensity_margin = std_intensity * threshold_factor
+        intensity_threshold_low = min_intensity * 0.8 - intensity_margin
+        intensity_threshold_high = mean_intensity + 2.0 * std_intensity + intensity_margin
+
+        rayon_physique = rayon_estime
+        base_radius_physique = rayon_physique * 0.7
+        expanded_radius_physique = base_radius_physique + threshold_factor * base_radius_physique * 0.3
+
+        radius_x_vox = int(np.ceil(expanded_radius_physique / spacing[0]))
+        radius_y_vox = int(np.ceil(expanded_radius_physique / spacing[1]))
+        radius_z_vox = int(np.ceil(expanded_radius_physique / spacing[2]))
+
+        print(f"Physical search radius: {expanded_radius_physique:.2f} mm")
+        print(f"Equivalent voxel: (x:{radius_x_vox}, y:{radius_y_vox}, z:{radius_z_vox})")
+
+        # ADDED: Compute valley barrier mask (sequence-adaptive)
+        valley_mask = self._stage('valley', inputs, lambda: computeValleyMask(
+            full_volume_array, wall_intensities, roi=roi), task=task)
+
+        # Region growing initial
+        intensity_tolerance = std_intensity * (1.0 + threshold_factor)
+        mask = self._stage('seeds', inputs, lambda: croissanceEllipsoidale(
+            volume_array, wall_ijk, spacing, expanded_radius_physique,
+            intensity_threshold_low, intensity_threshold_high,
+            intensity_tolerance, valley_mask), task=task)
+
+        # MODIFIED: pass valley_mask to expansion
+        print("Local expansion of adjacent areas…")
+        mask = self._stage('expansion', inputs, lambda: expansion_locale_adjacente(
+            mask, volume_array, n_iterations=3, valley_mask=valley_mask), task=task)
+
+        def stage_radial():
+            champ = None
+            if use_distance_field:
+                champ = self.obtenirChampDistance(volume, centerline_ras, roi)
+            return filtrerParDistanceCenterline(
+                mask, centerline_ras, volume.ijkToRAS,
+                rayon_estime=rayon_estime,
+                threshold_factor=threshold_factor,
+                workers=self.workers,
+                champ=champ)
+
+        print("Filtering by radial distance to the centerline…")
+        mask = self._stage('radial', inputs, stage_radial, task=task)
+
+        def stage_morphology():
+            # Fermeture morphologique adaptée à l'anisotropie
+            taille_physique = 2.0
+            taille_x = max(int(np.round(taille_physique / spacing[0])), 1)
+            taille_y = max(int(np.round(taille_physique / spacing[1])), 1)
+            taille_z = max(int(np.round(taille_physique / spacing[2])), 1)
+            struct_el_aniso = np.ones((taille_z, taille_y, taille_x), dtype=np.uint8)
+
+            closed = ndimage.binary_closing(mask, structure=struct_el_aniso, iterations=2)
+            print("Filling holes in the mask…")
+            closed = remplirTrous(closed, max_workers=self.workers if self.workers > 0 else None)
+
+            closed = ndimage.binary_closing(closed, structure=struct_el_aniso, iterations=1)
+
+            closed = closed.astype(np.uint8)
+
+            return filtrerComposantes(closed, relative_fraction=0.05,
+                                      min_volume_mm3=min_volume_mm3, spacing=spacing)
+
+        mask = self._stage('morphology', inputs, stage_morphology, task=task)
+
+        print(f"Nombre final de voxels segmentés : {np.sum(mask)}")
+
+        return mask, roi
+
+    def calculerSegmentation(self, volume, centerline_ras, wall_ras, threshold_factor, rayon_estime=6, min_volume_mm3=0.0, use_roi=True, roi=None, task=None):
+        """
+        Full lesion masks of a VolumeData.
+        use_roi: run the lesion pipeline on the padded centerline bounding box only.
+        roi: explicit tuple of slices overriding the computed ROI (e.g. a slab for previews).
+        task: optional BackgroundTask for progress and cancellation.
+        Returns (mask, full_mask_final), both full-size uint8 arrays.
+        """
+        with span('lesion.segmentation', shape=volume.shape, threshold_factor=threshold_factor,
+                  rayon_estime=rayon_estime) as segmentation_span:
+            inputs = self._entrees(volume, centerline_ras, wall_ras,
+                                   rayon_estime=rayon_estime,
+                                   threshold_factor=threshold_factor,
+                                   min_volume_mm3=min_volume_mm3)
+
+            if roi is None and use_roi:
+                roi = self._stage('roi', inputs, lambda: calculerROI(
+                    volume, centerline_ras, wall_ras, rayon_estime), task=task)
+
+            mask_roi, roi = self.segmenterROI(volume, centerline_ras, wall_ras, threshold_factor, rayon_estime,
+                                              min_volume_mm3=min_volume_mm3, roi=roi, task=task)
+            inputs['roi'] = tuple((sl.start, sl.stop) for sl in roi)
+
+            full_shape = volume.shape
+            mask = np.zeros(full_shape, dtype=np.uint8)
+            mask[roi] = mask_roi
+            print(f"After applying the trajectory mask: {np.sum(mask)} remaining voxels")
+
+            full_mask_final = np.zeros(full_shape, dtype=np.uint8)
+            full_mask_final[roi] = self._stage('expander_full', inputs, lambda: expanderSegmentation(
+                mask_roi, volume.array[roi], volume.spacing, threshold_factor, rayon_estime), task=task)
+
+            segmentation_span.set(roi_voxels=mask_roi.size, voxels=int(np.count_nonzero(full_mask_final[roi])))
+        return mask, full_mask_final
+
+    def calculerApercuCoupe(self, volume, centerline_ras, wall_ras, threshold_factor, rayon_estime, slice_index,
+                            task=None):
+        """
+        Fast preview of one axial slice (index k of the volume array) of the lesion segmentation.
+        The pipeline runs on a slab of the ROI centred on the slice, just thick enough for
+        the seed radius and morphological margins; mask statistics and 3D hole filling only
+        see the slab, so the preview can differ slightly from the full-volume result.
+        task: optional BackgroundTask for progress and cancellation.
+        Returns the 2D uint8 mask of the slice.
+        """
+        with span('lesion.preview', slice_index=slice_index, threshold_factor=threshold_factor):
+            preview = np.zeros(volume.shape[1:], dtype=np.uint8)
+
+            inputs = self._entrees(volume, centerline_ras, wall_ras, rayon_estime=rayon_estime)
+            roi = self._stage('roi', inputs, lambda: calculerROI(
+                volume, centerline_ras, wall_ras, rayon_estime), task=task)
+            if roi is None or not (roi[0].start <= slice_index < roi[0].stop):
+                return preview
+
+            margin_k = int(margesROI(volume.spacing, rayon_estime)[0])
+            slab = (slice(max(roi[0].start, slice_index - margin_k), min(roi[0].stop, slice_index + margin_k + 1)),
+                    roi[1], roi[2])
+
+            _, full_mask_final = self.calculerSegmentation(volume, centerline_ras, wall_ras,
+                                                           threshold_factor, rayon_estime, roi=slab, task=task)
+            return full_mask_final[slice_index]
@@ -0,0 +1,27 @@
+import numpy as np
+
+
+def calculerDICE(segmentation, ground_truth):
+    """Calcule le score DICE entre deux masques (tableaux de même forme)"""
+    ground_truth = (ground_truth > 0).astype(np.uint8)
+    segmentation = segmentation.astype(np.uint8)
+
+    intersection = np.sum(segmentation * ground_truth)
+
+    sum_seg = np.sum(segmentation)
+    sum_gt = np.sum(ground_truth)
+
+    dice = (2.0 * intersection) / (sum_seg + sum_gt)
+
+    return dice
+
+
+def calculerVolume(mask, spacing):
+    """Compute the segmented volume from the binary mask and (x, y, z) voxel spacing.
+    Returns volume in mm³, cm³, and number of voxels."""
+    voxel_volume_mm3 = spacing[0] * spacing[1] * spacing[2]
+    n_voxels = int(np.sum(mask > 0))
+    volume_mm3 = n_voxels * voxel_volume_mm3
+    volume_cm3 = volume_mm3 / 1000.0
+    print(f"Volume: {n_voxels} voxels = {volume_mm3:.1f} mm³ = {volume_cm3:.2f} cm³")
+    return volume_mm3, volume_cm3, n_voxels
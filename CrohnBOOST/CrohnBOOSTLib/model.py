@@ -0,0 +1,130 @@
+"""
+Slim inference-only nnU-Net checkpoints:
+
+    python -m CrohnBOOSTLib.model <model_folder> [--folds 0] [--fp16]
+
+A training checkpoint (checkpoint_best.pth) also holds the optimizer and grad scaler state
+and the training logs, and is fully deserialised on every load. The slim artifact
+(fold_X/checkpoint_inference.pth) keeps the network weights (optionally as float16) and
+what nnU-Net needs to rebuild the network. It is loaded with torch.load(mmap=True): the
+weights are paged in from the file instead of being copied into memory first.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+SLIM_CHECKPOINT = 'checkpoint_inference.pth'
+TRAINING_CHECKPOINT = 'checkpoint_best.pth'
+
+
+def choisirCheckpoint(model_folder, use_folds=(0,)):
+    """The slim checkpoint when every fold has one, else the training checkpoint."""
+    if all(os.path.exists(os.path.join(model_folder, f'fold_{fold}', SLIM_CHECKPOINT)) for fold in use_folds):
+        return SLIM_CHECKPOINT
+    return TRAINING_CHECKPOINT
+
+
+def convertirCheckpoint(model_folder, fold=0, checkpoint_name=TRAINING_CHECKPOINT, fp16=False):
+    """
+    Write fold_<fold>/checkpoint_inference.pth from a training checkpoint: network weights
+    (float16 with fp16), trainer name, configuration and mirroring axes. Returns its path.
+    """
+    import torch
+
+    fold_dir = os.path.join(model_folder, f'fold_{fold}')
+    checkpoint = torch.load(os.path.join(fold_dir, checkpoint_name), map_location='cpu', weights_only=False)
+    weights = checkpoint['network_weights']
+    if fp16:
+        weights = {name: tensor.half() if tensor.is_floating_point() else tensor
+                   for name, tensor in weights.items()}
+    slim = {
+        'network_weights': weights,
+        'trainer_name': checkpoint['trainer_name'],
+        'configuration': checkpoint['init_args']['configuration'],
+        'inference_allowed_mirroring_axes': checkpoint.get('inference_allowed_mirroring_axes'),
+    }
+    axes = slim['inference_allowed_mirroring_axes']
+    if axes is not None:
+        slim['inference_allowed_mirroring_axes'] = [int(axis) for axis in axes]
+
+    path = os.path.join(fold_dir, SLIM_CHECKPOINT)
+    tmp = f"{path}.tmp"
+    torch.save(slim, tmp)
+    os.replace(tmp, path)
+    print(f"Slim checkpoint: {path} ({os.path.getsize(path) / 1e6:.0f} MB, "
+          f"training checkpoint {os.path.getsize(os.path.join(fold_dir, checkpoint_name)) / 1e6:.0f} MB)")
+    return path
+
+
+def chargerCheckpointLeger(path):
+    """A slim checkpoint, memory-mapped when PyTorch supports it (2.1+)."""
+    import torch
+
+    try:
+        return torch.load(path, map_location='cpu', weights_only=True, mmap=True)
+    except TypeError:
+        return torch.load(path, map_location='cpu')
+
+
+def initialiserPredicteurLeger(predictor, model_folder, use_folds=(0,)):
+    """
+    initialize_from_trained_model_folder for slim checkpoints: the network is built from the
+    plans like nnU-Net does, and the memory-mapped weights are handed to manual_initialization.
+    """
+    import nnunetv2
+    from batchgenerators.utilities.file_and_folder_operations import load_json
+    from nnunetv2.utilities.find_class_by_name import recursive_find_python_class
+    from nnunetv2.utilities.label_handling.label_handling import determine_num_input_channels
+    from nnunetv2.utilities.plans_handling.plans_handler import PlansManager
+
+    dataset_json = load_json(os.path.join(model_folder, 'dataset.json'))
+    plans_manager = PlansManager(load_json(os.path.join(model_folder, 'plans.json')))
+
+    parameters = []
+    for fold in use_folds:
+        checkpoint = chargerCheckpointLeger(os.path.join(model_folder, f'fold_{fold}', SLIM_CHECKPOINT))
+        if not parameters:
+            trainer_name = checkpoint['trainer_name']
+            configuration_name = checkpoint['configuration']
+            mirroring_axes = checkpoint['inference_allowed_mirroring_axes']
+        parameters.append(checkpoint['network_weights'])
+
+    configuration_manager = plans_manager.get_configuration(configuration_name)
+    num_input_channels = determine_num_input_channels(plans_manager, configuration_manager, dataset_json)
+    trainer_class = recursive_find_python_class(os.path.join(nnunetv2.__path__[0], 'training', 'nnUNetTrainer'),
+                                                trainer_name, 'nnunetv2.training.nnUNetTrainer')
+    if trainer_class is None:
+        raise RuntimeError(f"Unable to locate trainer class {trainer_name}")
+    network = trainer_class.build_network_architecture(
+        configuration_manager.network_arch_class_name,
+        configuration_manager.network_arch_init_kwargs,
+        configuration_manager.network_arch_init_kwargs_req_import,
+        num_input_channels,
+        plans_manager.get_label_manager(dataset_json).num_segmentation_heads,
+        enable_deep_supervision=False)
+
+    predictor.manual_initialization(network, plans_manager, configuration_manager, parameters,
+                                    dataset_json, trainer_name, mirroring_axes)
+    return predictor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m CrohnBOOSTLib.model',
+                                     description="Write slim inference-only checkpoints of an nnU-Net model folder")
+    parser.add_argument('model_folder', help="<trainer>__<plans>__<configuration> folder")
+    parser.add_argument('--folds', type=int, nargs='+', default=[0], help="folds to convert (default: 0)")
+    parser.add_argument('--checkpoint', default=TRAINING_CHECKPOINT, help="training checkpoint name")
+    parser.add_argument('--fp16', action='store_true', help="store the weights as float16")
+    args = parser.parse_args(argv)
+
+    for fold in args.folds:
+        start = time.time()
+        convertirCheckpoint(args.model_folder, fold, args.checkpoint, fp16=args.fp16)
+        print(f"fold {fold} converted in {time.time() - start:.1f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import threading
+import traceback
+
+
+class TaskCancelled(Exception):
+    """Raised by BackgroundTask.checkCancelled() to unwind a cancelled computation."""
+
+
+class BackgroundTask:
+    """
+    Runs function(task) on a daemon thread, for the NumPy/SciPy parts of the pipeline.
+    The function reports progress with task.report() and calls task.checkCancelled()
+    between steps. Qt and MRML objects must only be used from the main thread, so the
+    caller (e.g. the Slicer widget, from a qt.QTimer) polls value/text/finished.
+    """
+
+    def __init__(self, function, maximum=100):
+        self._function = function
+        self._cancelEvent = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.maximum = maximum
+        self.value = 0
+        self.text = ""
+        self.result = None
+        self.error = None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.result = self._function(self)
+        except TaskCancelled:
+            print("Background task cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+
+    def report(self, value, text=None):
+        self.value = value
+        if text is not None:
+            self.text = text
+
+    def cancel(self):
+        self._cancelEvent.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelEvent.is_set()
+
+    def checkCancelled(self):
+        if self._cancelEvent.is_set():
+            raise TaskCancelled()
+
+    @property
+    def finished(self):
+        return self._thread.ident is not None and not self._thread.is_alive()
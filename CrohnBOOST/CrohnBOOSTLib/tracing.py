@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def _valeurAttribut(value):
+    """JSON-friendly attribute: arrays are summarised by shape, dtype and size, never stored."""
+    if isinstance(value, np.ndarray):
+        return {'shape': list(value.shape), 'dtype': str(value.dtype), 'nbytes': int(value.nbytes)}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_valeurAttribut(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class Span:
+    """
+    One timed region: wall time (perf_counter) and process CPU time (includes the
+    worker threads of SciPy / thread pools running meanwhile), nested under the span
+    that was open on the same thread.
+    """
+
+    __slots__ = ('name', 'attributes', 'start', 'duration', 'cpu', 'thread', 'threadName', 'depth', 'parent')
+
+    def __init__(self, name, attributes, parent, depth):
+        self.name = name
+        self.attributes = {}
+        self.set(**attributes)
+        self.parent = parent
+        self.depth = depth
+        thread = threading.current_thread()
+        self.thread = thread.ident
+        self.threadName = thread.name
+        self.start = None
+        self.duration = None
+        self.cpu = None
+
+    def set(self, **attributes):
+        """Add attributes (e.g. voxels=..., shape=...) to the span."""
+        for key, value in attributes.items():
+            self.attributes[key] = _valeurAttribut(value)
+
+    def asDict(self, origin=0.0):
+        return {
+            'name': self.name,
+            'parent': self.parent,
+            'depth': self.depth,
+            'thread': self.threadName,
+            'start': round(self.start - origin, 6),
+            'wall_seconds': round(self.duration, 6),
+            'cpu_seconds': round(self.cpu, 6),
+            'attributes': self.attributes,
+        }
+
+
+class _SpanInactif:
+    """Stand-in yielded when tracing is disabled, so callers can always call span.set()."""
+
+    duration = None
+
+    def set(self, **attributes):
+        pass
+
+
+class Tracer:
+    """
+    Records nested spans of the pipelines, from any thread (BackgroundTask included).
+    Only the last max_spans finished spans are kept. Export with exporterJSON() or
+    exporterChrome() (chrome://tracing, https://ui.perfetto.dev).
+    """
+
+    def __init__(self, enabled=True, max_spans=100000):
+        self.enabled = enabled
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        if not self.enabled:
+            yield _SpanInactif()
+            return
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        current = Span(name, attributes, stack[-1].name if stack else None, len(stack))
+        stack.append(current)
+        current.start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield current
+        except BaseException as e:
+            current.set(error=type(e).__name__)
+            raise
+        finally:
+            current.duration = time.perf_counter() - current.start
+            current.cpu = time.process_time() - cpu_start
+            stack.pop()
+            with self._lock:
+                self._spans.append(current)
+
+    def spans(self):
+        """Finished spans as dictionaries, in start order."""
+        with self._lock:
+            spans = sorted(self._spans, key=lambda s: s.start)
+        return [s.asDict(self.origin) for s in spans]
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+        self.origin = time.perf_counter()
+
+    def resume(self):
+        """Total wall/CPU time and call count per span name, slowest first."""
+        totals = {}
+        for s in self.spans():
+            total = totals.setdefault(s['name'], {'name': s['name'], 'count': 0,
+                                                  'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            total['count'] += 1
+            total['wall_seconds'] += s['wall_seconds']
+            total['cpu_seconds'] += s['cpu_seconds']
+        return sorted(totals.values(), key=lambda t: -t['wall_seconds'])
+
+    def afficherResume(self):
+        for total in self.resume():
+            print(f"{total['name']:<32} {total['count']:5d} x  {total['wall_seconds']:9.3f} s wall"
+                  f"  {total['cpu_seconds']:9.3f} s CPU")
+
+    def exporterJSON(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'spans': self.spans(), 'summary': self.resume()}, f, indent=2)
+
+    def exporterChrome(self, path):
+        """Chrome trace event format: one complete ('X') event per span, times in microseconds."""
+        pid = os.getpid()
+        events = []
+        threads = {}
+        with self._lock:
+            spans = list(self._spans)
+        for s in spans:
+            threads[s.thread] = s.threadName
+            events.append({
+                'name': s.name,
+                'cat': s.name.split('.')[0],
+                'ph': 'X',
+                'ts': (s.start - self.origin) * 1e6,
+                'dur': s.duration * 1e6,
+                'pid': pid,
+                'tid': s.thread,
+                'args': dict(s.attributes, cpu_ms=round(s.cpu * 1e3, 3)),
+            })
+        for tid, name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    """Span on the shared tracer: `with span('lesion.seeds', voxels=n) as s: ...; s.set(kept=k)`."""
+    return TRACER.span(name, **attributes)
@@ -0,0 +1,56 @@
+import hashlib
+
+import numpy as np
+
+
+class VolumeData:
+    """
+    A scalar volume as plain arrays, the input of every CrohnBOOSTLib algorithm.
+    array: voxels indexed (k, j, i), like slicer.util.arrayFromVolume
+    spacing: (x, y, z) voxel size in mm
+    ijkToRAS / rasToIJK: 4x4 numpy matrices (rasToIJK defaults to the inverse of ijkToRAS)
+    key: hashable identity of the voxel data, used in stage cache keys
+    (defaults to a content hash of the array).
+    """
+
+    def __init__(self, array, spacing, ijkToRAS=None, rasToIJK=None, key=None):
+        self.array = array
+        self.spacing = tuple(float(s) for s in spacing)
+        if ijkToRAS is None:
+            ijkToRAS = np.diag(list(self.spacing) + [1.0])
+        self.ijkToRAS = np.asarray(ijkToRAS, dtype=np.float64)
+        if rasToIJK is None:
+            rasToIJK = np.linalg.inv(self.ijkToRAS)
+        self.rasToIJK = np.asarray(rasToIJK, dtype=np.float64)
+        if key is None:
+            key = (array.shape, hashlib.sha1(np.ascontiguousarray(array)).hexdigest())
+        self.key = key
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def sousVolume(self, roi):
+        """VolumeData of a (k, j, i) tuple of slices (a view), with the origin moved to the ROI corner."""
+        offset_ijk = np.array([sl.start for sl in roi][::-1], dtype=np.float64)
+        ijkToRAS = self.ijkToRAS.copy()
+        ijkToRAS[:3, 3] = self.ijkToRAS[:3, :3] @ offset_ijk + self.ijkToRAS[:3, 3]
+        return VolumeData(self.array[roi], self.spacing, ijkToRAS=ijkToRAS,
+                          key=(self.key, tuple((sl.start, sl.stop) for sl in roi)))
+
+    def rasToKJI(self, points_ras):
+        """Nearest (k, j, i) voxel of (N, 3) RAS points (not clipped to the volume)."""
+        points_ras = np.asarray(points_ras, dtype=np.float64).reshape(-1, 3)
+        points_ijk = points_ras @ self.rasToIJK[:3, :3].T + self.rasToIJK[:3, 3]
+        return np.round(points_ijk).astype(int)[:, ::-1]
+
+    def kjiToRAS(self, coords_kji):
+        """RAS position of (N, 3) (k, j, i) voxel coordinates."""
+        return coords_kji[:, ::-1] @ self.ijkToRAS[:3, :3].T + self.ijkToRAS[:3, 3]
+
+
+def pointsFingerprint(points_ras):
+    """Content hash of an (N, 3) point array, used as a stage cache key."""
+    if points_ras is None:
+        return None
+    return hashlib.sha1(np.ascontiguousarray(points_ras, dtype=np.float64)).hexdigest()
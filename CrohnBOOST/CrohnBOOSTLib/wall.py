@@ -0,0 +1,250 @@
+import numpy as np
+
+from .tracing import span
+
+
+def trouverParoi(intensities, debut, fin):
+    if len(intensities) == 0:
+        return None
+
+    if np.all(intensities == 0):
+        return None
+
+    intensity_range = np.max(intensities) - np.min(intensities)
+    if intensity_range == 0:
+        return None
+
+    intensities_norm = (intensities - np.min(intensities)) / intensity_range
+
+    gradients = np.gradient(intensities_norm)
+    grad_threshold = 0.2
+    grad_peaks = np.where(gradients > grad_threshold)[0]
+
+    intensity_threshold = 0.5
+    intensity_peaks = np.where(intensities_norm > intensity_threshold)[0]
+
+    combined_peaks = np.union1d(grad_peaks, intensity_peaks)
+
+    if len(combined_peaks) == 0:
+        return None
+
+    peak_idx = combined_peaks[np.argmax(intensities_norm[combined_peaks])]
+    position_relative = peak_idx / len(intensities)
+
+    return debut + (fin - debut) * position_relative
+
+
+def trouverParoiBatch(intensities):
+    """
+    Matrix version of trouverParoi for a (n_rays, n_samples) block of profiles.
+    Returns the relative wall position (peak index / n_samples) of every ray,
+    or NaN where trouverParoi would return None. Same 0.2 gradient and
+    0.5 intensity thresholds; trouverParoi remains the reference implementation.
+    """
+    intensities = np.asarray(intensities, dtype=np.float64)
+    n_rays, n_samples = intensities.shape
+    positions = np.full(n_rays, np.nan)
+    if n_rays == 0 or n_samples == 0:
+        return positions
+
+    min_int = np.min(intensities, axis=1, keepdims=True)
+    intensity_range = np.max(intensities, axis=1, keepdims=True) - min_int
+    valid = (intensity_range[:, 0] != 0) & ~np.all(intensities == 0, axis=1)
+    if not np.any(valid):
+        return positions
+
+    intensities_norm = (intensities[valid] - min_int[valid]) / intensity_range[valid]
+    gradients = np.gradient(intensities_norm, axis=1)
+
+    grad_threshold = 0.2
+    intensity_threshold = 0.5
+    combined_peaks = (gradients > grad_threshold) | (intensities_norm > intensity_threshold)
+
+    # First index of the brightest peak, as argmax over the sorted union of peaks
+    peak_scores = np.where(combined_peaks, intensities_norm, -np.inf)
+    peak_idx = np.argmax(peak_scores, axis=1).astype(np.float64)
+    peak_idx[~np.any(combined_peaks, axis=1)] = np.nan
+
+    positions[valid] = peak_idx / n_samples
+    return positions
+
+
+def construireRayons(centerline_ras, n_angles, search_distance):
+    """
+    Build the radial rays cast from every centerline point (except the last one).
+    Returns the ray origins (N, 3), ray end points (N, n_angles, 3), the angles
+    and the in-plane perpendicular vector of each point, all in RAS.
+    """
+    p1 = centerline_ras[:-1]
+    vecteurs = centerline_ras[1:] - p1
+    vecteurs = vecteurs / np.linalg.norm(vecteurs, axis=1, keepdims=True)
+    perpendiculaires = np.stack([-vecteurs[:, 1], vecteurs[:, 0], np.zeros(len(vecteurs))], axis=1)
+
+    angles = np.linspace(0, 2*np.pi, n_angles, endpoint=False)
+    cos_a = np.cos(angles)[np.newaxis, :]
+    sin_a = np.sin(angles)[np.newaxis, :]
+    # Rotation of the perpendicular vector around the RAS z axis
+    directions = np.stack([
+        cos_a * perpendiculaires[:, 0:1] - sin_a * perpendiculaires[:, 1:2],
+        sin_a * perpendiculaires[:, 0:1] + cos_a * perpendiculaires[:, 1:2],
+        np.zeros((len(p1), n_angles))
+    ], axis=2)
+
+    ends = p1[:, np.newaxis, :] + directions * search_distance
+    return p1, ends, angles, perpendiculaires
+
+
+def echantillonnerRayons(volume_array, rasToIJK, starts, ends, n_samples=51, sigma=0.5, chunk_points=256):
+    """
+    Sample the volume along every ray, chunk_points centerline points per interpolation call.
+    starts: (N, 3) RAS origins, ends: (N, A, 3) RAS end points, rasToIJK: 4x4 numpy matrix.
+    Returns a (N, A, n_samples) array of linearly interpolated intensities,
+    smoothed along each ray (0 outside the volume).
+    Chunking bounds the RAS/IJK sample coordinates to (chunk_points, A, n_samples, 3)
+    whatever the length of the curve.
+    """
+    from scipy import ndimage
+    from scipy.ndimage import gaussian_filter1d
+
+    t = np.linspace(0.0, 1.0, n_samples)
+    intensities = np.zeros(ends.shape[:-1] + (n_samples,), dtype=np.float64)
+    if n_samples == 0:
+        return intensities
+
+    for first in range(0, len(starts), max(1, chunk_points)):
+        chunk = slice(first, first + max(1, chunk_points))
+        starts_b = starts[chunk, np.newaxis, :]
+        # Ray samples directly in IJK: the RAS-to-IJK transform is affine
+        starts_ijk = starts_b @ rasToIJK[:3, :3].T + rasToIJK[:3, 3]
+        steps_ijk = (ends[chunk] - starts_b) @ rasToIJK[:3, :3].T
+        samples_ijk = starts_ijk[..., np.newaxis, :] + steps_ijk[..., np.newaxis, :] * t[:, np.newaxis]
+
+        # The volume array is indexed (k, j, i)
+        coords = samples_ijk[..., ::-1].reshape(-1, 3).T
+        values = ndimage.map_coordinates(volume_array, coords, output=np.float64,
+                                         order=1, mode='constant', cval=0.0)
+        del samples_ijk, coords
+        intensities[chunk] = gaussian_filter1d(values.reshape(intensities[chunk].shape), sigma=sigma, axis=-1)
+
+    return intensities
+
+
+def interpolerPointsManquants(p1, detected_angles, detected_distances, all_angles, vecteur_perpendiculaire):
+    if len(detected_angles) < 4:
+        return [], []
+
+    detected_set = set(np.round(detected_angles, 4))
+    missing_angles = [a for a in all_angles if round(a, 4) not in detected_set]
+
+    if not missing_angles:
+        return [], []
+
+    sorted_indices = np.argsort(detected_angles)
+    sorted_angles = np.array(detected_angles)[sorted_indices]
+    sorted_distances = np.array(detected_distances)[sorted_indices]
+
+    extended_angles = np.concatenate([
+        sorted_angles - 2 * np.pi,
+        sorted_angles,
+        sorted_angles + 2 * np.pi
+    ])
+    extended_distances = np.concatenate([
+        sorted_distances, sorted_distances, sorted_distances
+    ])
+
+    interpolated_distances = np.interp(missing_angles, extended_angles, extended_distances)
+
+    new_points = []
+    new_distances = []
+    for angle, dist in zip(missing_angles, interpolated_distances):
+        rot_matrix = np.array([
+            [np.cos(angle), -np.sin(angle), 0],
+            [np.sin(angle),  np.cos(angle), 0],
+            [0,              0,              1]
+        ])
+        direction = np.dot(rot_matrix, vecteur_perpendiculaire)
+        direction = direction / np.linalg.norm(direction)
+        new_point = p1 + direction * dist
+        new_points.append(new_point)
+        new_distances.append(dist)
+
+    return new_points, new_distances
+
+
+def detecterPointsParoi(volume, centerline_ras, rayon_estime=6, n_angles=32, n_samples=51, task=None):
+    """
+    Wall points around an (N, 3) RAS centerline in a VolumeData.
+    Now includes max distance outlier rejection per cross-section.
+    All rays (n_angles per centerline point, n_samples per ray) are sampled
+    in one batch before the per-point wall search.
+    task: optional BackgroundTask for progress and cancellation.
+    Returns an (M, 3) RAS array of wall points, or None if detection fails.
+    """
+    centerline_ras = np.asarray(centerline_ras, dtype=np.float64).reshape(-1, 3)
+    if len(centerline_ras) < 2:
+        print("Not enough points to plot the curve.")
+        return None
+
+    with span('wall.detection', centerline_points=len(centerline_ras)) as detection_span:
+        spacing = volume.spacing
+        search_distance = min(20, rayon_estime / min(spacing) * 0.8)
+
+        print(f"Search distance : {search_distance} voxels")
+
+        with span('wall.sampling', n_samples=n_samples) as sampling_span:
+            ray_origins, ray_ends, angles, perpendiculaires = construireRayons(
+                centerline_ras, n_angles, search_distance)
+            sampling_span.set(rays=ray_ends.shape[0] * n_angles)
+
+            if task is not None:
+                task.report(0, f"Sampling {ray_ends.shape[0] * n_angles} rays...")
+            profiles = echantillonnerRayons(volume.array, volume.rasToIJK,
+                                            ray_origins, ray_ends, n_samples=n_samples)
+
+        # Wall position of every ray at once (NaN where no wall is found)
+        with span('wall.search'):
+            positions_relatives = trouverParoiBatch(profiles.reshape(-1, n_samples))
+            positions_relatives = positions_relatives.reshape(profiles.shape[:2])
+            wall_positions = ray_origins[:, np.newaxis, :] + \
+                (ray_ends - ray_origins[:, np.newaxis, :]) * positions_relatives[..., np.newaxis]
+            wall_distances = np.linalg.norm(wall_positions - ray_origins[:, np.newaxis, :], axis=2)
+
+        wall_points = []
+        with span('wall.filter'):
+            for i in range(len(centerline_ras) - 1):
+                if task is not None:
+                    task.checkCancelled()
+                    task.report(i, f"Point analysis {i+1}/{len(centerline_ras)-1}...")
+
+                p1 = ray_origins[i]
+                vecteur_perpendiculaire = perpendiculaires[i]
+
+                detected = ~np.isnan(positions_relatives[i])
+                current_points = list(wall_positions[i, detected])
+                current_distances = list(wall_distances[i, detected])
+                detected_angles = list(angles[detected])
+
+                # Interpolate wall points for missing angular directions
+                if len(detected_angles) >= 4 and len(detected_angles) < len(angles):
+                    new_points, new_distances = interpolerPointsManquants(
+                        p1, detected_angles, current_distances,
+                        angles, vecteur_perpendiculaire)
+                    current_points.extend(new_points)
+                    current_distances.extend(new_distances)
+
+                if len(current_distances) > 0:
+                    median_distance = np.median(current_distances)
+                    distance_threshold_min = median_distance * 0.3
+                    distance_threshold_max = median_distance * 1.8  # ADDED: reject outliers too far
+
+                    for point, distance in zip(current_points, current_distances):
+                        if distance > distance_threshold_min and distance < distance_threshold_max:
+                            wall_points.append(point)
+
+        detection_span.set(wall_points=len(wall_points))
+
+    if len(wall_points) == 0:
+        print("No wall point detected!")
+        return None
+
+    return np.array(wall_points, dtype=np.float64)
@@ -0,0 +1,309 @@
+"""
+Long-lived nnU-Net inference process.
+
+The model stays loaded in the worker between jobs, and a crash or out-of-memory inside
+PyTorch only takes the worker down, not the caller (e.g. the Slicer GUI). Volumes are
+exchanged through multiprocessing.shared_memory: the worker reads the input and writes the
+labels in place through NumPy views, only progress and small messages go through the pipe.
+
+    worker = InferenceWorker().start()
+    job = worker.submit(data, properties, model_folder)    # preparerEntreeNNUNet output
+    ... poll job.value / job.text / job.finished, then job.result (uint8 labels) or job.error
+"""
+
+import gc
+import itertools
+import multiprocessing
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class InferenceJob:
+    """
+    One prediction submitted to an InferenceWorker (or run by CrohnBOOSTLib.predireFile
+    in process). Like BackgroundTask, it is polled:
+    value (0-100) / text give the progress, result (full-size uint8 label array) or
+    error are set once finished is True. info holds the worker's report (device, seconds).
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.maximum = 100
+        self.value = 0
+        self.text = ""
+        self.result = None
+        self.error = None
+        self.info = {}
+        self._done = threading.Event()
+        self._shm = []
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job is finished; returns finished."""
+        return self._done.wait(timeout)
+
+    def finish(self, result=None, error=None):
+        """Set the outcome, free the job's shared memory and mark it finished."""
+        self.result = result
+        self.error = error
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+        self._done.set()
+
+
+class InferenceWorker:
+    """
+    Client of the inference process. Jobs are run one at a time, in submission order;
+    a listener thread updates them from the worker's messages.
+    executable: Python interpreter of the worker (in Slicer, PythonSlicer: sys.executable
+    is the application itself). idle_minutes: the worker drops its model after that long
+    without a job (0 = keep it).
+    """
+
+    def __init__(self, executable=None, idle_minutes=0):
+        self.executable = executable
+        self.idle_minutes = idle_minutes
+        self._process = None
+        self._conn = None
+        self._listener = None
+        self._sendLock = threading.Lock()
+        self._jobsLock = threading.Lock()
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.alive:
+            return self
+        if self._conn is not None:
+            self._conn.close()
+        # spawn: never fork a process holding Qt, VTK or PyTorch threads
+        context = multiprocessing.get_context('spawn')
+        if self.executable:
+            context.set_executable(self.executable)
+        self._conn, child_conn = context.Pipe()
+        # Jobs of this process only: a crashed worker's listener fails its own jobs, not the next worker's
+        self._jobs = {}
+        self._process = context.Process(target=_boucleWorker, args=(child_conn, self.idle_minutes),
+                                        name='CrohnBOOST inference', daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._listener = threading.Thread(target=self._ecouter, args=(self._conn, self._process, self._jobs),
+                                          daemon=True)
+        self._listener.start()
+        print(f"AI inference worker started (pid {self._process.pid})")
+        return self
+
+    def submit(self, data, properties, model_folder, optionsCPU=None, roi=None, shape=None,
+               use_folds=(0,), checkpoint_name=None, normalisation=None):
+        """
+        Queue the prediction of a (1, k, j, i) preparerEntreeNNUNet input.
+        roi: (k, j, i) slices of the full volume the input was cropped from, and shape its
+        (k, j, i) shape; the worker pastes the prediction there (default: the input itself).
+        normalisation: full-volume statistics of a cropped input (statistiquesNormalisation).
+        Returns the InferenceJob.
+        """
+        self.start()
+        if shape is None:
+            shape = data.shape[1:]
+        job = InferenceJob(next(self._ids))
+
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        shm_in = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        shm_out = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+        job._shm = [shm_in, shm_out]
+        np.ndarray(data.shape, dtype=np.float32, buffer=shm_in.buf)[...] = data
+        np.ndarray(shape, dtype=np.uint8, buffer=shm_out.buf)[...] = 0
+
+        message = {
+            'input': shm_in.name, 'input_shape': data.shape,
+            'output': shm_out.name, 'output_shape': tuple(shape),
+            'roi': None if roi is None else tuple((sl.start, sl.stop) for sl in roi),
+            'properties': properties,
+            'model_folder': model_folder,
+            'use_folds': tuple(use_folds),
+            'checkpoint_name': checkpoint_name,
+            'options': None if optionsCPU is None else vars(optionsCPU),
+            'normalisation': normalisation,
+        }
+        with self._jobsLock:
+            self._jobs[job.id] = job
+        try:
+            self._envoyer(('predict', job.id, message))
+        except (OSError, EOFError) as e:
+            with self._jobsLock:
+                self._jobs.pop(job.id, None)
+            job.finish(error=RuntimeError(f"Inference worker unavailable: {e}"))
+        return job
+
+    def preload(self, model_folder, optionsCPU=None, use_folds=(0,), checkpoint_name=None):
+        """Start the worker if needed and have it load the model ahead of the first job."""
+        self.start()
+        self._envoyer(('load', {
+            'model_folder': model_folder,
+            'use_folds': tuple(use_folds),
+            'checkpoint_name': checkpoint_name,
+            'options': None if optionsCPU is None else vars(optionsCPU),
+        }))
+
+    def release(self):
+        """Ask the worker to drop its model (the process keeps running)."""
+        if self.alive:
+            self._envoyer(('release',))
+
+    def stop(self, timeout=5.0):
+        """Stop the worker; jobs still queued fail."""
+        if self._process is None:
+            return
+        if self.alive:
+            try:
+                self._envoyer(('stop',))
+            except (OSError, EOFError):
+                pass
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+        self._conn.close()
+        self._process = None
+        print("AI inference worker stopped")
+
+    def _envoyer(self, message):
+        with self._sendLock:
+            self._conn.send(message)
+
+    def _ecouter(self, conn, process, jobs):
+        """Listener thread: apply the worker's messages to the jobs until the pipe closes."""
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            kind, job_id = message[0], message[1]
+            with self._jobsLock:
+                job = jobs.get(job_id)
+                if job is not None and kind in ('done', 'error'):
+                    del jobs[job_id]
+            if job is None:
+                continue
+            if kind == 'progress':
+                job.value, job.text = message[2], message[3]
+            elif kind == 'done':
+                job.info = message[2]
+                result = np.array(np.ndarray(message[2]['shape'], dtype=np.uint8, buffer=job._shm[1].buf))
+                job.value, job.text = 100, "Done"
+                job.finish(result=result)
+            else:
+                job.finish(error=RuntimeError(message[2]))
+
+        # The worker exited (stopped, crashed or killed by the OS): fail what it still owed
+        process.join(1.0)
+        with self._jobsLock:
+            owed = list(jobs.values())
+            jobs.clear()
+        for job in owed:
+            job.finish(error=RuntimeError(f"Inference worker exited (code {process.exitcode})"))
+
+
+def _boucleWorker(conn, idle_minutes=0):
+    """Worker process entry point: serve predict/load/release/stop messages until stopped."""
+    from .ai import OptionsCPU, choisirDevice, configurerThreadsCPU, creerPredicteur, predireTableau, restaurerThreadsCPU
+    from .model import choisirCheckpoint
+
+    predicteur = None  # (key, predictor)
+
+    def obtenir(job, report=None):
+        """(predictor, device, options, key) of a job, loading the model only when the key changes."""
+        nonlocal predicteur
+        options = OptionsCPU(**job['options']) if job['options'] is not None else None
+        device = choisirDevice()
+        if device.type != 'cpu':
+            options = None
+        elif options is not None:
+            configurerThreadsCPU(options)
+        else:
+            restaurerThreadsCPU()
+
+        checkpoint_name = job['checkpoint_name'] or choisirCheckpoint(job['model_folder'], job['use_folds'])
+        key = (job['model_folder'], job['use_folds'], checkpoint_name, str(device),
+               options.key if options is not None else None)
+        if predicteur is None or predicteur[0] != key:
+            if report is not None:
+                report(10, "Loading AI model...")
+            predicteur = None
+            gc.collect()
+            predicteur = (key, creerPredicteur(job['model_folder'], device, job['use_folds'],
+                                               checkpoint_name, options))
+        return predicteur[1], device, options, key
+
+    last_job = time.time()
+    while True:
+        if predicteur is not None and idle_minutes > 0:
+            if not conn.poll(max(0.0, last_job + idle_minutes * 60.0 - time.time())):
+                print("AI worker idle, releasing the model")
+                predicteur = None
+                gc.collect()
+                continue
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if message[0] == 'stop':
+            break
+        if message[0] == 'release':
+            predicteur = None
+            gc.collect()
+            continue
+        if message[0] == 'load':
+            try:
+                obtenir(message[1])
+                print("AI worker: model loaded")
+            except Exception:
+                traceback.print_exc()
+            last_job = time.time()
+            continue
+
+        _, job_id, job = message
+        start = time.time()
+        shm_in = shm_out = None
+        data = output = None
+        try:
+            predictor, device, options, key = obtenir(
+                job, lambda value, text: conn.send(('progress', job_id, value, text)))
+
+            conn.send(('progress', job_id, 30, "🧠 AI segmentation in progress..."))
+            shm_in = shared_memory.SharedMemory(name=job['input'])
+            shm_out = shared_memory.SharedMemory(name=job['output'])
+            data = np.ndarray(job['input_shape'], dtype=np.float32, buffer=shm_in.buf)
+            prediction = predireTableau(predictor, data, job['properties'], options, job['normalisation'])
+            if predictor.device != device:
+                predicteur = (key[:3] + (str(predictor.device), None), predictor)
+
+            output = np.ndarray(job['output_shape'], dtype=np.uint8, buffer=shm_out.buf)
+            roi = tuple(slice(*bounds) for bounds in job['roi']) if job['roi'] is not None else Ellipsis
+            output[roi] = prediction
+            conn.send(('done', job_id, {'shape': job['output_shape'], 'device': str(predictor.device),
+                                        'seconds': round(time.time() - start, 2)}))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(('error', job_id, f"{type(e).__name__}: {e}"))
+        finally:
+            # The NumPy views must go before their shared memory blocks are closed
+            data = output = None
+            for shm in (shm_in, shm_out):
+                if shm is not None:
+                    shm.close()
+        last_job = time.time()
@@ -0,0 +1,264 @@
+"""
+Headless tests of CrohnBOOSTLib (NumPy and SciPy only, no Slicer):
+
+    python -m pytest CrohnBOOST/Testing/Python/CrohnBOOSTLibTest.py
+    python -m unittest discover -s CrohnBOOST/Testing/Python -p "*Test.py"
+
+The vectorized, ROI and frontier-based implementations are checked against the
+straightforward versions they replaced, which are kept here as references.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+# The module directory is on sys.path inside Slicer; add it for a plain Python run
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import CrohnBOOSTLib  # noqa: E402
+from CrohnBOOSTLib.benchmark import genererFantome  # noqa: E402
+
+
+def _silencieux():
+    """The pipeline prints diagnostics on every step."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def croissanceEllipsoidaleReference(volume_array, wall_ijk, spacing, radius_mm,
+                                    intensity_low, intensity_high, intensity_tolerance, valley_mask):
+    """Per-voxel triple loop of segmenterParRegionSimple before vectorization."""
+    mask = np.zeros(volume_array.shape, dtype=np.uint8)
+    radius_x_vox = int(np.ceil(radius_mm / spacing[0]))
+    radius_y_vox = int(np.ceil(radius_mm / spacing[1]))
+    radius_z_vox = int(np.ceil(radius_mm / spacing[2]))
+    for z, y, x in wall_ijk:
+        ref_intensity = volume_array[z, y, x]
+        for lz in range(max(0, z - radius_z_vox), min(mask.shape[0], z + radius_z_vox + 1)):
+            for ly in range(max(0, y - radius_y_vox), min(mask.shape[1], y + radius_y_vox + 1)):
+                for lx in range(max(0, x - radius_x_vox), min(mask.shape[2], x + radius_x_vox + 1)):
+                    dx = (lx - x) * spacing[0]
+                    dy = (ly - y) * spacing[1]
+                    dz = (lz - z) * spacing[2]
+                    if np.sqrt(dx**2 + dy**2 + dz**2) > radius_mm or valley_mask[lz, ly, lx]:
+                        continue
+                    current_intensity = volume_array[lz, ly, lx]
+                    if (intensity_low <= current_intensity <= intensity_high and
+                            abs(current_intensity - ref_intensity) <= intensity_tolerance):
+                        mask[lz, ly, lx] = 1
+    return mask
+
+
+def remplirTrousReference(mask):
+    """The three full slice loops and the 3D fill, before remplirTrous."""
+    from scipy import ndimage
+
+    mask = np.array(mask, dtype=bool)
+    for z in range(mask.shape[0]):
+        mask[z, :, :] = ndimage.binary_fill_holes(mask[z, :, :])
+    for y in range(mask.shape[1]):
+        mask[:, y, :] = ndimage.binary_fill_holes(mask[:, y, :])
+    for x in range(mask.shape[2]):
+        mask[:, :, x] = ndimage.binary_fill_holes(mask[:, :, x])
+    return ndimage.binary_fill_holes(mask)
+
+
+def expansionReference(mask, volume_array, n_iterations=3, valley_mask=None):
+    """Dilation-based expansion_locale_adjacente."""
+    from scipy import ndimage
+
+    intensities_mask = volume_array[mask > 0]
+    int_min = np.mean(intensities_mask) - 2.5 * np.std(intensities_mask)
+    int_max = np.mean(intensities_mask) + 2.5 * np.std(intensities_mask)
+    result_mask = mask > 0
+    for _ in range(n_iterations):
+        border = ndimage.binary_dilation(result_mask, iterations=1) & ~result_mask
+        valid_border = border & (volume_array >= int_min) & (volume_array <= int_max)
+        if valley_mask is not None:
+            valid_border &= ~valley_mask
+        if not np.any(valid_border):
+            break
+        result_mask = result_mask | valid_border
+    return result_mask.astype(np.uint8)
+
+
+def croissanceGraisseReference(seed_mask, intensity_mask, max_iterations=25, z_iterations=3):
+    """Iterative binary_dilation fat growth of segmenterGraisse, before croissanceGraisse."""
+    from scipy import ndimage
+
+    struct_xy = np.zeros((1, 3, 3), dtype=np.uint8)
+    struct_xy[0, 1, :] = 1
+    struct_xy[0, :, 1] = 1
+    struct_z = np.ones((3, 1, 1), dtype=np.uint8)
+
+    fat_mask = seed_mask.copy()
+    for _ in range(max_iterations):
+        new_mask = (ndimage.binary_dilation(fat_mask, structure=struct_xy) & intensity_mask).astype(np.uint8)
+        if np.array_equal(new_mask, fat_mask):
+            break
+        fat_mask = new_mask
+    for _ in range(z_iterations):
+        new_mask = (ndimage.binary_dilation(fat_mask, structure=struct_z) & intensity_mask).astype(np.uint8)
+        new_mask = new_mask & ndimage.binary_dilation(new_mask, structure=struct_xy, iterations=1)
+        if np.array_equal(new_mask, fat_mask):
+            break
+        fat_mask = new_mask
+    return fat_mask.astype(np.uint8)
+
+
+def normalisationNNUNetReference(array, use_mask_for_norm):
+    """crop_to_nonzero then ZScoreNormalization of nnU-Net's DefaultPreprocessor, as (image, bbox, mask)."""
+    from scipy import ndimage
+
+    mask = ndimage.binary_fill_holes(array != 0)
+    bbox = tuple(slice(int(indices.min()), int(indices.max()) + 1) for indices in np.nonzero(mask))
+    image = array[bbox].astype(np.float32)
+    mask = mask[bbox]
+    selection = mask if use_mask_for_norm else np.ones_like(mask)
+    mean, std = image[selection].mean(), image[selection].std()
+    image[selection] = (image[selection] - mean) / max(std, 1e-8)
+    return image, bbox, mask
+
+
+class CrohnBOOSTLibTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with _silencieux():
+            cls.volume, cls.fat_volume, cls.centerline, cls.fat_points = genererFantome(
+                (24, 128, 128), (0.8, 0.8, 3.0))
+            cls.wall = CrohnBOOSTLib.detecterPointsParoi(cls.volume, cls.centerline)
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_trouverParoiBatch(self):
+        profiles = self.rng.normal(100, 40, (300, 51)).clip(0)
+        profiles[:, 20:26] += 400           # a wall on most rays
+        profiles[10] = 0                    # all zero
+        profiles[11] = 42                   # constant
+        profiles[12] = np.linspace(0, 1, 51)
+        positions = CrohnBOOSTLib.trouverParoiBatch(profiles)
+
+        for profile, position in zip(profiles, positions):
+            expected = CrohnBOOSTLib.trouverParoi(profile, 0.0, 1.0)
+            if expected is None:
+                self.assertTrue(np.isnan(position))
+            else:
+                self.assertAlmostEqual(position, expected, places=12)
+
+    def test_croissanceEllipsoidale(self):
+        spacing = (0.8, 0.8, 3.0)
+        for dtype in (np.float32, np.uint16):
+            volume_array = self.rng.integers(0, 600, (12, 40, 40)).astype(dtype)
+            valley_mask = volume_array < 60
+            wall_ijk = np.stack([self.rng.integers(0, n, 25) for n in volume_array.shape], axis=1)
+            arguments = (volume_array, wall_ijk, spacing, 4.2, 100.0, 500.0, 150.0, valley_mask)
+
+            with _silencieux():
+                mask = CrohnBOOSTLib.lesion.croissanceEllipsoidale(*arguments, batch_size=7)
+            # uint16 intensity differences wrap around in both versions
+            with np.errstate(over='ignore'):
+                reference = croissanceEllipsoidaleReference(*arguments)
+            np.testing.assert_array_equal(mask, reference)
+
+    def test_remplirTrous(self):
+        from scipy import ndimage
+
+        mask = np.zeros((20, 48, 40), dtype=bool)
+        mask[3:15, 5:40, 4:30] = ndimage.binary_erosion(self.rng.random((12, 35, 26)) > 0.3)
+        mask[5:10, 10:20, 10:20] = True
+        mask[6:9, 12:18, 12:18] = False      # a closed cavity
+        with _silencieux():
+            filled = CrohnBOOSTLib.remplirTrous(mask, max_workers=4)
+        np.testing.assert_array_equal(filled, remplirTrousReference(mask))
+
+    def test_expansion_locale_adjacente(self):
+        volume_array = self.rng.normal(300, 60, (16, 48, 48))
+        mask = np.zeros(volume_array.shape, dtype=np.uint8)
+        mask[6:10, 20:28, 20:28] = 1
+        valley_mask = volume_array < 180
+        for valley in (None, valley_mask):
+            with _silencieux():
+                expanded = CrohnBOOSTLib.expansion_locale_adjacente(mask, volume_array, 3, valley)
+            np.testing.assert_array_equal(expanded, expansionReference(mask, volume_array, 3, valley))
+
+    def test_croissanceGraisse(self):
+        intensity_mask = (self.rng.random((18, 50, 50)) > 0.35).astype(np.uint8)
+        seed_mask = np.zeros(intensity_mask.shape, dtype=np.uint8)
+        seed_mask[tuple(self.rng.integers(0, 18, 4)), tuple(self.rng.integers(0, 50, 4)),
+                  tuple(self.rng.integers(0, 50, 4))] = 1
+        seed_mask[9, 25, 25] = 1
+        for max_iterations, z_iterations in ((25, 3), (4, 2), (25, 12)):
+            with _silencieux():
+                grown = CrohnBOOSTLib.croissanceGraisse(seed_mask, intensity_mask, max_iterations, z_iterations)
+            np.testing.assert_array_equal(
+                grown, croissanceGraisseReference(seed_mask, intensity_mask, max_iterations, z_iterations))
+
+    def test_segmentation_roi(self):
+        self.assertIsNotNone(self.wall)
+        for threshold_factor in (0.2, 0.8):
+            with _silencieux():
+                mask_roi, final_roi = CrohnBOOSTLib.LesionPipeline().calculerSegmentation(
+                    self.volume, self.centerline, self.wall, threshold_factor, use_roi=True)
+                mask_full, final_full = CrohnBOOSTLib.LesionPipeline().calculerSegmentation(
+                    self.volume, self.centerline, self.wall, threshold_factor, use_roi=False)
+            self.assertGreater(np.count_nonzero(final_full), 0)
+            np.testing.assert_array_equal(mask_roi, mask_full)
+            np.testing.assert_array_equal(final_roi, final_full)
+
+    def test_normalisation_roi(self):
+        array = np.zeros((28, 136, 136), dtype=np.float32)
+        array[2:-2, 4:-4, 4:-4] = self.volume.array      # zero background around the body
+        volume = CrohnBOOSTLib.VolumeData(array, self.volume.spacing)
+        roi = (slice(6, 20), slice(30, 90), slice(40, 110))
+        for use_mask_for_norm in (False, True):
+            statistiques = CrohnBOOSTLib.statistiquesNormalisation(
+                volume, ['ZScoreNormalization'], [use_mask_for_norm])
+            reference, bbox, mask = normalisationNNUNetReference(array, use_mask_for_norm)
+            crop = tuple(slice(r.start - b.start, r.stop - b.start) for r, b in zip(roi, bbox))
+
+            image = array[roi].astype(np.float32)
+            normalised = CrohnBOOSTLib.normaliserZScore(image, mask[crop] if use_mask_for_norm else None, statistiques)
+            np.testing.assert_allclose(normalised, reference[crop], rtol=1e-5, atol=1e-5)
+        self.assertIsNone(CrohnBOOSTLib.statistiquesNormalisation(volume, ['CTNormalization'], [False]))
+
+    def test_stage_cache(self):
+        pipeline = CrohnBOOSTLib.LesionPipeline()
+        with _silencieux():
+            _, first = pipeline.calculerSegmentation(self.volume, self.centerline, self.wall, 0.5)
+            pipeline.calculerSegmentation(self.volume, self.centerline, self.wall, 0.7)
+            _, again = pipeline.calculerSegmentation(self.volume, self.centerline, self.wall, 0.5)
+        np.testing.assert_array_equal(first, again)
+        self.assertGreater(pipeline.stageCache.hits, 0)
+        self.assertLessEqual(pipeline.stageCache.total_bytes, pipeline.stageCache.max_bytes)
+
+    def test_preparerChampDistance(self):
+        from unittest import mock
+
+        pipeline = CrohnBOOSTLib.LesionPipeline()
+        with _silencieux():
+            roi = pipeline.preparerChampDistance(self.volume, self.centerline, self.wall, 6)
+            self.assertIsNotNone(roi)
+            # The segmentation and a preview slab only crop the prepared field
+            with mock.patch.object(CrohnBOOSTLib.lesion, 'calculerChampDistance',
+                                   side_effect=AssertionError("distance field rebuilt")):
+                pipeline.calculerApercuCoupe(self.volume, self.centerline, self.wall, 0.5, 6,
+                                             (roi[0].start + roi[0].stop) // 2)
+                _, final = pipeline.calculerSegmentation(self.volume, self.centerline, self.wall, 0.5, 6)
+        self.assertGreater(np.count_nonzero(final), 0)
+
+    def test_segmenterGraisse(self):
+        with _silencieux():
+            _, lesion_mask = CrohnBOOSTLib.LesionPipeline().calculerSegmentation(
+                self.volume, self.centerline, self.wall, 0.5)
+            fat_mask = CrohnBOOSTLib.segmenterGraisse(self.fat_volume, self.fat_points, lesion_mask=lesion_mask)
+        self.assertGreater(np.count_nonzero(fat_mask), 0)
+        self.assertEqual(np.count_nonzero(fat_mask & lesion_mask), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()